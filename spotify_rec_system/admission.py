@@ -0,0 +1,87 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class AdmissionController:
+    """
+    推荐计算的准入控制：最多 max_concurrent 个同时执行，另有 max_queue 个可短暂等待。
+    等待队列已满或等待超过 queue_timeout 秒时立即拒绝 (shed)，由调用方降级为廉价结果，
+    而不是让请求无限排队、把全库检索堆在同一批 CPU 上。
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 8, queue_timeout: float = 0.2):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        # 计数器
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self._running < self.max_concurrent and not self._waiting:
+                self._running += 1
+                self.admitted += 1
+                return True
+            if self._waiting >= self.max_queue:
+                self.shed_queue_full += 1
+                return False
+            self._waiting += 1
+            self.queued += 1
+            start = time.perf_counter()
+            deadline = start + self.queue_timeout
+            try:
+                while self._running >= self.max_concurrent:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.shed_timeout += 1
+                        return False
+                    self._cond.wait(remaining)
+                self._running += 1
+                self.admitted += 1
+                return True
+            finally:
+                self._waiting -= 1
+                waited = time.perf_counter() - start
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """with controller.slot() as admitted: admitted 为 False 时调用方应走降级路径。"""
+        admitted = self.try_acquire()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'waiting': self._waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed_queue_full': self.shed_queue_full,
+                'shed_timeout': self.shed_timeout,
+                'shed': self.shed_queue_full + self.shed_timeout,
+                'queue_wait_ms_avg': round(self.wait_seconds_total / self.queued * 1000, 2) if self.queued else 0.0,
+                'queue_wait_ms_max': round(self.wait_seconds_max * 1000, 2),
+            }
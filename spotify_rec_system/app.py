@@ -1,18 +1,31 @@
 import os
 import uuid
 import json
+import hashlib
+import hmac
+import io
 import urllib.parse
 # Fix for OpenMP runtime error on Windows
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
-from flask import Flask, session, request, redirect, render_template, url_for, jsonify
+from flask import Flask, session, request, redirect, render_template, url_for, jsonify, g, Response
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials
+from spotipy.cache_handler import MemoryCacheHandler
 import time
 import pandas as pd
 import threading
 from dotenv import load_dotenv
 from infra import EventProducer, RedisFeatureStore
+from session_profile import SessionVectorStore
+from spotify_fetch import SpotifyFetcher
+from metadata_cache import TwoTierCache
+from playlist_cache import PlaylistSeedCache
+from jobs import JobQueue, JobQueueFull
+from admission import AdmissionController
+import metrics
+import memstat
+from profiler import RequestProfiler
 # from recommender import ContentBasedRecommender  <-- Moved to inside init_model_background
 
 # Load environment variables
@@ -20,7 +33,8 @@ load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
-app.config['SESSION_COOKIE_NAME'] = 'Spotify Cookie'
+# 默认名称含空格，部分 HTTP 客户端 (如 requests) 不会回传；压测时可通过 SESSION_COOKIE_NAME 改名
+app.config['SESSION_COOKIE_NAME'] = os.getenv('SESSION_COOKIE_NAME', 'Spotify Cookie')
 
 # Initialize Recommender Engine (Global Instance)
 # 使用后台线程初始化，避免阻塞 Flask 启动
@@ -28,91 +42,407 @@ global_recommender = None
 is_model_ready = False
 is_training_started = False # 新增标志位
 init_progress = {'percent': 0, 'message': '等待初始化...'}
+# 启动耗时分解 (秒)，由 /readyz 输出；init_error 记录初始化失败原因
+startup_timings = {}
+init_started_at = None
+init_finished_at = None
+init_error = None
+_init_lock = threading.Lock()
+# lazy: 首次轮询 /status 时才开始加载 (默认)；eager: 进程启动即在后台加载
+RECOMMENDER_WARMUP = os.getenv('RECOMMENDER_WARMUP', 'lazy').strip().lower()
+# 管理接口 (/admin/*) 令牌；未配置时只允许本机访问
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '').strip()
+# 引擎未就绪 (加载/训练中) 时入库的歌曲 id，引擎最终就绪后再编入索引
+pending_ingest_ids = []
+_ingest_lock = threading.Lock()
 
 # 近线/在线：Kafka 行为事件 & Redis 缓存
 event_producer = EventProducer()
 feature_store = RedisFeatureStore()
+# 会话兴趣向量 (Redis 优先，未配置时进程内缓存)
+session_vectors = SessionVectorStore(feature_store)
+# 在线重排：近线聚合的共现 / 窗口热度信号的权重，以及内容召回的候选数 (见 rerank_with_nearline)
+NEARLINE_COVIEW_WEIGHT = float(os.getenv('REC_NEARLINE_COVIEW_WEIGHT', '0.3'))
+NEARLINE_POPULARITY_WEIGHT = float(os.getenv('REC_NEARLINE_POPULARITY_WEIGHT', '0.1'))
+NEARLINE_CANDIDATES = int(os.getenv('REC_NEARLINE_CANDIDATES', '30'))
+# Spotify Web API 抓取层 (连接池 + 并发分页 + 429 退避)
+# 歌曲/歌手元数据走两级缓存：内存 LRU -> 本地 SQLite，重复的结果页/详情页不再调用 API
+spotify_fetcher = SpotifyFetcher(cache=TwoTierCache(
+    disk_path=os.getenv('SPOTIFY_META_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'model_cache', 'spotify_meta.sqlite')),
+    memory_size=int(os.getenv('SPOTIFY_META_CACHE_SIZE', '5000')),
+))
+# 歌单快照 (playlist_id + snapshot_id) -> 已解析的种子行号
+playlist_seed_cache = PlaylistSeedCache(feature_store)
+# 歌单推荐后台任务队列 (有界线程池 + 等待上限，相同任务执行期间去重)
+recommendation_jobs = JobQueue(
+    max_workers=int(os.getenv('REC_JOB_WORKERS', '2')),
+    max_pending=int(os.getenv('REC_JOB_QUEUE_SIZE', '32')),
+)
+# 全库检索的准入控制：超出并发上限的请求短暂排队，排不上则降级为预排好的热门歌曲
+recommendation_admission = AdmissionController(
+    max_concurrent=int(os.getenv('REC_MAX_CONCURRENCY', str(os.cpu_count() or 2))),
+    max_queue=int(os.getenv('REC_ADMISSION_QUEUE', '8')),
+    queue_timeout=float(os.getenv('REC_ADMISSION_TIMEOUT_MS', '200')) / 1000.0,
+)
+# 慢请求剖析 (PROFILER_MODE=sample/cprofile 时启用)：超过阈值的请求调用栈写入环形目录，/admin/profiles 查看
+request_profiler = RequestProfiler.from_env()
 
 def update_progress(percent, message):
     global init_progress
     init_progress['percent'] = percent
     init_progress['message'] = message
 
-def init_model_background():
+def record_stage_timing(stage, seconds):
+    startup_timings[stage] = round(seconds, 3)
+
+def mark_model_ready(engine):
+    """引擎可提供服务 (临时索引或最终索引) 时调用：登记为共享引擎并放行被拦截的页面。"""
     global global_recommender, is_model_ready
+    from recommender import ContentBasedRecommender
+    # 登记为进程内共享引擎，其他路由通过 get_instance 复用，不再重复构建
+    ContentBasedRecommender.register_instance(engine)
+    with _init_lock:
+        # 先发布引擎再置位：读到 is_model_ready 为 True 的请求一定能拿到引擎
+        global_recommender = engine
+        is_model_ready = True
+    if engine.is_interim:
+        print("[SYSTEM] 临时索引已就绪，训练完成前提供近似推荐")
+    else:
+        apply_pending_ingest(engine)
+
+def apply_pending_ingest(engine):
+    """
+    把引擎就绪前 (或编入失败时) 入库的歌曲编入索引 (引擎构建时已读到的行按更新处理，结果一致)。
+    再次失败时放回待编入队列，等下一次入库或引擎就绪时重试。
+    """
+    with _ingest_lock:
+        ids = list(dict.fromkeys(pending_ingest_ids))
+        pending_ingest_ids.clear()
+    if not ids:
+        return
+    try:
+        from dataset_service import SpotifyDataset
+        df = SpotifyDataset.get_instance().get_dataframe()
+        result = engine.ingest(df.loc[df.index.intersection(ids)])
+        print(f"[SYSTEM] 已补充编入就绪前入库的歌曲: {result}")
+    except Exception as e:
+        print(f"[WARN] 补充编入入库歌曲失败: {e}")
+        with _ingest_lock:
+            pending_ingest_ids[:0] = ids
+
+def init_model_background():
+    global init_started_at, init_finished_at, init_error
     print("="*50)
     print("[SYSTEM] 正在初始化全局推荐引擎 (后台运行)...")
+    init_started_at = time.time()
+    init_error = None
     try:
         # Lazy import to prevent startup crashes due to Torch/OpenMP conflicts
+        import_start = time.perf_counter()
         from recommender import ContentBasedRecommender
+        record_stage_timing('imports', time.perf_counter() - import_start)
         
-        global_recommender = ContentBasedRecommender(progress_callback=update_progress)
-        is_model_ready = True
-        print("[SYSTEM] 全局推荐引擎初始化完成！")
+        # 需要训练时，临时索引建好即通过 ready_callback 提前就绪，训练完成后引擎内部切换为 Autoencoder 向量
+        engine = ContentBasedRecommender(progress_callback=update_progress,
+                                         timing_callback=record_stage_timing,
+                                         ready_callback=mark_model_ready)
+        mark_model_ready(engine)
+        print(f"[SYSTEM] 全局推荐引擎初始化完成！耗时分解: {startup_timings}")
     except Exception as e:
         print(f"[ERROR] 初始化失败: {e}")
         import traceback
         traceback.print_exc()
+        init_error = str(e)
         update_progress(0, f"初始化失败: {str(e)}")
+    finally:
+        init_finished_at = time.time()
+        record_stage_timing('total', init_finished_at - init_started_at)
     print("="*50)
 
-# 移除自动启动，改为在 /status 请求时触发
-# init_thread = threading.Thread(target=init_model_background)
-# init_thread.start()
+def start_model_init():
+    """启动后台初始化线程 (进程内只启动一次)。"""
+    global is_training_started
+    with _init_lock:
+        if is_training_started or is_model_ready:
+            return
+        is_training_started = True
+    threading.Thread(target=init_model_background, name='model-init', daemon=True).start()
+
+# 默认在 /status 首次请求时触发；RECOMMENDER_WARMUP=eager 时进程启动即开始加载
+if RECOMMENDER_WARMUP == 'eager':
+    start_model_init()
 
 @app.route('/status')
 def get_status():
-    global is_training_started
-    
     # 当前端 loading 页面第一次轮询状态时，才启动训练线程
     # 这样可以确保用户已经看到了 loading 页面
-    if not is_training_started and not is_model_ready:
-        is_training_started = True
-        threading.Thread(target=init_model_background).start()
+    start_model_init()
         
     return jsonify({
         'ready': is_model_ready,
         'progress': init_progress
     })
 
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程能处理请求即返回 200，不依赖模型状态。"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：推荐引擎可用时返回 200，否则 503；附带启动各阶段耗时。"""
+    if is_model_ready:
+        state = 'ready'
+    elif init_error:
+        state = 'failed'
+    elif is_training_started:
+        state = 'loading'
+    else:
+        state = 'idle'
+    body = {
+        'ready': is_model_ready,
+        'state': state,
+        'interim': bool(global_recommender and global_recommender.is_interim),
+        'embedding_space': global_recommender.embedding_space if global_recommender else None,
+        'singleflight': global_recommender.inflight_stats() if global_recommender else None,
+        'frontier': global_recommender.frontier_stats() if global_recommender else None,
+        'admission': recommendation_admission.stats(),
+        'warmup': RECOMMENDER_WARMUP,
+        'progress': init_progress,
+        'timings': dict(startup_timings),
+        'memory': dict(global_recommender.stage_memory) if global_recommender else None,
+        'error': init_error,
+    }
+    if init_started_at and not init_finished_at:
+        body['elapsed'] = round(time.time() - init_started_at, 3)
+    return jsonify(body), (200 if is_model_ready else 503)
+
+def admin_authorized():
+    """管理接口鉴权：配置了 ADMIN_TOKEN 时校验 X-Admin-Token 头，否则只允许本机访问。"""
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+def read_ingest_payload():
+    """入库数据：multipart 文件 (file) / JSON {"tracks": [...]} / 请求体直接为 CSV。"""
+    if 'file' in request.files:
+        return pd.read_csv(request.files['file'])
+    if request.is_json:
+        data = request.get_json() or {}
+        tracks = data.get('tracks') if isinstance(data, dict) else data
+        return pd.DataFrame(tracks or [])
+    return pd.read_csv(io.StringIO(request.get_data(as_text=True)))
+
+@app.route('/admin/ingest', methods=['POST'])
+def admin_ingest():
+    """
+    增量入库：把新增/更新的歌曲合入运行中的数据集并编入推荐索引，无需重启。
+    数据集部分立即生效 (列表/搜索/详情)；推荐引擎未就绪时先记下，就绪后自动补充编入。
+    """
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'unauthorized'}), 403
+    try:
+        delta = read_ingest_payload()
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'无法解析入库数据: {e}'}), 400
+
+    from dataset_service import SpotifyDataset
+    try:
+        rows, added, updated = SpotifyDataset.get_instance().ingest(delta)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    body = {'status': 'ok', 'added': len(added), 'updated': len(updated), 'index': None}
+
+    engine = global_recommender
+    indexed = failed = False
+    if is_model_ready and engine is not None and not engine.is_interim and len(rows):
+        try:
+            body['index'] = engine.ingest(rows)
+            indexed = True
+        except RuntimeError as e:
+            print(f"[WARN] 入库歌曲暂未编入索引: {e}")
+        except Exception as e:
+            # 数据集增量已生效并落盘，不能回滚成 500：记为待编入，下次入库或重启时重试
+            failed = True
+            body['index_error'] = f'{type(e).__name__}: {e}'
+            print(f"[WARN] 入库歌曲编入索引失败，已记为待编入: {e}")
+    if not indexed and len(rows):
+        with _ingest_lock:
+            pending_ingest_ids.extend(rows.index)
+        body['index'] = 'pending'
+        # 入库期间引擎恰好完成就绪时，由这里补一次
+        engine = global_recommender
+        if not failed and is_model_ready and engine is not None and not engine.is_interim:
+            apply_pending_ingest(engine)
+    elif indexed and pending_ingest_ids:
+        # 之前编入失败的歌曲随这次入库重试
+        apply_pending_ingest(engine)
+    return jsonify(body)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 抓取接口：各阶段耗时直方图、缓存/回退/外部依赖计数，以及准入控制等现有统计。"""
+    extra = metrics.gauge_lines('rec_admission', '全库检索准入控制状态', recommendation_admission.stats())
+    extra += metrics.gauge_lines('rec_jobs', '推荐后台任务队列状态', recommendation_jobs.stats())
+    if request_profiler.enabled:
+        extra += metrics.gauge_lines('rec_profiler', '慢请求剖析统计', request_profiler.stats())
+    engine = global_recommender
+    if engine is not None:
+        extra += metrics.gauge_lines('rec_singleflight', '相同检索请求合并统计', engine.inflight_stats())
+        extra += metrics.gauge_lines('rec_frontier', '歌单候选前沿统计', engine.frontier_stats())
+    extra += metrics.gauge_lines('rec_model', '推荐引擎状态', {
+        'ready': int(is_model_ready),
+        'interim': int(bool(engine and engine.is_interim)),
+        'rows': len(engine.df) if engine is not None and engine.df is not None else 0,
+    })
+    extra += metrics.gauge_lines('rec_memory_mb', '进程常驻内存 (MB)：当前值与进程峰值', {
+        'rss': memstat.rss_mb(),
+        'peak': memstat.process_peak_rss_mb(),
+    })
+    return Response(metrics.render(extra), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """慢请求剖析列表 (最新在前)：耗时、路由、最热的函数。"""
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'unauthorized'}), 403
+    return jsonify({
+        'mode': request_profiler.mode,
+        'threshold_ms': request_profiler.threshold * 1000,
+        'stats': request_profiler.stats(),
+        'profiles': request_profiler.list_profiles(),
+    })
+
+@app.route('/admin/profiles/<name>')
+def admin_profile_detail(name):
+    """单个剖析的完整内容；?format=prof 下载 cProfile 原始文件，?format=collapsed 输出折叠栈文本。"""
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'unauthorized'}), 403
+    fmt = request.args.get('format', 'json')
+    if fmt == 'prof':
+        path = request_profiler.prof_path(name)
+        if path is None:
+            return jsonify({'status': 'error', 'message': 'not found'}), 404
+        with open(path, 'rb') as f:
+            return Response(f.read(), mimetype='application/octet-stream',
+                            headers={'Content-Disposition': f'attachment; filename={name}.prof'})
+    record = request_profiler.load(name)
+    if record is None:
+        return jsonify({'status': 'error', 'message': 'not found'}), 404
+    if fmt == 'collapsed':
+        return Response('\n'.join(record.get('collapsed', [])) + '\n', mimetype='text/plain')
+    return jsonify(record)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_profile = request_profiler.start(request.endpoint, request.path)
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc):
+    # 放在 teardown 中，视图抛异常时也能结束采样并保留剖析
+    handle = g.pop('request_profile', None)
+    if handle is not None:
+        request_profiler.finish(handle, method=request.method, query=request.query_string.decode('utf-8', 'replace'),
+                                status=g.get('response_status', 500), error=repr(exc) if exc else None)
+
 @app.before_request
 def check_model_ready():
     # 允许静态资源和状态检查请求通过
-    if request.endpoint in ['static', 'get_status', 'songs', 'api_songs', 'api_songs_recommendations', 'song_detail', 'log_event']:
+    if request.endpoint in ['static', 'get_status', 'healthz', 'readyz', 'metrics_endpoint', 'admin_ingest', 'admin_profiles', 'admin_profile_detail', 'songs', 'api_songs', 'api_songs_recommendations', 'song_detail', 'log_event', 'job_status']:
         return
     
     # 如果模型未就绪，拦截所有页面请求并显示加载页
     if not is_model_ready:
         return render_template('loading.html')
 
+def run_admitted(compute, degrade, label):
+    """在准入控制下执行全库检索；被拒绝时返回 degrade() 的廉价结果。"""
+    with recommendation_admission.slot() as admitted:
+        if admitted:
+            return compute()
+    print(f"[WARN] 推荐计算繁忙 ({label})，降级为热门歌曲")
+    return degrade()
+
+def record_session_interaction(client_id, track_id):
+    """将一次交互累加进会话兴趣向量 (O(32))，模型未就绪时跳过。"""
+    engine = global_recommender
+    if not (is_model_ready and engine and client_id and track_id):
+        return
+    vector = engine.get_embedding(track_id)
+    if vector is not None:
+        session_vectors.update(client_id, engine.embedding_space, vector)
+
 # Spotify Configuration
 # Ensure no whitespace issues
 SPOTIPY_CLIENT_ID = os.getenv('SPOTIPY_CLIENT_ID', '').strip()
 SPOTIPY_CLIENT_SECRET = os.getenv('SPOTIPY_CLIENT_SECRET', '').strip()
-SPOTIPY_REDIRECT_URI = 'http://127.0.0.1:5000/callback'
+SPOTIPY_REDIRECT_URI = os.getenv('SPOTIPY_REDIRECT_URI', 'http://127.0.0.1:5000/callback').strip()
 SCOPE = 'user-library-read playlist-read-private playlist-read-collaborative user-read-private user-read-email'
+# 压测/联调时可指向本地 Mock (mock_spotify.py)：账号服务 (授权/换取 token) 与 Web API 地址
+SPOTIFY_ACCOUNTS_BASE = os.getenv('SPOTIFY_ACCOUNTS_BASE', '').strip().rstrip('/')
+SPOTIFY_API_BASE = os.getenv('SPOTIFY_API_BASE', '').strip().rstrip('/')
+
+def use_spotify_endpoints(auth_manager):
+    """配置了 SPOTIFY_ACCOUNTS_BASE 时，把 spotipy 的授权/换取 token 地址改为该服务。"""
+    if SPOTIFY_ACCOUNTS_BASE:
+        if hasattr(auth_manager, 'OAUTH_AUTHORIZE_URL'):
+            auth_manager.OAUTH_AUTHORIZE_URL = f"{SPOTIFY_ACCOUNTS_BASE}/authorize"
+        auth_manager.OAUTH_TOKEN_URL = f"{SPOTIFY_ACCOUNTS_BASE}/api/token"
+    return auth_manager
+
+def spotify_api_client(**kwargs):
+    """spotipy 客户端；配置了 SPOTIFY_API_BASE 时请求发往该地址。"""
+    sp = spotipy.Spotify(**kwargs)
+    if SPOTIFY_API_BASE:
+        sp.prefix = SPOTIFY_API_BASE + '/'
+    return sp
 
 def create_spotify_oauth():
-    return SpotifyOAuth(
+    return use_spotify_endpoints(SpotifyOAuth(
         client_id=SPOTIPY_CLIENT_ID,
         client_secret=SPOTIPY_CLIENT_SECRET,
         redirect_uri=SPOTIPY_REDIRECT_URI,
         scope=SCOPE
-    )
+    ))
+
+_spotify_client = None
+_spotify_client_lock = threading.Lock()
 
 def get_spotify_client():
     """
     Get a Spotify client using Client Credentials Flow.
     This is better for fetching public data (like audio features) 
     as it is less likely to run into user-specific permission issues.
+
+    进程内共享一个客户端；token 保存在内存 (MemoryCacheHandler) 中并在过期前复用，
+    不会落盘，也不会每个请求都重新换取 token。
     """
-    # Disable cache to prevent using stale tokens
-    client_credentials_manager = SpotifyClientCredentials(
-        client_id=SPOTIPY_CLIENT_ID,
-        client_secret=SPOTIPY_CLIENT_SECRET,
-        cache_handler=None
-    )
-    return spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+    global _spotify_client
+    if _spotify_client is None:
+        with _spotify_client_lock:
+            if _spotify_client is None:
+                client_credentials_manager = use_spotify_endpoints(SpotifyClientCredentials(
+                    client_id=SPOTIPY_CLIENT_ID,
+                    client_secret=SPOTIPY_CLIENT_SECRET,
+                    cache_handler=MemoryCacheHandler()
+                ))
+                _spotify_client = spotify_api_client(client_credentials_manager=client_credentials_manager)
+    return _spotify_client
+
+def get_app_token():
+    """Client Credentials 的 access token (缓存命中时不发请求)。"""
+    return get_spotify_client().auth_manager.get_access_token(as_dict=False)
 
 @app.route('/')
 def index():
@@ -138,15 +468,13 @@ def songs():
 def api_songs():
     page_size = min(int(request.args.get('limit', 50)), 200)
     page = max(int(request.args.get('page', 1)), 1)
-    page = int(request.args.get('page', 1))
-    page = max(page, 1)  # Ensure page is at least 1
+    genre = request.args.get('genre')
     year = request.args.get('year')
     search = request.args.get('q')
 
     sort_by = request.args.get('sort', 'popularity')  # Default sort by popularity
     from dataset_service import SpotifyDataset
     dataset = SpotifyDataset.get_instance()
-    tracks, total = dataset.list_tracks(limit=page_size, offset=(page - 1) * page_size, genre=genre, year=year, search=search)
     tracks, total = dataset.list_tracks(
         limit=page_size,
         offset=(page - 1) * page_size,
@@ -184,8 +512,11 @@ def song_detail(track_id):
 
     # 记录点击行为 + 会话 seeds，便于实时推荐
     try:
+        if 'client_id' not in session:
+            session['client_id'] = str(uuid.uuid4())
         event_producer.send_event('track_view_offline', {
             'track_id': track_id,
+            'client_id': session.get('client_id'),
             'ts': int(time.time()),
             'source': 'songs_list'
         })
@@ -195,6 +526,7 @@ def song_detail(track_id):
         recent = [t for t in recent if t != track_id]
         recent.insert(0, track_id)
         session['recent_track_ids'] = recent[:20]
+        record_session_interaction(session['client_id'], track_id)
         if feature_store and feature_store.enabled and session.get('client_id'):
             try:
                 key = feature_store._key('recent', session['client_id'])
@@ -239,6 +571,7 @@ def log_event():
         if 'client_id' not in session:
             session['client_id'] = str(uuid.uuid4())
         client_id = session.get('client_id')
+        payload['client_id'] = client_id
 
         # 即时会话内记录最近点击/反馈，便于在线侧实时推荐（不依赖后端流）
         track_id = payload.get('track_id')
@@ -248,6 +581,7 @@ def log_event():
             recent = [t for t in recent if t != track_id]
             recent.insert(0, track_id)
             session['recent_track_ids'] = recent[:20]
+            record_session_interaction(client_id, track_id)
 
         # Redis 近线缓存：记录最近 100 条交互，TTL 1 小时
         if feature_store and feature_store.enabled and client_id:
@@ -266,22 +600,97 @@ def log_event():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+def parse_rec_filters(args):
+    """从查询参数解析检索过滤条件：genre、year_min / year_max、min_popularity。"""
+    def to_number(name, cast):
+        value = args.get(name, '').strip()
+        try:
+            return cast(value) if value else None
+        except ValueError:
+            return None
+
+    year_min, year_max = to_number('year_min', int), to_number('year_max', int)
+    return {
+        'genre': args.get('genre', '').strip() or None,
+        'year_range': (year_min, year_max) if year_min is not None or year_max is not None else None,
+        'min_popularity': to_number('min_popularity', float),
+    }
+
+def nearline_rerank_enabled():
+    return bool(feature_store and feature_store.enabled and (NEARLINE_COVIEW_WEIGHT > 0 or NEARLINE_POPULARITY_WEIGHT > 0))
+
+def rerank_with_nearline(items, seed_ids, limit, ds, allow_new=False):
+    """
+    用近线聚合 (nearline_aggregator -> Redis) 的实时信号重排内容召回结果：
+    得分 = 召回名次分 (第 1 名 1.0，线性降到 0) + 共现权重 * 与最近浏览歌曲的共现次数占比 + 热度权重 * 窗口浏览次数占比。
+    allow_new 时 (无过滤条件) 最近浏览歌曲的共现邻居即使不在召回结果中也作为候选加入。
+    Redis 未启用或没有任何信号时保持原顺序。
+    """
+    if not nearline_rerank_enabled():
+        return items[:limit]
+    excluded = set(seed_ids)
+    coviews = {}
+    for neighbors in feature_store.get_coviewed_many(list(seed_ids[:5])).values():
+        for track_id, count in neighbors:
+            if track_id not in excluded:
+                coviews[track_id] = coviews.get(track_id, 0) + count
+
+    candidates = {item.get('id'): 1.0 - rank / max(len(items), 1) for rank, item in enumerate(items)}
+    records = {item.get('id'): item for item in items}
+    if allow_new:
+        for track_id, _ in sorted(coviews.items(), key=lambda kv: kv[1], reverse=True)[:limit]:
+            if track_id not in records:
+                record = ds.get_track_record(track_id)
+                if record:
+                    records[track_id] = record
+                    candidates[track_id] = 0.0
+    popularity = feature_store.get_popularity_scores(list(candidates))
+    if not coviews and not popularity:
+        return items[:limit]
+
+    max_coview = max(coviews.values(), default=0) or 1
+    max_popularity = max(popularity.values(), default=0) or 1
+    scored = sorted(candidates, key=lambda t: candidates[t]
+                    + NEARLINE_COVIEW_WEIGHT * coviews.get(t, 0) / max_coview
+                    + NEARLINE_POPULARITY_WEIGHT * popularity.get(t, 0) / max_popularity, reverse=True)
+    return [records[t] for t in scored[:limit]]
+
 @app.route('/api/songs_recommendations')
 def api_songs_recommendations():
-    """基于最近行为的在线推荐（列表页右侧小窗口）。"""
+    """
+    基于最近行为的在线推荐（列表页右侧小窗口）。
+    可选参数 genre / year_min / year_max / min_popularity：在检索阶段过滤，而不是对结果再筛选。
+    近线聚合已启用时多召回一些候选，再按实时共现 / 热度重排 (rerank_with_nearline)。
+    """
     from dataset_service import SpotifyDataset
     ds = SpotifyDataset.get_instance()
     df = ds.get_dataframe()
 
     # 取最近行为的 track_id 作为种子
     seed_ids = session.get('recent_track_ids', [])
+    filters = parse_rec_filters(request.args)
     recs = []
 
     # 优先用内容召回（模型已就绪且有种子）
-    if is_model_ready and global_recommender and seed_ids:
+    engine = global_recommender
+    has_filters = any(v is not None for v in filters.values())
+    if is_model_ready and engine and seed_ids:
+        recall = NEARLINE_CANDIDATES if nearline_rerank_enabled() else 10
         try:
-            seed_infos = [{'id': t} for t in seed_ids[:20]]
-            rec_results = global_recommender.recommend(seed_infos, limit=10)
+            # 会话兴趣向量由 /events 增量维护，这里只做一次单向量检索
+            client_id = session.get('client_id')
+            query = session_vectors.get(client_id, engine.embedding_space) if client_id else None
+            if query is None:
+                # 冷启动或模型切换：按时间顺序 (旧 -> 新) 用最近交互重建
+                vectors = engine.get_embeddings(list(reversed(seed_ids[:20])))
+                query = session_vectors.rebuild(client_id, engine.embedding_space, [v for v in vectors if v is not None])
+            if query is not None:
+                compute = lambda: engine.recommend_by_vector(query, limit=recall, exclude_ids=seed_ids, **filters)
+            else:
+                compute = lambda: engine.recommend([{'id': t} for t in seed_ids[:20]], limit=recall, **filters)
+            rec_results = run_admitted(compute, lambda: engine.recommend_popular(limit=recall, exclude_ids=seed_ids, **filters),
+                                       'api_songs_recommendations')
+            rec_results = rerank_with_nearline(rec_results, seed_ids, 10, ds, allow_new=not has_filters)
             for item in rec_results:
                 recs.append({
                     'id': item.get('id'),
@@ -293,9 +702,31 @@ def api_songs_recommendations():
         except Exception as e:
             print(f"[WARN] 在线推荐回退: {e}")
 
-    # 回退：按人气排序的 Top 列表
+    # 回退 1：近线聚合的实时热度 (nearline_aggregator 写入 Redis)；带过滤条件时跳过 (热度榜无法按条件筛)
+    if not recs and not has_filters and feature_store and feature_store.enabled:
+        for track_id, _ in feature_store.get_popular_tracks(limit=10):
+            record = ds.get_track_record(track_id)
+            if record:
+                recs.append({
+                    'id': record.get('id'),
+                    'name': record.get('track_name'),
+                    'artist': record.get('artist_name'),
+                    'genre': record.get('genre'),
+                    'popularity': record.get('popularity')
+                })
+
+    # 回退 2：按人气排序的 Top 列表 (模型就绪时用过滤索引，保证条件生效)
+    if not recs and has_filters and is_model_ready and engine:
+        for item in engine.recommend_popular(limit=10, exclude_ids=seed_ids, **filters):
+            recs.append({
+                'id': item.get('id'),
+                'name': item.get('track_name'),
+                'artist': item.get('artist_name'),
+                'genre': item.get('genre'),
+                'popularity': item.get('popularity')
+            })
     if not recs:
-        tracks, _ = ds.list_tracks(limit=10, offset=0)
+        tracks, _ = ds.list_tracks(limit=10, offset=0, genre=filters['genre'])
         for item in tracks:
             recs.append({
                 'id': item.get('id'),
@@ -381,7 +812,7 @@ def select_playlist():
     if not token_info:
         return redirect(url_for('login'))
     
-    sp = spotipy.Spotify(auth=token_info['access_token'])
+    sp = spotify_api_client(auth=token_info['access_token'])
     
     # Debug: Print current user info to console to verify email
     try:
@@ -419,55 +850,78 @@ def select_playlist():
 
 @app.route('/recommend', methods=['POST'])
 def recommend():
+    """提交歌单推荐任务：重计算在后台队列中执行，Web 线程立即返回可轮询的任务页。"""
     token_info = get_token()
     if not token_info:
         return redirect(url_for('login'))
     
-    # Use User Token for accessing playlist (User Data)
-    sp_user = spotipy.Spotify(auth=token_info['access_token'])
-    # Use Client Token for analysis (Public Data) - More stable
-    sp_public = get_spotify_client()
-    
     playlist_id = request.form.get('playlist_id')
-    
-    # 1. Get tracks from the selected playlist
-    results = sp_user.playlist_tracks(playlist_id)
-    tracks = results['items']
-    while results['next']:
-        results = sp_user.next(results)
-        tracks.extend(results['items'])
-        
-    # 2. Extract Track IDs
-    seed_infos = []
-    for item in tracks:
-        # Ensure it's a track (not episode), has an ID, and is not a local file
-        if (item['track'] and 
-            item['track']['id'] and 
-            item['track']['type'] == 'track' and 
-            not item['track'].get('is_local', False)):
-            seed_infos.append({
-                'id': item['track']['id'],
-                'name': item['track']['name'],
-                'artist': item['track']['artists'][0]['name'] if item['track'].get('artists') else None
-            })
-            
-    if not seed_infos:
-        return render_template('error.html', message="该歌单似乎是空的，或者包含的歌曲无法被 Spotify 识别（例如本地文件）。<br>请尝试选择另一个歌单。")
+    return enqueue_recommendation('recommend', _recommend_job, token_info['access_token'], playlist_id)
+
+def _recommend_job(job, access_token, playlist_id):
+    """/recommend 的后台任务：返回 job_page(...)，由 /jobs/<id> 渲染。"""
+    # Use User Token for accessing playlist (User Data)
+    # (公开数据如封面则使用 Client Token，见 get_app_token)
+
+    # 用户信息与歌单快照互不依赖，提前并发发起
+    user_future = spotify_fetcher.submit(spotify_fetcher.current_user, access_token)
+    engine = global_recommender
 
-    # Limit to analyzing first 100 tracks to avoid rate limits and slowness for this demo
-    seed_infos = seed_infos[:100]
+    job.update_progress(10, "正在读取歌单...")
+    # 0. 歌单快照未变化 (snapshot_id 相同) 时，直接复用上次解析好的种子行号，
+    #    跳过整张歌单的分页下载与种子解析
+    snapshot_id = None
+    try:
+        with metrics.span('spotify_snapshot'):
+            snapshot_id = spotify_fetcher.playlist(access_token, playlist_id, fields='snapshot_id').get('snapshot_id')
+    except Exception as e_snap:
+        print(f"[WARN] 获取歌单快照失败，跳过快照缓存: {e_snap}")
+    # 索引版本只读一次：解析种子期间若发生入库/切换，按旧版本解析的行号也只记在旧版本下，
+    # 不会被当作新版本的有效结果
+    index_version = engine.index_version
+    seed_positions = playlist_seed_cache.get(playlist_id, snapshot_id, index_version)
+    metrics.CACHE_REQUESTS.inc(cache='playlist_seeds', result='miss' if seed_positions is None else 'hit')
+
+    if seed_positions is None:
+        job.update_progress(25, "正在下载歌单并解析种子歌曲...")
+        # 1. Get tracks from the selected playlist (首页拿到 total 后，其余页并发拉取)
+        with metrics.span('spotify_pagination'):
+            tracks = spotify_fetcher.playlist_items(access_token, playlist_id)
+            
+        # 2. Extract Track IDs
+        seed_infos = []
+        for item in tracks:
+            # Ensure it's a track (not episode), has an ID, and is not a local file
+            if (item['track'] and 
+                item['track']['id'] and 
+                item['track']['type'] == 'track' and 
+                not item['track'].get('is_local', False)):
+                seed_infos.append({
+                    'id': item['track']['id'],
+                    'name': item['track']['name'],
+                    'artist': item['track']['artists'][0]['name'] if item['track'].get('artists') else None
+                })
+                
+        if not seed_infos:
+            return job_page('error.html', message="该歌单似乎是空的，或者包含的歌曲无法被 Spotify 识别（例如本地文件）。<br>请尝试选择另一个歌单。")
+
+        # Limit to analyzing first 100 tracks to avoid rate limits and slowness for this demo
+        seed_infos = seed_infos[:100]
+        seed_positions = engine.resolve_seed_positions(seed_infos)
+        playlist_seed_cache.put(playlist_id, snapshot_id, index_version, seed_positions)
+    else:
+        print(f"[CACHE] 歌单 {playlist_id} 快照未变化，复用 {len(seed_positions)} 个已解析种子")
     
     # 3. 使用全局推荐引擎 (Global Recommender)
-    # from recommender import ContentBasedRecommender
-    # recommender = ContentBasedRecommender()
     
+    job.update_progress(50, "正在计算相似度...")
     print("[INFO] 正在调用全局推荐算法...")
     try:
         # 用户/设备标识，用于缓存和事件
         user_profile = None
         user_id = None
         try:
-            user_profile = sp_user.current_user()
+            user_profile = user_future.result()
             user_id = user_profile.get('id') if user_profile else None
         except Exception:
             user_profile = None
@@ -476,6 +930,7 @@ def recommend():
         cached_ids = None
         if feature_store and feature_store.enabled and user_id:
             cached_ids = feature_store.get_cached_recommendation(user_id, playlist_id)
+            metrics.CACHE_REQUESTS.inc(cache='recommendation', result='hit' if cached_ids else 'miss')
 
         if cached_ids:
             print(f"[CACHE] 命中用户 {user_id} 歌单 {playlist_id} 的推荐缓存")
@@ -488,9 +943,11 @@ def recommend():
             except Exception:
                 rec_results = []
         else:
-            # 传入所有 track_ids 作为种子，让算法自己计算平均值
-            # 注意：算法内部会过滤掉不在数据库中的 ID
-            rec_results = global_recommender.recommend(seed_infos, limit=50)
+            # 种子已解析为库内行号 (不在数据库中的歌曲已被过滤)
+            rec_results = run_admitted(lambda: engine.recommend_positions(seed_positions, limit=50,
+                                                                         frontier_key=playlist_id),
+                                       lambda: engine.recommend_popular(limit=50, exclude_positions=seed_positions),
+                                       'recommend')
         
         rec_tracks = []
         if rec_results:
@@ -508,13 +965,15 @@ def recommend():
                     'external_url': f"https://open.spotify.com/track/{item['id']}"
                 })
                 
+            job.update_progress(85, "正在获取封面...")
             # 可选：如果想要封面图，可以批量调用一次 Spotify API (tracks endpoint)
             # 但为了速度和避免 API 限制，这里先留空或使用占位符
             # 如果您非常需要封面，可以取消下面这段注释
             try:
                 rec_ids = [item['id'] for item in rec_results][:50]
-                sp_tracks = sp_public.tracks(rec_ids)
-                for i, t_info in enumerate(sp_tracks['tracks']):
+                with metrics.span('cover_enrichment'):
+                    sp_tracks = spotify_fetcher.tracks(get_app_token(), rec_ids)
+                for i, t_info in enumerate(sp_tracks):
                     if t_info and i < len(rec_tracks):
                         rec_tracks[i]['album_art'] = t_info['album']['images'][0]['url'] if t_info['album']['images'] else None
                         rec_tracks[i]['preview_url'] = t_info['preview_url']
@@ -532,25 +991,59 @@ def recommend():
                     'ts': int(time.time())
                 })
 
-            return render_template('results.html', tracks=rec_tracks, user_profile=user_profile, playlist_id=playlist_id)
+            return job_page('results.html', tracks=rec_tracks, user_profile=user_profile, playlist_id=playlist_id)
             
         else:
             print("[WARN] 推荐算法未返回任何结果 (可能是种子歌曲都不在数据库中)")
-            return render_template('error.html', message="无法生成推荐：您的歌单中的歌曲似乎都不在我们的离线数据库中。<br>请尝试选择包含更多热门歌曲的歌单。")
+            return job_page('error.html', message="无法生成推荐：您的歌单中的歌曲似乎都不在我们的离线数据库中。<br>请尝试选择包含更多热门歌曲的歌单。")
 
     except Exception as e:
         print(f"[ERROR] 推荐算法运行出错: {e}")
         import traceback
         traceback.print_exc()
-        return render_template('error.html', message=f"推荐算法内部错误: {e}")
+        return job_page('error.html', message=f"推荐算法内部错误: {e}")
 
-    # (以下旧代码已废弃)
-    """
-    # 4. Calculate Average Features (The "Algorithm")
-    # We create a profile of the user's taste based on this playlist
-    df = pd.DataFrame(all_audio_features)
-    ...
-    """
+
+def job_page(template, **context):
+    """后台任务不能直接渲染模板 (没有请求上下文)，先记录模板与参数，由 /jobs/<id> 渲染。"""
+    return {'template': template, 'context': context}
+
+def enqueue_recommendation(kind, fn, access_token, playlist_id, *args):
+    """提交后台推荐任务并跳转到任务页；同一用户对同一歌单的在途任务会被合并。"""
+    token_digest = hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+    try:
+        job = recommendation_jobs.submit((kind, playlist_id, token_digest, *args), fn, access_token, playlist_id, *args)
+    except JobQueueFull:
+        return render_template('error.html', message="当前推荐请求较多，请稍后重试。")
+    # 任务页只对提交者可见
+    job_ids = [j for j in session.get('job_ids', []) if j != job.id]
+    session['job_ids'] = ([job.id] + job_ids)[:20]
+    return redirect(url_for('job_result', job_id=job.id))
+
+def _get_own_job(job_id):
+    if job_id not in session.get('job_ids', []):
+        return None
+    return recommendation_jobs.get(job_id)
+
+@app.route('/jobs/<job_id>')
+def job_result(job_id):
+    job = _get_own_job(job_id)
+    if not job:
+        return render_template('error.html', message="推荐任务不存在或已过期，请重新选择歌单。")
+    if job.status == 'failed':
+        return render_template('error.html', message=f"推荐算法内部错误: {job.error}")
+    if job.status != 'done':
+        # 复用 loading.html 的轮询进度条，完成后自动刷新到结果页
+        return render_template('loading.html', status_url=url_for('job_status', job_id=job_id),
+                               title="正在生成推荐", description="正在分析您的歌单并在全库中检索相似歌曲，请稍候。")
+    return render_template(job.result['template'], **job.result['context'])
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = _get_own_job(job_id)
+    if not job:
+        return jsonify({'ready': True, 'status': 'missing', 'progress': {'percent': 0, 'message': '任务不存在'}}), 404
+    return jsonify(job.to_status())
 
 @app.route('/playlist', methods=['GET'])
 def playlist_detail():
@@ -558,28 +1051,29 @@ def playlist_detail():
     if not token_info:
         return redirect(url_for('login'))
     
-    sp_user = spotipy.Spotify(auth=token_info['access_token'])
+    access_token = token_info['access_token']
     playlist_id = request.args.get('playlist_id')
     
     if not playlist_id:
         return redirect(url_for('select_playlist'))
 
     try:
+        # 元数据、用户信息与歌曲分页三者互不依赖，并发发起
+        meta_future = spotify_fetcher.submit(spotify_fetcher.playlist, access_token, playlist_id, "name,images,description")
+        user_future = spotify_fetcher.submit(spotify_fetcher.current_user, access_token)
+
+        # Get tracks (Basic Info Only)
+        with metrics.span('spotify_pagination'):
+            tracks = spotify_fetcher.playlist_items(access_token, playlist_id)
+
         # Get Playlist Metadata
-        playlist_meta = sp_user.playlist(playlist_id, fields="name,images,description")
+        playlist_meta = meta_future.result()
         playlist_info = {
             'name': playlist_meta['name'],
             'image': playlist_meta['images'][0]['url'] if playlist_meta['images'] else None,
             'description': playlist_meta['description']
         }
 
-        # Get tracks (Basic Info Only)
-        results = sp_user.playlist_tracks(playlist_id)
-        tracks = results['items']
-        while results['next']:
-            results = sp_user.next(results)
-            tracks.extend(results['items'])
-            
         track_data = []
         for item in tracks:
             if (item['track'] and item['track']['id'] and item['track']['type'] == 'track'):
@@ -590,7 +1084,7 @@ def playlist_detail():
                     'album_art': item['track']['album']['images'][0]['url'] if item['track']['album']['images'] else None
                 })
         
-        return render_template('playlist.html', tracks=track_data, playlist_id=playlist_id, playlist_info=playlist_info, user_profile=sp_user.current_user())
+        return render_template('playlist.html', tracks=track_data, playlist_id=playlist_id, playlist_info=playlist_info, user_profile=user_future.result())
     except Exception as e:
         return render_template('error.html', message=f"获取歌单失败: {e}")
 
@@ -600,15 +1094,17 @@ def track_detail(track_id):
     if not token_info:
         return redirect(url_for('login'))
     
-    sp_user = spotipy.Spotify(auth=token_info['access_token'])
-    sp_public = get_spotify_client()
+    access_token = token_info['access_token']
     
     from dataset_service import SpotifyDataset
     dataset = SpotifyDataset.get_instance()
     
     try:
+        # 用户信息只用于行为上报，与歌曲信息并发获取
+        user_future = spotify_fetcher.submit(spotify_fetcher.current_user, access_token)
+
         # 1. Get Online Metadata (Name, Artist, Popularity, Release Date)
-        track_info = sp_user.track(track_id)
+        track_info = spotify_fetcher.track(access_token, track_id)
         track_name = track_info['name']
         artist_name = track_info['artists'][0]['name']
         
@@ -634,7 +1130,7 @@ def track_detail(track_id):
             # Fallback to Spotify Artist API
             try:
                 artist_id = track_info['artists'][0]['id']
-                artist_info = sp_public.artist(artist_id)
+                artist_info = spotify_fetcher.artist(get_app_token(), artist_id)
                 if artist_info and artist_info.get('genres'):
                     genres_list = [g.title() for g in artist_info.get('genres', [])[:3]]
                     genres = ", ".join(genres_list)
@@ -678,7 +1174,7 @@ def track_detail(track_id):
 
         # 行为上报：用于近线特征/曝光
         try:
-            user_profile = sp_user.current_user()
+            user_profile = user_future.result()
             user_id = user_profile.get('id') if user_profile else None
             if user_id:
                 event_producer.send_event('track_view', {
@@ -704,14 +1200,18 @@ def recommend_from_playlist():
     token_info = get_token()
     if not token_info:
         return redirect(url_for('login'))
-    sp_user = spotipy.Spotify(auth=token_info['access_token'])
-    
+    loose = request.form.get('fallback_loose')
+    fallback_loose = None if loose is None else loose.lower() in ('1', 'true', 'yes')
+    return enqueue_recommendation('recommend_from_playlist', _recommend_from_playlist_job,
+                                  token_info['access_token'], playlist_id, fallback_loose)
+
+def _recommend_from_playlist_job(job, access_token, playlist_id, fallback_loose):
+    """/recommend_from_playlist 的后台任务。"""
     try:
-        results = sp_user.playlist_tracks(playlist_id)
-        tracks = results['items']
-        while results['next']:
-            results = sp_user.next(results)
-            tracks.extend(results['items'])
+        job.update_progress(10, "正在读取歌单...")
+        user_future = spotify_fetcher.submit(spotify_fetcher.current_user, access_token)
+        with metrics.span('spotify_pagination'):
+            tracks = spotify_fetcher.playlist_items(access_token, playlist_id)
             
         # Build seed infos (id, name, artist) so recommender can fallback to name+artist matching
         seed_infos = []
@@ -723,23 +1223,27 @@ def recommend_from_playlist():
                     'artist': item['track']['artists'][0]['name'] if item['track'].get('artists') else None
                 })
 
+        # 复用进程内已初始化的共享引擎；可选的 fallback_loose 只生成轻量视图
         from recommender import ContentBasedRecommender
-        recommender = ContentBasedRecommender()
-
-        rec_results = recommender.recommend(seed_infos, limit=50)
+        recommender = ContentBasedRecommender.get_instance(fallback_loose=fallback_loose)
+
+        job.update_progress(50, "正在计算相似度...")
+        rec_results = []
+        if seed_infos:
+            seed_positions = recommender.resolve_seed_positions(seed_infos)
+            rec_results = run_admitted(lambda: recommender.recommend_positions(seed_positions, limit=50,
+                                                                              frontier_key=playlist_id),
+                                       lambda: recommender.recommend_popular(limit=50, exclude_positions=seed_positions),
+                                       'recommend_from_playlist')
         
         rec_tracks = []
         if rec_results:
-            # Optional: Fetch covers
-            sp_public = get_spotify_client()
+            job.update_progress(85, "正在获取封面...")
+            # Optional: Fetch covers (已缓存的歌曲不会再调用 API)
             try:
                 rec_ids = [item['id'] for item in rec_results][:50]
-                # Split into chunks of 50 for API
-                sp_tracks_info = []
-                for i in range(0, len(rec_ids), 50):
-                    chunk = rec_ids[i:i+50]
-                    resp = sp_public.tracks(chunk)
-                    sp_tracks_info.extend(resp['tracks'])
+                with metrics.span('cover_enrichment'):
+                    sp_tracks_info = spotify_fetcher.tracks(get_app_token(), rec_ids)
                 
                 for i, item in enumerate(rec_results):
                     if i < len(sp_tracks_info) and sp_tracks_info[i]:
@@ -773,16 +1277,15 @@ def recommend_from_playlist():
                         'external_url': f"https://open.spotify.com/track/{item['id']}"
                     })
             
-            # Get current user profile for display
+            # Get current user profile for display (只请求一次，展示与上报共用)
             user_profile = None
             try:
-                user_profile = sp_user.current_user()
-            except:
+                user_profile = user_future.result()
+            except Exception:
                 pass
 
             # 行为上报 & 缓存
             try:
-                user_profile = sp_user.current_user()
                 user_id = user_profile.get('id') if user_profile else None
                 if user_id:
                     feature_store.cache_recommendation(user_id, playlist_id, [t['id'] for t in rec_tracks])
@@ -795,12 +1298,12 @@ def recommend_from_playlist():
             except Exception:
                 pass
 
-            return render_template('results.html', tracks=rec_tracks, user_profile=user_profile, playlist_id=playlist_id)
+            return job_page('results.html', tracks=rec_tracks, user_profile=user_profile, playlist_id=playlist_id)
         else:
-             return render_template('error.html', message="无法生成推荐：您的歌单中的歌曲似乎都不在我们的离线数据库中。")
+            return job_page('error.html', message="无法生成推荐：您的歌单中的歌曲似乎都不在我们的离线数据库中。")
 
     except Exception as e:
-        return render_template('error.html', message=f"推荐失败: {e}")
+        return job_page('error.html', message=f"推荐失败: {e}")
 
 # Deprecated routes (kept for reference or removed)
 # @app.route('/get_features', methods=['POST']) ... 
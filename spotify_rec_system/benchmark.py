@@ -0,0 +1,273 @@
+"""
+可复现的性能基准：在合成歌曲库 (synthetic_catalog.py) 上计时数据加载、预处理、训练、向量生成、
+推荐与列表/查找接口，输出 JSON 供回归对比。
+
+    python benchmark.py --rows 100k --out bench_100k.json
+    python benchmark.py --sizes 100k,1m,5m --epochs 2 --out bench.json
+    python benchmark.py --rows 100k --compare bench_100k.json --tolerance 0.25
+    python benchmark.py --rows 1m --encoder pca --compare bench_1m_ae.json   # 线性编码器 vs Autoencoder
+    python benchmark.py --rows 1m --lean --out bench_1m_lean.json             # 省内存模式
+
+每个规模在独立子进程中运行 (互不影响内存与单例)，模型缓存放在临时目录，不会改动 model_cache/。
+计时项：
+    load_data                SpotifyDataset 读取 CSV 并建立 id 索引
+    preprocess               _preprocess_data (清洗、离群值截断、特征缩放)
+    train / train_epoch      冷启动训练总耗时 / 每个 epoch
+    embeddings / index       全库向量生成 / 归一化建索引
+    warm_start               有缓存时的引擎初始化
+    recommend_{1,20,100}     recommend() 延迟 (种子数)
+    features_by_name         get_track_features_by_name (命中 / 未命中)
+    list_tracks.*            列表页查询 (默认、筛选、搜索、排序、深翻页)
+每个规模另记进程峰值内存 peak_rss_mb 与冷启动各阶段的 峰值 / 常驻内存 stage_memory (MB)。
+--compare 时按 seconds / p50_ms 对比，超过容差的项记为回归，进程以 1 退出。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import memstat
+from synthetic_catalog import parse_rows, write_catalog
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def latency_stats(samples_s):
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    return {
+        'n': int(len(ms)),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'min_ms': round(float(ms.min()), 3),
+    }
+
+
+def timed_calls(fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return latency_stats(samples)
+
+
+def run_size(rows, args):
+    """在当前进程内跑一个规模 (调用前应尚未导入数据集/推荐模块)。"""
+    workdir = os.path.abspath(args.workdir)
+    catalog = os.path.join(workdir, f"catalog_{rows}_{args.seed}.csv")
+    results = {}
+    if not os.path.exists(catalog):
+        results['generate'] = {'seconds': round(write_catalog(catalog, rows, args.seed), 3)}
+
+    cache_dir = os.path.join(workdir, f"cache_{rows}_{args.seed}")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.environ.update({
+        'SPOTIFY_DATASET_PATH': catalog,
+        'SPOTIFY_INGEST_DIR': os.path.join(workdir, 'ingested_none'),
+        'RECOMMENDER_CACHE_DIR': cache_dir,
+        'RECOMMENDER_EPOCHS': str(args.epochs),
+        'RECOMMENDER_ENCODER': args.encoder,
+        'RECOMMENDER_MEMORY_LEAN': '1' if args.lean else '0',
+        'RECOMMENDER_PROGRESSIVE': '0',
+        'RECOMMENDER_SHARDS': '0',
+    })
+    from dataset_service import SpotifyDataset
+
+    start = time.perf_counter()
+    dataset = SpotifyDataset()
+    results['load_data'] = {'seconds': round(time.perf_counter() - start, 3)}
+    SpotifyDataset._instance = dataset
+
+    from recommender import ContentBasedRecommender
+    # 训练开始 ("准备训练数据", 25%) 与每个 epoch 结束时的时间点
+    epoch_marks = []
+
+    def on_progress(percent, message):
+        if percent == 25 or 'Epoch' in message:
+            epoch_marks.append(time.perf_counter())
+
+    engine = ContentBasedRecommender(progress_callback=on_progress)
+    timings = engine.stage_timings
+    results['preprocess'] = {'seconds': round(timings.get('scaler', 0.0), 3)}
+    results['train'] = {'seconds': round(timings.get('weights', 0.0), 3),
+                        'epochs': args.epochs if args.encoder == 'ae' else 0}
+    if len(epoch_marks) > 1:
+        epochs = np.diff(epoch_marks)
+        results['train_epoch'] = {'seconds': round(float(np.median(epochs)), 3),
+                                  'all': [round(float(x), 3) for x in epochs]}
+    results['embeddings'] = {'seconds': round(timings.get('embeddings', 0.0), 3)}
+    results['index'] = {'seconds': round(timings.get('index', 0.0), 3)}
+    stage_memory = dict(engine.stage_memory)
+    del engine
+    ContentBasedRecommender._instances.clear()
+
+    start = time.perf_counter()
+    engine = ContentBasedRecommender()
+    results['warm_start'] = {'seconds': round(time.perf_counter() - start, 3),
+                             'stages': {k: round(v, 3) for k, v in engine.stage_timings.items()}}
+
+    rng = np.random.default_rng(args.seed)
+    ids = engine.df.index.to_numpy()
+    for n_seeds in (1, 20, 100):
+        calls = [(list(rng.choice(ids, n_seeds, replace=False)),) for _ in range(args.queries)]
+        results[f'recommend_{n_seeds}'] = timed_calls(lambda seeds: engine.recommend(seeds, limit=50), calls)
+
+    df = dataset.get_dataframe()
+    sample = df.iloc[rng.integers(0, len(df), args.queries)]
+    pairs = list(zip(sample['track_name'], sample['artist_name']))
+    start = time.perf_counter()
+    dataset.get_track_features_by_name(*pairs[0])
+    results['features_by_name.first'] = {'seconds': round(time.perf_counter() - start, 3)}
+    results['features_by_name.hit'] = timed_calls(dataset.get_track_features_by_name, pairs)
+    results['features_by_name.miss'] = timed_calls(dataset.get_track_features_by_name,
+                                                   [(f"No Such Song {i}", 'Nobody') for i in range(args.queries)])
+
+    genre = str(df['genre'].iloc[0])
+    year = int(df['year'].iloc[0])
+    queries = {
+        'default': {},
+        'genre': {'genre': genre},
+        'year': {'year': year},
+        'search': {'search': 'midnight'},
+        'sort_name': {'sort_by': 'name'},
+        'deep_page': {'offset': len(df) // 2},
+        'combined': {'genre': genre, 'year': year, 'search': 'love', 'sort_by': 'name'},
+    }
+    for name, kwargs in queries.items():
+        start = time.perf_counter()
+        dataset.list_tracks(limit=50, **kwargs)
+        first = time.perf_counter() - start
+        stats = timed_calls(lambda kw: dataset.list_tracks(limit=50, **kw), [(kwargs,)] * args.queries)
+        stats['first_ms'] = round(first * 1000, 3)
+        results[f'list_tracks.{name}'] = stats
+
+    if not args.keep_cache:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    run = {'rows': rows, 'loaded_rows': int(len(df)), 'indexed_rows': int(len(engine.df)), 'results': results}
+    peak = memstat.process_peak_rss_mb()
+    if peak is not None:
+        run['peak_rss_mb'] = round(peak, 1)
+    run['stage_memory'] = stage_memory
+    return run
+
+
+def environment_meta(args):
+    meta = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'epochs': args.epochs,
+        'encoder': args.encoder,
+        'lean': args.lean,
+        'queries': args.queries,
+    }
+    for module in ('numpy', 'pandas', 'torch', 'sklearn'):
+        try:
+            meta[module] = __import__(module).__version__
+        except Exception:
+            meta[module] = None
+    try:
+        meta['git'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                                     text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        meta['git'] = None
+    return meta
+
+
+def flatten(report):
+    """{rows/stage.metric: 值}，只取用于回归对比的 seconds / p50_ms。"""
+    flat = {}
+    for run in report.get('runs', []):
+        for stage, values in run['results'].items():
+            for metric in ('seconds', 'p50_ms'):
+                if metric in values and stage != 'generate':
+                    flat[f"{run['rows']}/{stage}.{metric}"] = values[metric]
+    return flat
+
+
+def compare(current, baseline, tolerance, min_delta_ms=1.0):
+    """打印对比表，返回回归项列表 (当前值 > 基准 * (1 + tolerance) 且差值超过 min_delta_ms)。"""
+    cur, base = flatten(current), flatten(baseline)
+    regressions = []
+    print(f"{'metric':<48} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for key in sorted(set(cur) & set(base)):
+        b, c = base[key], cur[key]
+        ratio = c / b if b else float('inf')
+        delta_ms = (c - b) * (1000 if key.endswith('.seconds') else 1)
+        flag = ''
+        if ratio > 1 + tolerance and delta_ms > min_delta_ms:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print(f"{key:<48} {b:>12.3f} {c:>12.3f} {ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成歌曲库上的性能基准")
+    parser.add_argument('--rows', default='100k', help='单个规模 (如 100k / 1m)')
+    parser.add_argument('--sizes', help='逗号分隔的多个规模，每个规模在独立子进程中运行 (如 100k,1m,5m)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--epochs', type=int, default=int(os.getenv('RECOMMENDER_EPOCHS', '20')))
+    parser.add_argument('--encoder', choices=('ae', 'pca'), default=os.getenv('RECOMMENDER_ENCODER', 'ae'),
+                        help='编码器：ae (Autoencoder) / pca (线性投影)')
+    parser.add_argument('--lean', action='store_true', help='省内存模式 (RECOMMENDER_MEMORY_LEAN=1)')
+    parser.add_argument('--queries', type=int, default=20, help='每项查询重复次数')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'rec-bench'),
+                        help='合成库与临时模型缓存目录 (合成库会复用)')
+    parser.add_argument('--keep-cache', action='store_true', help='保留临时模型缓存')
+    parser.add_argument('--out', help='结果 JSON 路径')
+    parser.add_argument('--compare', help='基准 JSON，对比 seconds / p50_ms')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的变慢比例')
+    args = parser.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+
+    if args.sizes:
+        runs = []
+        for size in [s for s in args.sizes.split(',') if s.strip()]:
+            with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                part = f.name
+            cmd = [sys.executable, os.path.abspath(__file__), '--rows', size, '--seed', str(args.seed),
+                   '--epochs', str(args.epochs), '--encoder', args.encoder, '--queries', str(args.queries), '--workdir', args.workdir, '--out', part]
+            if args.keep_cache:
+                cmd.append('--keep-cache')
+            if args.lean:
+                cmd.append('--lean')
+            print(f"[INFO] 基准规模 {size} ...")
+            subprocess.run(cmd, cwd=BASE_DIR, check=True)
+            with open(part, encoding='utf-8') as f:
+                runs.extend(json.load(f)['runs'])
+            os.unlink(part)
+        report = {'meta': environment_meta(args), 'runs': runs}
+    else:
+        report = {'meta': environment_meta(args), 'runs': [run_size(parse_rows(args.rows), args)]}
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"[INFO] 结果已写入 {args.out}")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"[WARN] {len(regressions)} 项超过容差 {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
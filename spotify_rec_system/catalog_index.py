@@ -0,0 +1,142 @@
+"""
+离线歌曲库的浏览/查找索引 (SpotifyDataset 使用)：
+
+- 歌名索引：track_name -> 行号，按 名称+歌手 回退匹配时不再全表比较；
+- 搜索列：预先转为小写的歌名 / 歌手名，关键词搜索不再每次对全表 lower()；
+- 排序：按人气 (降序) / 歌名 (升序) 预排好的行号及排序键，分页时直接切片，不再每次 sort_values。
+
+各部分在首次使用时构建。入库时 with_rows 只对新增/修改的行增量维护 (排序用二分插入)，
+返回新对象，旧对象保持不变，读请求拿到的始终是一致的 (df, 索引) 组合。
+"""
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 歌名为空的行排在最后 (与 sort_values 的 NaN 位置一致)
+_NAME_SENTINEL = '\U0010ffff'
+
+
+class CatalogIndex:
+    SORT_KEYS = ('popularity', 'name')
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._names: Optional[Dict[str, np.ndarray]] = None
+        self._search: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # sort_by -> (有序行号, 对应的排序键)
+        self._orders: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    # --- 歌名索引 ---
+
+    def name_positions(self, track_name) -> np.ndarray:
+        names = self._names
+        if names is None:
+            with self._lock:
+                if self._names is None:
+                    self._names = self.df.groupby('track_name', sort=False).indices
+                names = self._names
+        return names.get(track_name, np.array([], dtype=np.int64))
+
+    # --- 关键词搜索 ---
+
+    def _search_columns(self) -> Tuple[np.ndarray, np.ndarray]:
+        search = self._search
+        if search is None:
+            with self._lock:
+                if self._search is None:
+                    self._search = (self._lowered(self.df, 'track_name'), self._lowered(self.df, 'artist_name'))
+                search = self._search
+        return search
+
+    @staticmethod
+    def _lowered(frame: pd.DataFrame, column: str) -> np.ndarray:
+        if column not in frame.columns:
+            return np.full(len(frame), np.nan, dtype=object)
+        return frame[column].str.lower().to_numpy(dtype=object)
+
+    def search_mask(self, query: str) -> np.ndarray:
+        """歌名或歌手名包含 query (忽略大小写) 的行。"""
+        names, artists = self._search_columns()
+        q = str(query).lower()
+        return (pd.Series(names).str.contains(q, na=False).to_numpy()
+                | pd.Series(artists).str.contains(q, na=False).to_numpy())
+
+    # --- 预排序 ---
+
+    @staticmethod
+    def _sort_keys(frame: pd.DataFrame, sort_by: str) -> np.ndarray:
+        """升序排序键：人气取负 (空值排最后)；歌名原样 (空值用哨兵排最后)。"""
+        if sort_by == 'popularity':
+            if 'popularity' not in frame.columns:
+                return np.zeros(len(frame))
+            values = pd.to_numeric(frame['popularity'], errors='coerce').to_numpy(dtype=np.float64)
+            return np.where(np.isnan(values), np.inf, -values)
+        if 'track_name' not in frame.columns:
+            return np.full(len(frame), _NAME_SENTINEL, dtype=object)
+        names = frame['track_name']
+        return names.astype(str).where(names.notna(), _NAME_SENTINEL).to_numpy(dtype=object)
+
+    def order(self, sort_by: str) -> np.ndarray:
+        entry = self._orders.get(sort_by)
+        if entry is None:
+            with self._lock:
+                entry = self._orders.get(sort_by)
+                if entry is None:
+                    keys = self._sort_keys(self.df, sort_by)
+                    order = np.argsort(keys, kind='stable')
+                    entry = (order, keys[order])
+                    self._orders[sort_by] = entry
+        return entry[0]
+
+    # --- 增量维护 ---
+
+    def with_rows(self, df: pd.DataFrame, positions) -> 'CatalogIndex':
+        """
+        df 为入库后的新表，positions 为新增或修改过的行号 (新增行追加在末尾，已有行行号不变)。
+        已构建的部分增量更新后带入新对象，未构建的部分仍在首次使用时构建。
+        """
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        old_rows = len(self.df)
+        existing = positions[positions < old_rows]
+        rows = df.iloc[positions]
+        updated = CatalogIndex(df)
+
+        if self._names is not None:
+            names = dict(self._names)
+            for pos, name in zip(existing, self.df['track_name'].iloc[existing]):
+                if pd.isna(name) or name not in names:
+                    continue
+                kept = names[name][names[name] != pos]
+                if len(kept):
+                    names[name] = kept
+                else:
+                    del names[name]
+            for pos, name in zip(positions, rows['track_name']):
+                if pd.isna(name):
+                    continue
+                names[name] = np.append(names[name], pos) if name in names else np.array([pos], dtype=np.int64)
+            updated._names = names
+
+        if self._search is not None:
+            updated._search = tuple(self._grow(column, len(df), positions, self._lowered(rows, name))
+                                    for column, name in zip(self._search, ('track_name', 'artist_name')))
+
+        for sort_by, (order, keys) in self._orders.items():
+            # 先去掉被修改的行，再把这些行按新排序键二分插回
+            keep = ~np.isin(order, existing)
+            order, keys = order[keep], keys[keep]
+            new_keys = self._sort_keys(rows, sort_by)
+            rank = np.argsort(new_keys, kind='stable')
+            at = np.searchsorted(keys, new_keys[rank], side='right')
+            updated._orders[sort_by] = (np.insert(order, at, positions[rank]), np.insert(keys, at, new_keys[rank]))
+        return updated
+
+    @staticmethod
+    def _grow(column: np.ndarray, n_rows: int, positions: np.ndarray, values: np.ndarray) -> np.ndarray:
+        out = np.empty(n_rows, dtype=column.dtype)
+        out[:len(column)] = column
+        out[positions] = values
+        return out
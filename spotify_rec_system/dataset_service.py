@@ -1,5 +1,11 @@
 import pandas as pd
 import os
+import glob
+import time
+import threading
+
+from catalog_index import CatalogIndex
+import metrics
 
 class SpotifyDataset:
     _instance = None
@@ -16,15 +22,29 @@ class SpotifyDataset:
         possible_names = ['dataset.csv', 'tracks.csv', 'spotify_tracks.csv', 'spotify_data.csv']
         
         self.csv_path = None
+        # SPOTIFY_DATASET_PATH 可直接指定 CSV (如基准测试用的合成库)
+        env_path = os.getenv('SPOTIFY_DATASET_PATH', '').strip()
+        if env_path:
+            if os.path.exists(env_path):
+                self.csv_path = env_path
+            else:
+                print(f"[WARN] SPOTIFY_DATASET_PATH 指定的文件不存在: {env_path}")
         for name in possible_names:
+            if self.csv_path:
+                break
             p = os.path.join(base_dir, name)
             if os.path.exists(p):
                 self.csv_path = p
-                break
         
+        # 增量入库的 delta 文件 (按写入顺序回放)，重启后仍然生效
+        self.ingest_dir = os.getenv('SPOTIFY_INGEST_DIR', os.path.join(base_dir, 'ingested'))
+        self._ingest_lock = threading.Lock()
         self.df = None
+        # 浏览/搜索索引，与 df 成对替换 (见 catalog_index.py)
+        self._catalog = CatalogIndex(pd.DataFrame())
         self.load_data()
 
+    @metrics.span('dataset_load')
     def load_data(self):
         if not self.csv_path:
             print(f"[WARN] 未找到数据集文件。推荐功能将无法使用。")
@@ -47,6 +67,7 @@ class SpotifyDataset:
                 self.df['id'] = self.df['id'].astype(str)
                 self.df.drop_duplicates(subset=['id'], inplace=True)
                 self.df.set_index('id', inplace=True, drop=False) # 保留 id 列以便后续使用
+                self._replay_deltas()
                 print(f"[INFO] 数据集加载完成! 包含 {len(self.df)} 首歌曲。")
             else:
                 print(f"[ERROR] CSV 中未找到 'id' 或 'track_id' 列，无法建立索引。")
@@ -55,6 +76,80 @@ class SpotifyDataset:
         except Exception as e:
             print(f"[ERROR] 加载数据集失败: {e}")
             self.df = None
+        if self.df is not None:
+            self._catalog = CatalogIndex(self.df)
+
+    # --- 增量入库 ---
+
+    @staticmethod
+    def normalize_delta(frame):
+        """按加载 CSV 的规则整理 delta：清理列名、统一 id 列并以其为索引；同一 id 出现多次时保留最后一条。"""
+        frame = frame.copy()
+        frame.columns = frame.columns.str.strip()
+        if 'track_id' in frame.columns:
+            frame.rename(columns={'track_id': 'id'}, inplace=True)
+        if 'id' not in frame.columns:
+            raise ValueError("delta 中缺少 'id' 或 'track_id' 列")
+        frame = frame[frame['id'].notna()]
+        frame['id'] = frame['id'].astype(str).str.strip()
+        frame = frame[frame['id'] != '']
+        frame = frame.drop_duplicates(subset=['id'], keep='last')
+        frame.set_index('id', inplace=True, drop=False)
+        return frame
+
+    @staticmethod
+    def _upsert(df, delta):
+        """已存在的 id 原位更新 (只覆盖 delta 中的非空值，行号不变)，新 id 追加在末尾。不修改传入的 df。"""
+        if df is None:
+            return delta.copy(), list(delta.index), []
+        exists = delta.index.isin(df.index)
+        updated, added = delta.index[exists], delta.index[~exists]
+        if len(updated):
+            df = df.copy()
+            df.update(delta.loc[updated])
+        if len(added):
+            df = pd.concat([df, delta.loc[added]])
+        return df, list(added), list(updated)
+
+    def _replay_deltas(self):
+        paths = sorted(glob.glob(os.path.join(self.ingest_dir, 'delta_*.csv')))
+        for path in paths:
+            try:
+                self.df, _, _ = self._upsert(self.df, self.normalize_delta(pd.read_csv(path)))
+            except Exception as e:
+                print(f"[WARN] 回放增量文件失败 {path}: {e}")
+        if paths:
+            print(f"[INFO] 已回放 {len(paths)} 个增量入库文件 ({self.ingest_dir})")
+
+    @staticmethod
+    def write_delta(frame, ingest_dir):
+        """把 delta 写入入库目录 (文件名含纳秒时间戳，回放顺序即写入顺序)。"""
+        os.makedirs(ingest_dir, exist_ok=True)
+        path = os.path.join(ingest_dir, f"delta_{time.time_ns()}.csv")
+        tmp = path + '.tmp'
+        frame.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        return path
+
+    def ingest(self, delta, persist=True):
+        """
+        把一批新增/更新的歌曲合入正在运行的数据集，不重新读取 CSV。
+        id 索引、歌名索引、搜索列与排序顺序只对涉及的行增量维护；persist 时同时写入入库目录。
+        返回 (涉及行的完整记录 DataFrame, 新增 id 列表, 更新 id 列表)。
+        """
+        delta = self.normalize_delta(delta)
+        if delta.empty:
+            return delta, [], []
+        with self._ingest_lock:
+            df, added, updated = self._upsert(self.df, delta)
+            catalog = self._catalog.with_rows(df, df.index.get_indexer(delta.index))
+            if persist:
+                self.write_delta(delta, self.ingest_dir)
+            # 先替换索引再替换 df：读请求各自只取一次引用
+            self._catalog = catalog
+            self.df = df
+        print(f"[INFO] 增量入库完成: 新增 {len(added)} 首，更新 {len(updated)} 首，当前共 {len(df)} 首歌曲")
+        return df.loc[delta.index], added, updated
 
     def get_track_features(self, track_id):
         """获取单曲特征 (用于前端展示)"""
@@ -69,31 +164,22 @@ class SpotifyDataset:
         except:
             return None
 
+    @metrics.span('name_lookup')
     def get_track_features_by_name(self, track_name, artist_name):
         """通过歌名和歌手名查找特征 (备用方案)"""
         if self.df is None:
             return None
         
         try:
-            # 1. 尝试精确匹配 (最快)
+            # 1. 尝试精确匹配 (最快)：歌名索引直接取同名歌曲，不再全表比较
             # 注意：CSV 中的 artist_name 可能包含多个歌手，或者格式不同
             # 这里做一个简单的尝试
-            matches = self.df[
-                (self.df['track_name'] == track_name) & 
-                (self.df['artist_name'] == artist_name)
-            ]
+            catalog = self._catalog
+            potential_matches = catalog.df.iloc[catalog.name_positions(track_name)]
+            matches = potential_matches[potential_matches['artist_name'] == artist_name]
             
             if matches.empty:
-                # 2. 尝试稍微宽松的匹配 (忽略大小写) - 性能警告：这在百万级数据上可能较慢
-                # 为了优化，我们可以先只匹配 track_name (假设重名歌曲远少于总数)
-                # 然后在结果中筛选 artist
-                
-                # 筛选同名歌曲 (忽略大小写)
-                # 注意：str.lower() 操作比较耗时，但如果只对 track_name 做，可能还行？
-                # 不，还是先尝试精确匹配 track_name，然后模糊匹配 artist
-                
-                potential_matches = self.df[self.df['track_name'] == track_name]
-                
+                # 2. 尝试稍微宽松的匹配：在同名歌曲 (假设重名歌曲远少于总数) 中筛选 artist
                 if potential_matches.empty:
                     # 如果连歌名都精确匹配不到，那可能真的没有，或者大小写差异
                     # 考虑到性能，这里不再做全表 lower() 扫描
@@ -133,37 +219,40 @@ class SpotifyDataset:
         return self.df
 
     # --- 新增：用于歌曲列表/前端展示的便捷方法 ---
+    @metrics.span('list_tracks')
     def list_tracks(self, limit=50, offset=0, genre=None, year=None, search=None, sort_by='popularity'):
         """
         从离线 CSV 中分页返回歌曲列表。
         仅使用 DataFrame 切片，避免在接口层做重计算。
         """
-        if self.df is None or self.df.empty:
+        # 只取一次索引引用，入库切换期间 df 与索引保持一致
+        catalog = self._catalog
+        df = catalog.df
+        if df is None or df.empty:
             return [], 0
 
-        df_view = self.df
-
-        # 轻量筛选：genre / year / 关键词
+        # 轻量筛选：genre / year / 关键词 (布尔掩码)
+        mask = None
         if genre:
-            df_view = df_view[df_view['genre'].str.contains(str(genre), case=False, na=False)]
+            mask = df['genre'].str.contains(str(genre), case=False, na=False).to_numpy()
         if year:
-            df_view = df_view[df_view['year'] == int(year)]
+            year_mask = (df['year'] == int(year)).to_numpy()
+            mask = year_mask if mask is None else mask & year_mask
         if search:
-            q = str(search).lower()
-            df_view = df_view[
-                df_view['track_name'].str.lower().str.contains(q, na=False) |
-                df_view['artist_name'].str.lower().str.contains(q, na=False)
-            ]
+            search_mask = catalog.search_mask(search)
+            mask = search_mask if mask is None else mask & search_mask
 
-        total = len(df_view)
-        start = max(int(offset), 0)
-        end = start + int(limit)
         if sort_by not in {'popularity', 'name'}:
             sort_by = 'popularity'
-        if sort_by == 'name':
-            sliced = df_view.sort_values(by='track_name', ascending=True).iloc[start:end]
-        else:
-            sliced = df_view.sort_values(by='popularity', ascending=False).iloc[start:end]
+        # 预排好的行号按掩码筛选后直接切片
+        order = catalog.order(sort_by)
+        if mask is not None:
+            order = order[mask[order]]
+
+        total = len(order)
+        start = max(int(offset), 0)
+        end = start + int(limit)
+        sliced = df.iloc[order[start:end]]
 
         records = sliced[['id', 'track_name', 'artist_name', 'genre', 'year', 'popularity']].fillna('Unknown').to_dict('records')
         return records, total
@@ -0,0 +1,188 @@
+"""
+检索过滤索引：在打分之前确定候选行，只对符合 genre / 年份 / 最低人气条件的行计算相似度。
+
+- genre：每个流派预先建好有序行号分区 (partition)，查询时直接取出；
+- year / popularity：预先按值排序的行号，区间查询用二分定位，O(log N + M)；
+- 多个条件同时出现时，从最小的候选集出发，再用列数组校验其余条件；
+- 增量入库时 with_rows 只更新涉及的分区与有序数组 (二分插入)，不重新排序。
+"""
+from typing import Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+GenreFilter = Union[str, Sequence[str], None]
+
+
+class FilterIndex:
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+
+        codes, vocab = pd.factorize(self._genre_values(df), sort=True)
+        self.genre_codes = codes.astype(np.int32)
+        self.genre_vocab = [str(g) for g in vocab]
+        order = np.argsort(self.genre_codes, kind='stable')
+        bounds = np.searchsorted(self.genre_codes[order], np.arange(len(self.genre_vocab) + 1))
+        # genre -> 有序行号
+        self.genre_positions = {code: np.sort(order[bounds[code]:bounds[code + 1]])
+                                for code in range(len(self.genre_vocab))}
+
+        self.years, self.year_order, self.years_sorted = self._sorted_column(df, 'year')
+        self.popularity, self.popularity_order, self.popularity_sorted = self._sorted_column(df, 'popularity')
+
+    @staticmethod
+    def _genre_values(df: pd.DataFrame) -> pd.Series:
+        if 'genre' not in df.columns:
+            return pd.Series([''] * len(df), index=df.index)
+        return df['genre'].fillna('').astype(str).str.strip().str.lower()
+
+    @staticmethod
+    def _column_values(df: pd.DataFrame, column: str) -> np.ndarray:
+        if column not in df.columns:
+            return np.full(len(df), -1.0)
+        return pd.to_numeric(df[column], errors='coerce').fillna(-1).to_numpy(dtype=np.float64)
+
+    @classmethod
+    def _sorted_column(cls, df: pd.DataFrame, column: str):
+        values = cls._column_values(df, column)
+        order = np.argsort(values, kind='stable')
+        return values, order, values[order]
+
+    # --- 增量维护 ---
+
+    def with_rows(self, df: pd.DataFrame, positions) -> 'FilterIndex':
+        """
+        df 为入库后的新表，positions 为新增或修改过的行号 (新增行追加在末尾，已有行行号不变)。
+        返回新的 FilterIndex，原对象不变 (旧快照仍在使用)。新流派追加到词表末尾。
+        """
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        existing = positions[positions < self.n_rows]
+        rows = df.iloc[positions]
+        updated = FilterIndex.__new__(FilterIndex)
+        updated.n_rows = len(df)
+
+        vocab = list(self.genre_vocab)
+        lookup = {name: code for code, name in enumerate(vocab)}
+        new_codes = []
+        for genre in self._genre_values(rows):
+            if genre not in lookup:
+                lookup[genre] = len(vocab)
+                vocab.append(genre)
+            new_codes.append(lookup[genre])
+        new_codes = np.array(new_codes, dtype=np.int32)
+        updated.genre_vocab = vocab
+        updated.genre_codes = self._grow(self.genre_codes, updated.n_rows, positions, new_codes)
+        updated.genre_positions = dict(self.genre_positions)
+        for code in np.union1d(self.genre_codes[existing], new_codes):
+            code = int(code)
+            kept = updated.genre_positions.get(code, np.array([], dtype=np.int64))
+            kept = kept[~np.isin(kept, existing)]
+            updated.genre_positions[code] = np.union1d(kept, positions[new_codes == code])
+
+        for column, attrs in (('year', ('years', 'year_order', 'years_sorted')),
+                              ('popularity', ('popularity', 'popularity_order', 'popularity_sorted'))):
+            values, order, sorted_values = (getattr(self, a) for a in attrs)
+            new_values = self._column_values(rows, column)
+            keep = ~np.isin(order, existing)
+            order, sorted_values = order[keep], sorted_values[keep]
+            rank = np.argsort(new_values, kind='stable')
+            at = np.searchsorted(sorted_values, new_values[rank], side='right')
+            for attr, value in zip(attrs, (self._grow(values, updated.n_rows, positions, new_values),
+                                           np.insert(order, at, positions[rank]),
+                                           np.insert(sorted_values, at, new_values[rank]))):
+                setattr(updated, attr, value)
+        return updated
+
+    @staticmethod
+    def _grow(column: np.ndarray, n_rows: int, positions: np.ndarray, values: np.ndarray) -> np.ndarray:
+        out = np.empty(n_rows, dtype=column.dtype)
+        out[:len(column)] = column
+        out[positions] = values
+        return out
+
+    # --- 单个条件 ---
+
+    def genre_codes_for(self, genre: GenreFilter) -> np.ndarray:
+        """流派名匹配 (忽略大小写，子串匹配，与列表页筛选一致)；支持逗号分隔或列表。"""
+        if isinstance(genre, str):
+            wanted = [g.strip().lower() for g in genre.split(',')]
+        else:
+            wanted = [str(g).strip().lower() for g in genre]
+        wanted = [g for g in wanted if g]
+        return np.array([code for code, name in enumerate(self.genre_vocab)
+                         if any(w in name for w in wanted)], dtype=np.int32)
+
+    def _genre_candidates(self, genre: GenreFilter) -> np.ndarray:
+        parts = [self.genre_positions[int(code)] for code in self.genre_codes_for(genre)]
+        if not parts:
+            return np.array([], dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    @staticmethod
+    def _range_candidates(order, sorted_values, low=None, high=None) -> np.ndarray:
+        lo = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        hi = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='right')
+        return np.sort(order[lo:hi])
+
+    # --- 组合查询 ---
+
+    def eligible(self, genre: GenreFilter = None, year_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                 min_popularity: Optional[float] = None) -> Optional[np.ndarray]:
+        """返回满足全部条件的有序行号；没有任何条件时返回 None (表示全库)。"""
+        year_min, year_max = year_range if year_range else (None, None)
+        has_genre = bool(genre)
+        has_year = year_min is not None or year_max is not None
+        has_pop = min_popularity is not None
+        if not (has_genre or has_year or has_pop):
+            return None
+
+        # 估算各条件的候选数，从最小的出发
+        sizes = {}
+        if has_genre:
+            codes = self.genre_codes_for(genre)
+            sizes['genre'] = int(sum(len(self.genre_positions[int(c)]) for c in codes))
+        if has_year:
+            lo = 0 if year_min is None else np.searchsorted(self.years_sorted, year_min, side='left')
+            hi = self.n_rows if year_max is None else np.searchsorted(self.years_sorted, year_max, side='right')
+            sizes['year'] = int(max(0, hi - lo))
+        if has_pop:
+            sizes['popularity'] = int(self.n_rows - np.searchsorted(self.popularity_sorted, min_popularity, side='left'))
+        first = min(sizes, key=sizes.get)
+
+        if first == 'genre':
+            candidates = self._genre_candidates(genre)
+        elif first == 'year':
+            candidates = self._range_candidates(self.year_order, self.years_sorted, year_min, year_max)
+        else:
+            candidates = self._range_candidates(self.popularity_order, self.popularity_sorted, min_popularity)
+
+        mask = np.ones(len(candidates), dtype=bool)
+        if has_genre and first != 'genre':
+            mask &= np.isin(self.genre_codes[candidates], self.genre_codes_for(genre))
+        if has_year and first != 'year':
+            years = self.years[candidates]
+            if year_min is not None:
+                mask &= years >= year_min
+            if year_max is not None:
+                mask &= years <= year_max
+        if has_pop and first != 'popularity':
+            mask &= self.popularity[candidates] >= min_popularity
+        return candidates[mask]
+
+    def most_popular(self, positions: np.ndarray, limit: int) -> np.ndarray:
+        """在给定候选中按人气取前 limit 个 (降级推荐用)。"""
+        if len(positions) <= limit:
+            return positions[np.argsort(-self.popularity[positions], kind='stable')]
+        top = np.argpartition(-self.popularity[positions], limit - 1)[:limit]
+        top = top[np.argsort(-self.popularity[positions][top], kind='stable')]
+        return positions[top]
+
+
+def exclude_sorted(positions: np.ndarray, excluded: Optional[Iterable[int]]) -> np.ndarray:
+    """从有序行号中去掉 excluded (种子等)。"""
+    if excluded is None:
+        return positions
+    excluded = np.asarray(list(excluded) if not isinstance(excluded, np.ndarray) else excluded, dtype=np.int64)
+    if not excluded.size:
+        return positions
+    return positions[~np.isin(positions, excluded)]
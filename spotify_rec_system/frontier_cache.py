@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+
+
+class PlaylistFrontier:
+    """
+    一个歌单的候选前沿：精确 Max-Sim 得分最高的 M 行 (已排除种子，按得分降序) + 产生它的种子集合。
+
+    threshold 为前沿之外任意行得分的上界：前沿中第 K 名得分 >= threshold 时，
+    前沿的前 K 行就是精确 Top-K。version 绑定索引版本与过滤条件，任一变化即失效。
+    """
+    __slots__ = ('version', 'seeds', 'positions', 'scores', 'threshold')
+
+    def __init__(self, version: Hashable, seeds: np.ndarray, positions: np.ndarray, scores: np.ndarray,
+                 threshold: float):
+        self.version = version
+        self.seeds = seeds
+        self.positions = positions
+        self.scores = scores
+        self.threshold = threshold
+
+    def covers(self, limit: int) -> bool:
+        """前沿能否给出精确的 Top-limit。"""
+        if len(self.positions) < limit:
+            # 前沿之外没有候选 (threshold 为 -inf) 时，现有的行就是全部结果
+            return self.threshold == -np.inf
+        return bool(self.scores[limit - 1] >= self.threshold)
+
+
+class FrontierCache:
+    """进程内 LRU：frontier_key (通常为 playlist_id) -> PlaylistFrontier。"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, PlaylistFrontier]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.incremental = 0
+        self.reused = 0
+        self.full = 0
+
+    def get(self, key: Hashable) -> Optional[PlaylistFrontier]:
+        with self._lock:
+            frontier = self._entries.get(key)
+            if frontier is not None:
+                self._entries.move_to_end(key)
+            return frontier
+
+    def put(self, key: Hashable, frontier: PlaylistFrontier):
+        with self._lock:
+            self._entries[key] = frontier
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count(self, kind: str):
+        """kind: reused (种子未变) / incremental (只对新增种子打分) / full (全量重算)。"""
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'reused': self.reused,
+                    'incremental': self.incremental, 'full': self.full}
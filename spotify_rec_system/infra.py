@@ -1,6 +1,9 @@
 import json
 import os
-from typing import Any, Dict, List, Optional
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
 
 # 可选依赖：Kafka 与 Redis 均为按需启用，未配置时自动降级为 no-op。
 try:
@@ -15,11 +18,18 @@ except Exception:  # pragma: no cover
 
 
 class EventProducer:
-    """Kafka 事件生产者，用于近线层行为上报。"""
+    """Kafka 事件生产者，用于近线层行为上报。
+
+    未配置 Kafka 时，若设置了 EVENT_SPOOL_PATH，则事件以 JSON Lines 追加写入本地文件，
+    供 nearline_aggregator 回放/消费。
+    """
 
-    def __init__(self, topic: Optional[str] = None, bootstrap_servers: Optional[str] = None):
+    def __init__(self, topic: Optional[str] = None, bootstrap_servers: Optional[str] = None,
+                 spool_path: Optional[str] = None):
         self.topic = topic or os.getenv("KAFKA_TOPIC_EVENTS", "spotify_events")
         brokers = bootstrap_servers or os.getenv("KAFKA_BOOTSTRAP_SERVERS")
+        self.spool_path = spool_path or os.getenv("EVENT_SPOOL_PATH") or None
+        self._spool_lock = threading.Lock()
 
         if KafkaProducer is None or not brokers:
             self.enabled = False
@@ -34,21 +44,58 @@ class EventProducer:
             )
             self.enabled = True
         except Exception as exc:  # pragma: no cover - 连接失败时降级
+            metrics.BACKEND_ERRORS.inc(backend='kafka', op='init')
             print(f"[WARN] Kafka 初始化失败，关闭事件上报: {exc}")
             self.enabled = False
             self.producer = None
 
     def send_event(self, event_type: str, payload: Dict[str, Any]) -> bool:
-        if not self.enabled or not self.producer:
-            return False
         event = {"type": event_type, **payload}
+        if not self.enabled or not self.producer:
+            return self._spool(event)
         try:
             self.producer.send(self.topic, event)
             return True
         except Exception as exc:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='kafka', op='send_event')
             print(f"[WARN] 发送 Kafka 事件失败: {exc}")
             return False
 
+    def _spool(self, event: Dict[str, Any]) -> bool:
+        """Kafka 不可用时的本地文件降级 (每行一个 JSON 事件)。"""
+        if not self.spool_path:
+            return False
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        try:
+            with self._spool_lock:
+                with open(self.spool_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            return True
+        except Exception as exc:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='spool', op='write')
+            print(f"[WARN] 写入本地事件文件失败: {exc}")
+            return False
+
+
+# 会话向量的原子衰减累加：v <- decay * v + x (无旧值或长度不符时取 x)，保留 precision 位小数后写回并设置过期。
+# 读-改-写在一个脚本内完成，多线程 / 多进程同时更新同一会话不会互相覆盖
+_DECAY_ADD_LUA = """
+local incoming = cjson.decode(ARGV[1])
+local decay = tonumber(ARGV[2])
+local scale = 10 ^ tonumber(ARGV[4])
+local current = redis.call('GET', KEYS[1])
+if current then
+  current = cjson.decode(current)
+  if #current == #incoming then
+    for i = 1, #incoming do incoming[i] = decay * current[i] + incoming[i] end
+  end
+end
+for i = 1, #incoming do incoming[i] = math.floor(incoming[i] * scale + 0.5) / scale end
+local encoded = cjson.encode(incoming)
+redis.call('SET', KEYS[1], encoded, 'EX', tonumber(ARGV[3]))
+return encoded
+"""
+
 
 class RedisFeatureStore:
     """Redis 封装，用于实时/在线特征或推荐缓存。"""
@@ -56,6 +103,7 @@ class RedisFeatureStore:
     def __init__(self, url: Optional[str] = None, namespace: str = "rec"):  # noqa: D401
         redis_url = url or os.getenv("REDIS_URL")
         self.namespace = namespace
+        self._decay_add_script = None
 
         if redis is None or not redis_url:
             self.enabled = False
@@ -66,6 +114,7 @@ class RedisFeatureStore:
             self.client = redis.from_url(redis_url, decode_responses=True)
             self.enabled = True
         except Exception as exc:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='init')
             print(f"[WARN] Redis 初始化失败，关闭缓存: {exc}")
             self.enabled = False
             self.client = None
@@ -78,9 +127,11 @@ class RedisFeatureStore:
             return False
         key = self._key("rec", user_id, playlist_id)
         try:
-            self.client.set(key, json.dumps(track_ids), ex=ttl_seconds)
+            with metrics.span('redis_set'):
+                self.client.set(key, json.dumps(track_ids), ex=ttl_seconds)
             return True
         except Exception as exc:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='cache_recommendation')
             print(f"[WARN] Redis 缓存失败: {exc}")
             return False
 
@@ -89,9 +140,36 @@ class RedisFeatureStore:
             return None
         key = self._key("rec", user_id, playlist_id)
         try:
-            data = self.client.get(key)
+            with metrics.span('redis_get'):
+                data = self.client.get(key)
             return json.loads(data) if data else None
         except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='get_cached_recommendation')
+            return None
+
+    def cache_playlist_seeds(self, playlist_id: str, snapshot_id: str, index_version: str,
+                             positions: List[int], ttl_seconds: int = 86400) -> bool:
+        if not self.enabled or not self.client:
+            return False
+        key = self._key("pls", playlist_id, snapshot_id, index_version)
+        try:
+            with metrics.span('redis_set'):
+                self.client.set(key, json.dumps(positions), ex=ttl_seconds)
+            return True
+        except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='cache_playlist_seeds')
+            return False
+
+    def get_playlist_seeds(self, playlist_id: str, snapshot_id: str, index_version: str) -> Optional[List[int]]:
+        if not self.enabled or not self.client:
+            return None
+        key = self._key("pls", playlist_id, snapshot_id, index_version)
+        try:
+            with metrics.span('redis_get'):
+                data = self.client.get(key)
+            return json.loads(data) if data is not None else None
+        except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='get_playlist_seeds')
             return None
 
     def store_user_features(self, user_id: str, feature_vector: List[float], ttl_seconds: int = 3600):
@@ -102,14 +180,119 @@ class RedisFeatureStore:
             self.client.set(key, json.dumps(feature_vector), ex=ttl_seconds)
             return True
         except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='store_user_features')
             return False
 
+    def decay_add_user_features(self, user_id: str, vector: List[float], decay: float, ttl_seconds: int = 3600,
+                                precision: int = 5) -> Optional[List[float]]:
+        """原子地执行 v <- decay * v + vector (Lua 脚本)，返回更新后的向量；Redis 不可用时返回 None。"""
+        if not self.enabled or not self.client:
+            return None
+        key = self._key("uf", user_id)
+        try:
+            if self._decay_add_script is None:
+                self._decay_add_script = self.client.register_script(_DECAY_ADD_LUA)
+            with metrics.span('redis_set'):
+                data = self._decay_add_script(keys=[key], args=[json.dumps(vector), decay, ttl_seconds, precision])
+            return json.loads(data)
+        except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='decay_add_user_features')
+            return None
+
     def get_user_features(self, user_id: str) -> Optional[List[float]]:
         if not self.enabled or not self.client:
             return None
         key = self._key("uf", user_id)
         try:
-            data = self.client.get(key)
+            with metrics.span('redis_get'):
+                data = self.client.get(key)
             return json.loads(data) if data else None
         except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='get_user_features')
             return None
+
+    # --- 近线聚合特征 (由 nearline_aggregator 批量写入) ---
+
+    def publish_popularity(self, counts: Dict[str, int], window: str = "views", ttl_seconds: int = 3600) -> bool:
+        """批量写入窗口内的热度计数 (Sorted Set)，先写临时 key 再 RENAME，读侧不会看到半成品。"""
+        if not self.enabled or not self.client:
+            return False
+        key = self._key("pop", window)
+        tmp_key = key + ":tmp"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.delete(tmp_key)
+            if counts:
+                pipe.zadd(tmp_key, {k: int(v) for k, v in counts.items()})
+                pipe.rename(tmp_key, key)
+                pipe.expire(key, ttl_seconds)
+            else:
+                pipe.delete(key)
+            pipe.execute()
+            return True
+        except Exception as exc:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='publish_popularity')
+            print(f"[WARN] Redis 写入热度特征失败: {exc}")
+            return False
+
+    def get_popular_tracks(self, limit: int = 10, window: str = "views") -> List[Tuple[str, float]]:
+        if not self.enabled or not self.client:
+            return []
+        try:
+            return [(k, float(v)) for k, v in self.client.zrevrange(self._key("pop", window), 0, limit - 1, withscores=True)]
+        except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='get_popular_tracks')
+            return []
+
+    def publish_coviews(self, neighbors: Dict[str, List[Tuple[str, int]]], ttl_seconds: int = 3600) -> bool:
+        """批量写入共现 (co-view) 邻居列表，一个 pipeline 完成。"""
+        if not self.enabled or not self.client:
+            return False
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for track_id, items in neighbors.items():
+                pipe.set(self._key("cov", track_id), json.dumps(items), ex=ttl_seconds)
+            pipe.execute()
+            return True
+        except Exception as exc:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='publish_coviews')
+            print(f"[WARN] Redis 写入共现特征失败: {exc}")
+            return False
+
+    def get_coviewed_many(self, track_ids: List[str]) -> Dict[str, List[Tuple[str, int]]]:
+        """一次 MGET 取多首歌的共现邻居 (在线重排用)，没有数据的歌不出现在结果中。"""
+        if not self.enabled or not self.client or not track_ids:
+            return {}
+        try:
+            with metrics.span('redis_get'):
+                values = self.client.mget([self._key("cov", t) for t in track_ids])
+            return {t: [tuple(x) for x in json.loads(v)] for t, v in zip(track_ids, values) if v}
+        except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='get_coviewed_many')
+            return {}
+
+    def get_popularity_scores(self, track_ids: List[str], window: str = "views") -> Dict[str, float]:
+        """候选歌曲在窗口热度榜中的计数 (一个 pipeline)，不在榜上的歌不出现在结果中。"""
+        if not self.enabled or not self.client or not track_ids:
+            return {}
+        key = self._key("pop", window)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for track_id in track_ids:
+                pipe.zscore(key, track_id)
+            with metrics.span('redis_get'):
+                scores = pipe.execute()
+            return {t: float(v) for t, v in zip(track_ids, scores) if v is not None}
+        except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='get_popularity_scores')
+            return {}
+
+    def get_coviewed(self, track_id: str) -> List[Tuple[str, int]]:
+        if not self.enabled or not self.client:
+            return []
+        try:
+            data = self.client.get(self._key("cov", track_id))
+            return [tuple(x) for x in json.loads(data)] if data else []
+        except Exception:  # pragma: no cover
+            metrics.BACKEND_ERRORS.inc(backend='redis', op='get_coviewed')
+            return []
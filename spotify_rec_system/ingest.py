@@ -0,0 +1,68 @@
+"""
+增量入库命令行：把一批新增/更新的歌曲 (CSV，列同 data/dataset.csv) 合入正在运行的服务。
+
+    python ingest.py new_tracks.csv                       # POST 到本机 /admin/ingest
+    python ingest.py new_tracks.csv --url http://host:5000 --token $ADMIN_TOKEN
+    python ingest.py new_tracks.csv --offline             # 服务未运行：写入入库目录，下次启动时回放
+
+已存在的 id 只覆盖 CSV 中的非空字段，新 id 追加到库末尾；服务端只对这些行编码，几秒内即可被推荐。
+"""
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+import pandas as pd
+
+from dataset_service import SpotifyDataset
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+
+def post_delta(path, url, token, timeout=120.0):
+    with open(path, 'rb') as f:
+        body = f.read()
+    headers = {'Content-Type': 'text/csv; charset=utf-8'}
+    if token:
+        headers['X-Admin-Token'] = token
+    req = urllib.request.Request(url.rstrip('/') + '/admin/ingest', data=body, headers=headers, method='POST')
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量入库 (新增/更新歌曲)")
+    parser.add_argument('path', help='delta CSV 文件 (需包含 id 或 track_id 列)')
+    parser.add_argument('--url', default=os.getenv('INGEST_URL', 'http://127.0.0.1:5000'), help='运行中的服务地址')
+    parser.add_argument('--token', default=os.getenv('ADMIN_TOKEN', ''), help='管理接口令牌 (ADMIN_TOKEN)')
+    parser.add_argument('--offline', action='store_true', help='不连接服务，写入入库目录 (SPOTIFY_INGEST_DIR)')
+    args = parser.parse_args()
+
+    if args.offline:
+        delta = SpotifyDataset.normalize_delta(pd.read_csv(args.path))
+        ingest_dir = os.getenv('SPOTIFY_INGEST_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ingested'))
+        target = SpotifyDataset.write_delta(delta, ingest_dir)
+        print(f"[INFO] 已写入 {len(delta)} 首歌曲到 {target}，服务下次启动时生效")
+        return 0
+
+    try:
+        result = post_delta(args.path, args.url, args.token)
+    except urllib.error.HTTPError as e:
+        print(f"[ERROR] 入库失败 (HTTP {e.code}): {e.read().decode('utf-8', 'replace')}")
+        return 1
+    except urllib.error.URLError as e:
+        print(f"[ERROR] 无法连接服务 {args.url}: {e.reason} (服务未运行时可使用 --offline)")
+        return 1
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class JobQueueFull(Exception):
+    """等待中的任务已达上限，调用方应提示稍后重试。"""
+
+
+class Job:
+    """一个后台推荐任务；progress 的结构与 /status 一致，便于复用 loading.html 轮询。"""
+
+    def __init__(self, key: Hashable):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'  # queued -> running -> done / failed
+        self.progress = {'percent': 0, 'message': '排队中...'}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def update_progress(self, percent: int, message: str):
+        self.progress = {'percent': percent, 'message': message}
+
+    def to_status(self) -> Dict[str, Any]:
+        return {'id': self.id, 'status': self.status, 'ready': self.finished,
+                'progress': self.progress, 'error': self.error}
+
+
+class JobQueue:
+    """
+    有界后台任务队列：固定数量的工作线程 + 等待数量上限。
+    相同 key 的任务在执行期间只会运行一次，后续提交直接返回同一个 Job。
+    已完成的任务保留 result_ttl 秒供轮询读取，之后清理。
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32, result_ttl: float = 600.0):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rec-job')
+        self._jobs: Dict[str, Job] = {}
+        self._inflight: Dict[Hashable, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """提交任务：fn(job, *args, **kwargs) 的返回值即为 job.result。"""
+        with self._lock:
+            self._cleanup()
+            existing = self._inflight.get(key)
+            if existing is not None:
+                return existing
+            if len(self._inflight) >= self.max_pending:
+                raise JobQueueFull(f"等待中的推荐任务已达上限 ({self.max_pending})")
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'inflight': len(self._inflight), 'tracked': len(self._jobs)}
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs):
+        job.status = 'running'
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'done'
+            job.update_progress(100, '完成')
+        except Exception as exc:
+            job.error = str(exc)
+            job.status = 'failed'
+            print(f"[ERROR] 后台推荐任务失败 ({job.id}): {exc}")
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+
+    def _cleanup(self):
+        now = time.time()
+        expired = [jid for jid, j in self._jobs.items() if j.finished_at and now - j.finished_at > self.result_ttl]
+        for jid in expired:
+            del self._jobs[jid]
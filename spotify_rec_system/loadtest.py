@@ -0,0 +1,319 @@
+"""
+端到端 HTTP 压测：按给定比例回放 /songs、/api/songs、/events、/api/songs_recommendations、/recommend 流量，
+输出每个路由的吞吐与 p50/p95/p99 延迟。需要 Spotify 的路由 (/recommend) 走本地 Mock (mock_spotify.py)。
+
+    # 一条命令：启动 Mock Spotify + 应用子进程，再压测
+    python loadtest.py --spawn --concurrency 16 --duration 60 --out loadtest.json
+
+    # 压测已在运行的应用 (应用需以 SPOTIFY_API_BASE / SPOTIFY_ACCOUNTS_BASE 指向 Mock 启动)
+    python loadtest.py --url http://127.0.0.1:5000 --mix songs=3,api_songs=3,events=2,api_songs_recommendations=2,recommend=1
+
+每个并发线程是一个虚拟用户 (独立 cookie 会话)：先经 /login -> Mock 授权 -> /callback 登录，
+再按比例随机发请求。/recommend 记录提交耗时，recommend.e2e 为提交到后台任务结果页返回的总耗时。
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+from mock_spotify import MockSpotifyServer, load_pool
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = 'songs=30,api_songs=30,events=20,api_songs_recommendations=15,recommend=5'
+SEARCH_WORDS = ['love', 'night', 'blue', 'heart', 'fire', 'dream', 'rain', 'summer', 'star', 'baby']
+SORTS = ['popularity', 'name']
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(VirtualUser.ROUTES)
+    if unknown:
+        raise ValueError(f"未知路由: {', '.join(sorted(unknown))} (可选: {', '.join(VirtualUser.ROUTES)})")
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+class Recorder:
+    """线程安全地收集每个路由的延迟样本与状态码。"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def add(self, route: str, seconds: float, status):
+        with self._lock:
+            self.samples[route].append(seconds)
+            self.statuses[route][str(status)] += 1
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        out = {}
+        with self._lock:
+            for route in sorted(self.samples):
+                ms = np.asarray(self.samples[route]) * 1000
+                statuses = dict(self.statuses[route])
+                errors = sum(n for s, n in statuses.items() if not s.isdigit() or int(s) >= 400)
+                out[route] = {
+                    'requests': int(len(ms)),
+                    'rps': round(len(ms) / elapsed, 2) if elapsed else 0.0,
+                    'errors': errors,
+                    'p50_ms': round(float(np.percentile(ms, 50)), 2),
+                    'p95_ms': round(float(np.percentile(ms, 95)), 2),
+                    'p99_ms': round(float(np.percentile(ms, 99)), 2),
+                    'max_ms': round(float(ms.max()), 2),
+                    'statuses': statuses,
+                }
+        return out
+
+
+class VirtualUser:
+    ROUTES = ('songs', 'api_songs', 'events', 'api_songs_recommendations', 'recommend')
+
+    def __init__(self, base_url: str, recorder: Recorder, track_ids: List[str], playlists: int,
+                 rng: random.Random, job_timeout: float = 120.0, timeout: float = 60.0):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.track_ids = track_ids
+        self.playlists = playlists
+        self.rng = rng
+        self.job_timeout = job_timeout
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.logged_in = False
+
+    def _timed(self, route: str, method: str, path: str, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as exc:
+            self.recorder.add(route, time.perf_counter() - start, type(exc).__name__)
+            return None
+        self.recorder.add(route, time.perf_counter() - start, resp.status_code)
+        return resp
+
+    def login(self) -> bool:
+        """/login -> Mock /authorize -> /callback，登录成功后停在 /select_playlist。"""
+        resp = self._timed('login', 'GET', '/login')
+        self.logged_in = resp is not None and resp.ok and '/select_playlist' in resp.url
+        return self.logged_in
+
+    def songs(self):
+        params = {'page': self.rng.randint(1, 50)}
+        if self.rng.random() < 0.5:
+            params['q'] = self.rng.choice(SEARCH_WORDS)
+        self._timed('songs', 'GET', '/songs', params=params)
+
+    def api_songs(self):
+        params = {'page': self.rng.randint(1, 50), 'sort': self.rng.choice(SORTS)}
+        if self.rng.random() < 0.3:
+            params['q'] = self.rng.choice(SEARCH_WORDS)
+        self._timed('api_songs', 'GET', '/api/songs', params=params)
+
+    def events(self):
+        if not self.track_ids:
+            return
+        self._timed('events', 'POST', '/events', json={'type': 'track_view', 'track_id': self.rng.choice(self.track_ids)})
+
+    def api_songs_recommendations(self):
+        self._timed('api_songs_recommendations', 'GET', '/api/songs_recommendations', params={'limit': 10})
+
+    def recommend(self):
+        if not self.logged_in and not self.login():
+            return
+        playlist_id = f"loadtest_{self.rng.randrange(self.playlists)}"
+        start = time.perf_counter()
+        resp = self._timed('recommend', 'POST', '/recommend', data={'playlist_id': playlist_id}, allow_redirects=False)
+        location = resp.headers.get('Location', '') if resp is not None else ''
+        if '/jobs/' not in location:
+            self.recorder.add('recommend.e2e', time.perf_counter() - start, getattr(resp, 'status_code', 'error'))
+            return
+        job_path = '/jobs/' + location.rsplit('/jobs/', 1)[1]
+        deadline = time.monotonic() + self.job_timeout
+        status = 'timeout'
+        while time.monotonic() < deadline:
+            try:
+                job = self.session.get(f"{self.base_url}{job_path}/status", timeout=self.timeout).json()
+            except (requests.RequestException, ValueError):
+                status = 'error'
+                break
+            if job.get('status') in ('done', 'failed', 'missing'):
+                status = job['status']
+                break
+            time.sleep(0.05)
+        if status == 'done':
+            final = self.session.get(self.base_url + job_path, timeout=self.timeout)
+            status = final.status_code
+        self.recorder.add('recommend.e2e', time.perf_counter() - start, status)
+
+    def step(self, mix: Dict[str, float]):
+        route = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        getattr(self, route)()
+
+
+def wait_ready(base_url: str, timeout: float) -> bool:
+    """轮询 /status (会触发模型加载) 直到引擎就绪。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url.rstrip('/') + '/status', timeout=10).json().get('ready'):
+                return True
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(1.0)
+    return False
+
+
+def sample_track_ids(base_url: str, pages: int = 5) -> List[str]:
+    ids = []
+    for page in range(1, pages + 1):
+        try:
+            data = requests.get(base_url.rstrip('/') + '/api/songs', params={'page': page, 'limit': 200}, timeout=30).json()
+        except (requests.RequestException, ValueError):
+            break
+        ids.extend(t['id'] for t in data.get('tracks', []))
+    return ids
+
+
+def run(base_url: str, mix: Dict[str, float], concurrency: int, duration: float, max_requests: Optional[int],
+        playlists: int, seed: int) -> dict:
+    recorder = Recorder()
+    track_ids = sample_track_ids(base_url)
+    if not track_ids:
+        print("[WARN] 未能从 /api/songs 取到歌曲 id，/events 将被跳过")
+    stop_at = time.monotonic() + duration
+    budget = {'left': max_requests}
+    budget_lock = threading.Lock()
+
+    def take() -> bool:
+        if time.monotonic() >= stop_at:
+            return False
+        if budget['left'] is None:
+            return True
+        with budget_lock:
+            if budget['left'] <= 0:
+                return False
+            budget['left'] -= 1
+            return True
+
+    def worker(i):
+        user = VirtualUser(base_url, recorder, track_ids, playlists, random.Random(seed * 1000 + i))
+        if 'recommend' in mix:
+            user.login()
+        while take():
+            user.step(mix)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    routes = recorder.report(elapsed)
+    total = sum(r['requests'] for name, r in routes.items() if name in VirtualUser.ROUTES)
+    return {'elapsed_s': round(elapsed, 2), 'concurrency': concurrency, 'mix': mix,
+            'total_rps': round(total / elapsed, 2) if elapsed else 0.0, 'routes': routes}
+
+
+def print_table(result: dict):
+    print(f"\n并发 {result['concurrency']}，耗时 {result['elapsed_s']}s，总吞吐 {result['total_rps']} req/s")
+    print(f"{'route':<28} {'requests':>9} {'rps':>8} {'errors':>7} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'max_ms':>9}")
+    for route, r in result['routes'].items():
+        print(f"{route:<28} {r['requests']:>9} {r['rps']:>8.2f} {r['errors']:>7} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_app(port: int, mock: MockSpotifyServer) -> subprocess.Popen:
+    """以 Mock 地址启动应用子进程 (flask run，多线程)。"""
+    env = dict(os.environ)
+    env.update({
+        'SPOTIFY_API_BASE': mock.api_base,
+        'SPOTIFY_ACCOUNTS_BASE': mock.base_url,
+        'SPOTIPY_REDIRECT_URI': f"http://127.0.0.1:{port}/callback",
+        'SPOTIPY_CLIENT_ID': env.get('SPOTIPY_CLIENT_ID') or 'mock-client',
+        'SPOTIPY_CLIENT_SECRET': env.get('SPOTIPY_CLIENT_SECRET') or 'mock-secret',
+        'RECOMMENDER_WARMUP': 'eager',
+        'SESSION_COOKIE_NAME': 'spotify_session',
+        # Mock 返回的封面等元数据不写入正式的元数据缓存
+        'SPOTIFY_META_CACHE_PATH': os.path.join(tempfile.gettempdir(), f'loadtest_meta_{port}.sqlite'),
+    })
+    cmd = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1', '--port', str(port),
+           '--no-reload', '--no-debugger', '--with-threads']
+    return subprocess.Popen(cmd, cwd=BASE_DIR, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端 HTTP 压测 (Mock Spotify)")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='被测应用地址 (--spawn 时忽略)')
+    parser.add_argument('--spawn', action='store_true', help='启动 Mock Spotify 与应用子进程后再压测')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='路由比例，如 songs=3,events=1,recommend=1')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发虚拟用户数')
+    parser.add_argument('--duration', type=float, default=30.0, help='压测时长 (秒)')
+    parser.add_argument('--requests', type=int, help='总请求数上限 (先到先停)')
+    parser.add_argument('--playlists', type=int, default=20, help='/recommend 使用的不同歌单数 (越少缓存命中越多)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ready-timeout', type=float, default=900.0, help='等待模型就绪的最长时间 (秒)')
+    parser.add_argument('--mock-latency-ms', type=float, default=20.0, help='--spawn 时 Mock API 的模拟延迟')
+    parser.add_argument('--mock-dataset', default=os.path.join(BASE_DIR, 'data', 'dataset.csv'),
+                        help='--spawn 时 Mock 歌单的曲库 (离线数据集 CSV，不存在则用随机 id)')
+    parser.add_argument('--out', help='结果 JSON 路径')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    mock = app_proc = None
+    base_url = args.url
+    try:
+        if args.spawn:
+            pool = load_pool(args.mock_dataset, 200000) if os.path.exists(args.mock_dataset) else None
+            mock = MockSpotifyServer(latency_ms=args.mock_latency_ms, pool=pool).start()
+            port = free_port()
+            app_proc = spawn_app(port, mock)
+            base_url = f"http://127.0.0.1:{port}"
+            print(f"[INFO] Mock Spotify: {mock.api_base}，应用: {base_url}")
+
+        print("[INFO] 等待推荐引擎就绪...")
+        if not wait_ready(base_url, args.ready_timeout):
+            print("[ERROR] 应用未在限定时间内就绪")
+            return 1
+        result = run(base_url, mix, args.concurrency, args.duration, args.requests, args.playlists, args.seed)
+    finally:
+        if app_proc is not None:
+            app_proc.terminate()
+            try:
+                app_proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                app_proc.kill()
+        if mock is not None:
+            mock.stop()
+
+    print_table(result)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"[INFO] 结果已写入 {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
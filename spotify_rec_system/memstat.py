@@ -0,0 +1,81 @@
+"""
+进程内存 (RSS) 读数：推荐引擎按启动阶段记录 峰值 / 阶段结束时的常驻内存，用来估算容器内存配额。
+
+Linux 上读取 /proc/self/status (VmRSS 当前值、VmHWM 峰值)，并在每个阶段开始时通过
+/proc/self/clear_refs 清零峰值，使峰值只反映该阶段；清零前的峰值累计到进程峰值中，
+因此 process_peak_rss_mb() 仍是整个进程的最大值 (清零同样会影响 getrusage 的 ru_maxrss)。
+其他平台依次尝试 psutil (可选依赖) 与 resource，无法清零时各阶段峰值即截至当时的进程峰值。
+"""
+import os
+import sys
+import threading
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PROC_STATUS = '/proc/self/status'
+_lock = threading.Lock()
+# 历次清零前观察到的最大峰值 (MB)
+_process_peak = 0.0
+_can_reset = os.path.exists('/proc/self/clear_refs')
+
+
+def _proc_status_mb(key: str) -> Optional[float]:
+    try:
+        with open(_PROC_STATUS) as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) / 1024.0  # kB
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def rss_mb() -> Optional[float]:
+    """当前常驻内存 (MB)，无法获取时为 None。"""
+    value = _proc_status_mb('VmRSS')
+    if value is None and psutil is not None:
+        value = psutil.Process().memory_info().rss / (1024.0 * 1024.0)
+    return value
+
+
+def peak_rss_mb() -> Optional[float]:
+    """自上次 reset_peak() (或进程启动) 以来的峰值常驻内存 (MB)。"""
+    value = _proc_status_mb('VmHWM')
+    if value is None and resource is not None:
+        # ru_maxrss 在 Linux 上为 KB，macOS 上为字节
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        value = peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+    return value
+
+
+def reset_peak() -> bool:
+    """清零峰值 (仅 Linux)；返回是否成功。清零前的峰值计入进程峰值。"""
+    global _process_peak, _can_reset
+    with _lock:
+        _process_peak = max(_process_peak, peak_rss_mb() or 0.0)
+        if not _can_reset:
+            return False
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+            return True
+        except OSError:
+            _can_reset = False
+            return False
+
+
+def process_peak_rss_mb() -> Optional[float]:
+    """整个进程的峰值常驻内存 (MB)，不受 reset_peak() 影响。"""
+    current = peak_rss_mb()
+    if current is None:
+        return _process_peak or None
+    return max(_process_peak, current)
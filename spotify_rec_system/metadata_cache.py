@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+_MISSING = object()
+
+
+class TwoTierCache:
+    """
+    两级 TTL 缓存：进程内 LRU (一级) + 本地 SQLite 文件 (二级，进程重启后仍可命中)。
+    两级都有容量上限；值需可 JSON 序列化 (None 也会被缓存，用于记住"查无此曲")。
+    """
+
+    def __init__(self, disk_path: Optional[str] = None, memory_size: int = 5000, max_disk_entries: int = 200000):
+        self.memory_size = memory_size
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_writes = 0
+        if disk_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+                self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires_at)")
+            except Exception as exc:  # pragma: no cover - 磁盘不可写时只用内存
+                print(f"[WARN] 本地元数据缓存不可用，仅使用内存缓存: {exc}")
+                self._db = None
+
+    # --- 一级：内存 LRU ---
+
+    def _memory_get(self, key: str, now: float):
+        item = self._memory.get(key)
+        if item is None:
+            return _MISSING
+        value, expires_at = item
+        if expires_at < now:
+            del self._memory[key]
+            return _MISSING
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: Any, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    # --- 对外接口 ---
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """返回命中的 key -> value (未命中或已过期的 key 不在结果中)。"""
+        now = time.time()
+        hits: Dict[str, Any] = {}
+        misses = []
+        with self._lock:
+            for key in keys:
+                value = self._memory_get(key, now)
+                if value is _MISSING:
+                    misses.append(key)
+                else:
+                    hits[key] = value
+            if misses and self._db is not None:
+                placeholders = ','.join('?' * len(misses))
+                rows = self._db.execute(
+                    f"SELECT key, value, expires_at FROM cache WHERE key IN ({placeholders}) AND expires_at >= ?",
+                    [*misses, now],
+                ).fetchall()
+                for key, raw, expires_at in rows:
+                    value = json.loads(raw)
+                    hits[key] = value
+                    self._memory_put(key, value, expires_at)  # 回填一级缓存
+        return hits
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items: Dict[str, Any], ttl_seconds: float, memory_only: bool = False):
+        if not items:
+            return
+        expires_at = time.time() + ttl_seconds
+        with self._lock:
+            for key, value in items.items():
+                self._memory_put(key, value, expires_at)
+            if memory_only or self._db is None:
+                return
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                [(k, json.dumps(v), expires_at) for k, v in items.items()],
+            )
+            self._disk_writes += len(items)
+            if self._disk_writes >= 1000:
+                self._disk_writes = 0
+                self._prune_disk()
+
+    def set(self, key: str, value: Any, ttl_seconds: float, memory_only: bool = False):
+        self.set_many({key: value}, ttl_seconds, memory_only=memory_only)
+
+    def _prune_disk(self):
+        """删除过期项；仍超过上限时按到期时间淘汰最早的一批。"""
+        self._db.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)", (overflow,)
+            )
@@ -0,0 +1,158 @@
+"""
+进程内轻量指标：计时 span 聚合为直方图，事件计数为计数器，/metrics 以 Prometheus 文本格式输出。
+
+    with metrics.span('similarity_scan'):
+        ...
+    metrics.CACHE_REQUESTS.inc(cache='playlist_seeds', result='hit')
+
+记录时只在锁内更新几个整数 (单次约 1-2 微秒)，文本序列化只在抓取 /metrics 时发生；
+METRICS_ENABLED=0 时 span / inc / observe 直接返回。
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+ENABLED = os.getenv('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+
+# 秒级延迟分桶：覆盖亚毫秒的内存操作到数十秒的外部 API 分页
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各桶计数 (非累计，最后一个为 +Inf), 总和, 次数]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float('inf')), counts):
+                cumulative += n
+                le = ('le', _format_value(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+_registry: List = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+STAGE_SECONDS = _register(Histogram(
+    'rec_stage_seconds', '推荐链路各阶段耗时 (秒)', ('stage',)))
+HTTP_REQUEST_SECONDS = _register(Histogram(
+    'http_request_seconds', 'HTTP 请求耗时 (秒)', ('endpoint',)))
+HTTP_REQUESTS = _register(Counter(
+    'http_requests_total', 'HTTP 请求数', ('endpoint', 'status')))
+CACHE_REQUESTS = _register(Counter(
+    'rec_cache_requests_total', '缓存查询次数 (result=hit/miss)', ('cache', 'result')))
+FALLBACK_MATCHES = _register(Counter(
+    'rec_fallback_matches_total', '种子 id 未命中时按 名称+歌手 回退匹配的结果', ('result',)))
+BACKEND_ERRORS = _register(Counter(
+    'rec_backend_errors_total', 'Kafka / Redis / 本地事件文件等外部依赖的失败次数', ('backend', 'op')))
+
+
+@contextmanager
+def span(stage: str):
+    """计时一个阶段并记入 rec_stage_seconds{stage=...} (异常时同样记录)；也可用作装饰器。"""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def gauge_lines(name: str, documentation: str, values: Dict[str, float]) -> List[str]:
+    """把现有的 stats() 字典 (准入控制、并发合并等) 在抓取时转成 gauge，只输出数值项。"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for key, value in sorted(values.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f'{name}{{key="{_escape(key)}"}} {_format_value(value)}')
+    return lines
+
+
+def render(extra: Iterable[str] = ()) -> str:
+    """Prometheus 文本格式 (text/plain; version=0.0.4)。"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    lines.extend(extra)
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,295 @@
+"""
+本地 Mock Spotify Web API，用于抓取层压测、端到端压测 (loadtest.py) 与离线联调 (无需真实账号与网络)。
+
+    python mock_spotify.py --port 8900 --latency-ms 50
+    python mock_spotify.py --port 8900 --dataset data/dataset.csv   # 歌单歌曲取自离线库，推荐能命中
+
+Web API (均挂在 /v1 下，需带 Bearer token，任意 token 均可)：
+    GET /playlists/<id>, /playlists/<id>/tracks (limit/offset 分页)
+    GET /tracks/<id>, /tracks?ids=..., /artists/<id>, /artists?ids=...
+    GET /me, /me/playlists (limit/offset 分页)
+账号服务 (模拟 accounts.spotify.com)：
+    GET  /authorize   直接 302 回 redirect_uri?code=...&state=... (不显示授权页)
+    POST /api/token   authorization_code / refresh_token / client_credentials
+
+让 Flask 应用指向本服务 (见 .env.example)：
+    SPOTIFY_API_BASE=http://127.0.0.1:8900/v1
+    SPOTIFY_ACCOUNTS_BASE=http://127.0.0.1:8900
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _fake_id(*parts) -> str:
+    return hashlib.md5(':'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:22]
+
+
+def load_pool(csv_path: str, limit: Optional[int] = None) -> List[Tuple[str, str, str]]:
+    """从离线数据集读取 (track_id, track_name, artist_name)，作为 Mock 歌单的曲库。"""
+    import pandas as pd
+    df = pd.read_csv(csv_path, usecols=['track_id', 'track_name', 'artist_name'], nrows=limit)
+    df = df.dropna().drop_duplicates(subset=['track_id'])
+    return list(df[['track_id', 'track_name', 'artist_name']].astype(str).itertuples(index=False, name=None))
+
+
+class MockCatalog:
+    """
+    确定性生成歌单/歌曲/歌手数据：同一个 id 每次返回相同内容。
+    给定 pool (track_id, 歌名, 歌手) 时，歌单歌曲从中按歌单 id 确定性抽取，歌曲信息与离线库一致。
+    """
+
+    def __init__(self, tracks_per_playlist: int = 200, pool: Optional[List[Tuple[str, str, str]]] = None,
+                 playlists_per_user: int = 8):
+        self.tracks_per_playlist = tracks_per_playlist
+        self.playlists_per_user = playlists_per_user
+        self.pool = pool or []
+        self._pool_map = {tid: (name, artist) for tid, name, artist in self.pool}
+
+    def playlist_track_ids(self, playlist_id: str) -> List[str]:
+        if self.pool:
+            rng = random.Random(playlist_id)
+            return [self.pool[rng.randrange(len(self.pool))][0] for _ in range(self.tracks_per_playlist)]
+        return [_fake_id(playlist_id, i) for i in range(self.tracks_per_playlist)]
+
+    def user_playlist_ids(self, user_id: str) -> List[str]:
+        return [f"mock_{_fake_id('playlist', user_id, i)}" for i in range(self.playlists_per_user)]
+
+    def track(self, track_id: str) -> Dict[str, Any]:
+        name, artist = self._pool_map.get(track_id, (f"Track {track_id[:6]}", None))
+        artist_id = _fake_id('artist', artist or track_id[:2])
+        return {
+            'id': track_id,
+            'type': 'track',
+            'name': name,
+            'is_local': False,
+            'popularity': int(_fake_id('popularity', track_id)[:2], 16) % 100,
+            'preview_url': None,
+            'external_urls': {'spotify': f"https://open.spotify.com/track/{track_id}"},
+            'artists': [{'id': artist_id, 'name': artist or f"Artist {artist_id[:4]}"}],
+            'album': {'images': [{'url': f"https://i.scdn.co/image/{track_id}"}], 'release_date': '2020-01-01'},
+        }
+
+    def artist(self, artist_id: str) -> Dict[str, Any]:
+        return {'id': artist_id, 'name': f"Artist {artist_id[:4]}", 'genres': ['pop', 'indie pop']}
+
+    def playlist(self, playlist_id: str) -> Dict[str, Any]:
+        return {
+            'id': playlist_id,
+            'name': f"Playlist {playlist_id}",
+            'description': 'mock playlist',
+            'images': [],
+            'snapshot_id': _fake_id('snapshot', playlist_id, self.tracks_per_playlist),
+            'tracks': {'total': self.tracks_per_playlist},
+        }
+
+
+def _page(items: List[Any], query: Dict[str, str], next_base: str, max_limit: int) -> Dict[str, Any]:
+    """Spotify 风格的 limit/offset 分页体。"""
+    limit = min(int(query.get('limit', max_limit)), max_limit)
+    offset = int(query.get('offset', 0))
+    next_url = None
+    if offset + limit < len(items):
+        next_url = f"{next_base}?offset={offset + limit}&limit={limit}"
+    return {'items': items[offset:offset + limit], 'total': len(items), 'limit': limit, 'offset': offset,
+            'next': next_url}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MockSpotifyServer._HTTPServer"
+
+    def log_message(self, format, *args):  # noqa: A002 - 静默访问日志
+        pass
+
+    def _send(self, status: int, body: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body or {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(self, location: str):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _before(self) -> bool:
+        """模拟延迟与限流；被限流时已写出 429 并返回 False。"""
+        owner = self.server.owner
+        if owner.latency_ms:
+            time.sleep(owner.latency_ms / 1000.0)
+        if owner.should_rate_limit():
+            self._send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}, {'Retry-After': '0'})
+            return False
+        return True
+
+    def do_GET(self):  # noqa: N802
+        owner = self.server.owner
+        parsed = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        parts = [p for p in parsed.path.split('/') if p]
+        if parts == ['authorize']:
+            # 授权页：直接同意并带 code 跳回应用
+            code = owner.issue_code(query.get('scope', ''))
+            params = {'code': code}
+            if 'state' in query:
+                params['state'] = query['state']
+            self._redirect(f"{query.get('redirect_uri', '')}?{urllib.parse.urlencode(params)}")
+            return
+        if not self._before():
+            return
+        if parts[:1] != ['v1']:
+            self._send(404, {'error': {'status': 404, 'message': 'not found'}})
+            return
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self._send(401, {'error': {'status': 401, 'message': 'No token provided'}})
+            return
+        parts = parts[1:]
+        catalog = owner.catalog
+        base = f"http://{self.headers.get('Host')}/v1"
+
+        if parts == ['me']:
+            self._send(200, {'id': 'mock_user', 'display_name': 'Mock User', 'email': 'mock@example.com', 'images': []})
+        elif parts == ['me', 'playlists']:
+            items = [catalog.playlist(pid) for pid in catalog.user_playlist_ids('mock_user')]
+            self._send(200, _page(items, query, f"{base}/me/playlists", 50))
+        elif len(parts) == 2 and parts[0] == 'playlists':
+            self._send(200, catalog.playlist(parts[1]))
+        elif len(parts) == 3 and parts[0] == 'playlists' and parts[2] == 'tracks':
+            ids = catalog.playlist_track_ids(parts[1])
+            body = _page(ids, query, f"{base}/playlists/{parts[1]}/tracks", 100)
+            body['items'] = [{'track': catalog.track(tid)} for tid in body['items']]
+            self._send(200, body)
+        elif parts == ['tracks']:
+            ids = [x for x in query.get('ids', '').split(',') if x]
+            self._send(200, {'tracks': [catalog.track(tid) for tid in ids]})
+        elif len(parts) == 2 and parts[0] == 'tracks':
+            self._send(200, catalog.track(parts[1]))
+        elif parts == ['artists']:
+            ids = [x for x in query.get('ids', '').split(',') if x]
+            self._send(200, {'artists': [catalog.artist(aid) for aid in ids]})
+        elif len(parts) == 2 and parts[0] == 'artists':
+            self._send(200, catalog.artist(parts[1]))
+        else:
+            self._send(404, {'error': {'status': 404, 'message': 'not found'}})
+
+    def do_POST(self):  # noqa: N802
+        owner = self.server.owner
+        parsed = urllib.parse.urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode('utf-8'))) if length else {}
+        if parsed.path.rstrip('/') != '/api/token':
+            self._send(404, {'error': {'status': 404, 'message': 'not found'}})
+            return
+        if not self._before():
+            return
+        body = owner.token_response(form)
+        if body is None:
+            self._send(400, {'error': 'invalid_grant', 'error_description': 'Invalid authorization code'})
+        else:
+            self._send(200, body)
+
+
+class MockSpotifyServer:
+    """在后台线程运行的 Mock 服务器，可作为上下文管理器使用。"""
+
+    class _HTTPServer(ThreadingHTTPServer):
+        daemon_threads = True
+        owner: "MockSpotifyServer"
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0,
+                 tracks_per_playlist: int = 200, rate_limit_every: int = 0,
+                 pool: Optional[List[Tuple[str, str, str]]] = None, token_ttl: int = 3600):
+        self.latency_ms = latency_ms
+        self.rate_limit_every = rate_limit_every
+        self.catalog = MockCatalog(tracks_per_playlist, pool=pool)
+        self.token_ttl = token_ttl
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        # 已签发但未兑换的授权码 -> scope
+        self._codes: Dict[str, str] = {}
+        self.httpd = self._HTTPServer((host, port), _Handler)
+        self.httpd.owner = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.base_url}/v1"
+
+    def should_rate_limit(self) -> bool:
+        with self._count_lock:
+            self.request_count += 1
+            return bool(self.rate_limit_every) and self.request_count % self.rate_limit_every == 0
+
+    def issue_code(self, scope: str) -> str:
+        code = uuid.uuid4().hex
+        with self._count_lock:
+            self._codes[code] = scope
+        return code
+
+    def token_response(self, form: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """POST /api/token 的响应体；授权码无效时返回 None。"""
+        grant = form.get('grant_type')
+        body = {'access_token': f"mock-{uuid.uuid4().hex}", 'token_type': 'Bearer', 'expires_in': self.token_ttl}
+        if grant == 'authorization_code':
+            with self._count_lock:
+                scope = self._codes.pop(form.get('code', ''), None)
+            if scope is None:
+                return None
+            body.update(scope=scope, refresh_token=f"mock-refresh-{uuid.uuid4().hex}")
+        elif grant == 'refresh_token':
+            body.update(scope=form.get('scope', ''), refresh_token=form.get('refresh_token'))
+        elif grant != 'client_credentials':
+            return None
+        return body
+
+    def start(self) -> "MockSpotifyServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本地 Mock Spotify Web API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--tracks-per-playlist', type=int, default=200)
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    parser.add_argument('--dataset', help='离线数据集 CSV：歌单歌曲从中抽取 (推荐可命中)')
+    parser.add_argument('--pool-size', type=int, default=200000, help='从数据集读取的歌曲数上限')
+    args = parser.parse_args()
+    pool = load_pool(args.dataset, args.pool_size) if args.dataset else None
+    server = MockSpotifyServer(args.host, args.port, args.latency_ms, args.tracks_per_playlist, args.rate_limit_every,
+                               pool=pool)
+    print(f"[INFO] Mock Spotify API 已启动: {server.api_base}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
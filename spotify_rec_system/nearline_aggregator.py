@@ -0,0 +1,375 @@
+"""
+近线聚合进程：消费 EventProducer 上报的行为事件 (Kafka 或本地 spool 文件)，
+在有界内存内维护窗口热度与共现 (co-view) 特征，并批量写入 RedisFeatureStore。
+
+用法:
+    python nearline_aggregator.py --source kafka
+    python nearline_aggregator.py --source spool --spool events.jsonl --follow
+    python nearline_aggregator.py --replay events.jsonl --bench      # 回放压测 (events/sec)
+    python nearline_aggregator.py --synthetic 500000 --bench         # 合成事件压测
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from infra import RedisFeatureStore
+
+try:
+    from kafka import KafkaConsumer  # type: ignore
+except Exception:  # pragma: no cover - 在缺省环境下可能不存在
+    KafkaConsumer = None
+
+load_dotenv()
+
+# 不计入"浏览"的事件类型 (负反馈)
+NON_VIEW_TYPES = {'skip', 'recommendation_served'}
+
+
+class CountMinSketch:
+    """Count-Min Sketch：固定 depth x width 计数表，估计值只会偏大不会偏小。"""
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        # 逐事件更新是标量操作，用 array 比 numpy 花式索引快一个数量级
+        self.table = [array('I', bytes(4 * width)) for _ in range(depth)]
+
+    def _indices(self, key: str) -> List[int]:
+        # 双重哈希: h_i = h1 + i * h2，一次 blake2b 即可得到 depth 个下标
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], 'little')
+        h2 = int.from_bytes(digest[4:], 'little') | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """累加并返回更新后的估计值。"""
+        estimate = None
+        for row, idx in zip(self.table, self._indices(key)):
+            value = row[idx] + count
+            row[idx] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        return min(row[idx] for row, idx in zip(self.table, self._indices(key)))
+
+    def clear(self):
+        for row in self.table:
+            row[:] = array('I', bytes(4 * self.width))
+
+
+class HeavyHitters:
+    """基于 CMS 估计值的 Top-K 候选集：超过 2*capacity 时裁剪回 capacity，内存有界。"""
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.candidates: Dict[str, int] = {}
+
+    def offer(self, key: str, estimate: int):
+        self.candidates[key] = estimate
+        if len(self.candidates) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        top = sorted(self.candidates.items(), key=lambda kv: kv[1], reverse=True)[:self.capacity]
+        self.candidates = dict(top)
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[str, int]]:
+        items = sorted(self.candidates.items(), key=lambda kv: kv[1], reverse=True)
+        return items[:k or self.capacity]
+
+    def clear(self):
+        self.candidates.clear()
+
+
+class WindowedCounter:
+    """滑动窗口计数：num_windows 个时间桶，每桶一个 CMS + HeavyHitters，按事件时间轮转。"""
+
+    def __init__(self, window_seconds: int = 3600, num_windows: int = 24,
+                 width: int = 4096, depth: int = 4, capacity: int = 1000):
+        self.window_seconds = window_seconds
+        self.num_windows = num_windows
+        self.sketches = [CountMinSketch(width, depth) for _ in range(num_windows)]
+        self.hitters = [HeavyHitters(capacity) for _ in range(num_windows)]
+        self.bucket_ids = [-1] * num_windows
+
+    def _slot(self, ts: int) -> int:
+        bucket = int(ts) // self.window_seconds
+        slot = bucket % self.num_windows
+        if self.bucket_ids[slot] != bucket:
+            # 过期桶复用，内存不随时间增长
+            self.sketches[slot].clear()
+            self.hitters[slot].clear()
+            self.bucket_ids[slot] = bucket
+        return slot
+
+    def add(self, key: str, ts: int, count: int = 1):
+        slot = self._slot(ts)
+        self.hitters[slot].offer(key, self.sketches[slot].add(key, count))
+
+    def _live_slots(self, now: int) -> List[int]:
+        current = int(now) // self.window_seconds
+        return [s for s, b in enumerate(self.bucket_ids) if b >= 0 and current - b < self.num_windows]
+
+    def estimate(self, key: str, now: int) -> int:
+        return sum(self.sketches[s].estimate(key) for s in self._live_slots(now))
+
+    def top(self, k: int, now: int) -> List[Tuple[str, int]]:
+        """窗口内 Top-K：以各桶候选的并集为候选，再用全窗口 CMS 估计值排序。"""
+        slots = self._live_slots(now)
+        keys = set()
+        for s in slots:
+            keys.update(self.hitters[s].candidates)
+        scored = [(key, sum(self.sketches[s].estimate(key) for s in slots)) for key in keys]
+        scored.sort(key=lambda kv: kv[1], reverse=True)
+        return scored[:k]
+
+
+class NearlineAggregator:
+    """行为事件 -> 热度 / 曝光 / 共现聚合。"""
+
+    def __init__(self, window_seconds: int = 3600, num_windows: int = 24, session_history: int = 5,
+                 max_sessions: int = 100000, sketch_width: int = 4096, top_k: int = 1000):
+        self.views = WindowedCounter(window_seconds, num_windows, sketch_width, 4, top_k)
+        self.impressions = WindowedCounter(window_seconds, num_windows, sketch_width, 4, top_k)
+        self.pairs = WindowedCounter(window_seconds, num_windows, sketch_width * 4, 4, top_k * 4)
+        self.session_history = session_history
+        self.max_sessions = max_sessions
+        # 每个会话最近浏览的 track，LRU 淘汰以保证内存有界
+        self.sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self.events_processed = 0
+        self.last_ts = 0
+
+    def add(self, event: Dict[str, Any]):
+        event_type = event.get('type')
+        ts = int(event.get('ts') or time.time())
+        self.last_ts = max(self.last_ts, ts)
+        self.events_processed += 1
+
+        if event_type == 'recommendation_served':
+            for track_id in event.get('track_ids') or []:
+                self.impressions.add(str(track_id), ts)
+            return
+
+        track_id = event.get('track_id')
+        if not track_id or event_type in NON_VIEW_TYPES:
+            return
+        track_id = str(track_id)
+        self.views.add(track_id, ts)
+
+        session_key = event.get('user_id') or event.get('client_id')
+        if not session_key:
+            return
+        history = self.sessions.get(session_key)
+        if history is None:
+            history = deque(maxlen=self.session_history)
+            self.sessions[session_key] = history
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(session_key)
+        for other in history:
+            if other != track_id:
+                a, b = (other, track_id) if other < track_id else (track_id, other)
+                self.pairs.add(f"{a}|{b}", ts)
+        history.append(track_id)
+
+    def snapshot(self, top_k: int = 500, neighbors_per_track: int = 20, now: Optional[int] = None):
+        """
+        导出当前窗口的聚合结果：(热门浏览, 热门曝光, 每首歌的共现邻居)。
+        now 为窗口的参考时间：回放时默认取最后一条事件的时间；实时消费时应传入当前时间，
+        否则流量停止后窗口不会老化，空闲的流会一直重复发布同一份过期结果。
+        """
+        now = now or self.last_ts or int(time.time())
+        popular = dict(self.views.top(top_k, now))
+        exposed = dict(self.impressions.top(top_k, now))
+        neighbors: Dict[str, List[Tuple[str, int]]] = {}
+        for pair, count in self.pairs.top(top_k * 4, now):
+            a, b = pair.split('|', 1)
+            neighbors.setdefault(a, []).append((b, count))
+            neighbors.setdefault(b, []).append((a, count))
+        for key in neighbors:
+            neighbors[key] = sorted(neighbors[key], key=lambda kv: kv[1], reverse=True)[:neighbors_per_track]
+        return popular, exposed, neighbors
+
+    def publish(self, store: RedisFeatureStore, ttl_seconds: int = 3600, top_k: int = 500,
+                now: Optional[int] = None) -> bool:
+        popular, exposed, neighbors = self.snapshot(top_k=top_k, now=now)
+        ok = store.publish_popularity(popular, window='views', ttl_seconds=ttl_seconds)
+        ok = store.publish_popularity(exposed, window='impressions', ttl_seconds=ttl_seconds) and ok
+        ok = store.publish_coviews(neighbors, ttl_seconds=ttl_seconds) and ok
+        return ok
+
+
+# --- 事件源 ---
+
+def iter_spool_events(path: str, follow: bool = False, poll_interval: float = 0.5) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    读取 EventProducer 写出的 JSON Lines 文件；follow=True 时类似 tail -f。
+    follow 模式下没有新事件时每 poll_interval 秒产出一次 None (心跳)，供消费循环按时发布；
+    生产方尚未写完的行 (没有结尾换行) 暂存，等下次读到换行后再解析，不会被当作坏行丢弃。
+    """
+    pending = ''
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.readline()
+            if chunk:
+                pending += chunk
+                if not pending.endswith('\n'):
+                    continue
+            elif not follow:
+                # 文件已读完：最后一行没有换行也是完整的
+                if not pending:
+                    return
+            else:
+                yield None
+                time.sleep(poll_interval)
+                continue
+            line, pending = pending.strip(), ''
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"[WARN] 跳过无法解析的事件: {line[:80]}")
+
+
+def iter_kafka_events(topic: Optional[str] = None, bootstrap_servers: Optional[str] = None,
+                      group_id: str = 'nearline-aggregator', poll_timeout_ms: int = 1000
+                      ) -> Iterator[Optional[Dict[str, Any]]]:
+    """持续消费 Kafka；一次 poll 超时没有消息时产出 None (心跳)，空闲时消费循环也能按时发布。"""
+    if KafkaConsumer is None:
+        raise RuntimeError("未安装 kafka-python，无法从 Kafka 消费")
+    brokers = bootstrap_servers or os.getenv("KAFKA_BOOTSTRAP_SERVERS")
+    if not brokers:
+        raise RuntimeError("未配置 KAFKA_BOOTSTRAP_SERVERS")
+    consumer = KafkaConsumer(
+        topic or os.getenv("KAFKA_TOPIC_EVENTS", "spotify_events"),
+        bootstrap_servers=brokers.split(","),
+        group_id=group_id,
+        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
+        auto_offset_reset='latest',
+    )
+    while True:
+        batches = consumer.poll(timeout_ms=poll_timeout_ms)
+        if not batches:
+            yield None
+            continue
+        for records in batches.values():
+            for message in records:
+                yield message.value
+
+
+def synthetic_events(n: int, num_tracks: int = 50000, num_sessions: int = 5000, seed: int = 42) -> List[Dict[str, Any]]:
+    """生成带长尾分布的合成事件，用于压测。"""
+    rng = random.Random(seed)
+    tracks = [f"track{i:07d}" for i in range(num_tracks)]
+    weights = [1.0 / (i + 1) for i in range(num_tracks)]
+    picks = rng.choices(tracks, weights=weights, k=n)
+    ts0 = int(time.time()) - 3600
+    events = []
+    for i, track_id in enumerate(picks):
+        ts = ts0 + i * 3600 // max(n, 1)
+        if i % 20 == 0:
+            events.append({'type': 'recommendation_served', 'user_id': f"u{rng.randrange(num_sessions)}",
+                           'track_ids': rng.sample(tracks[:5000], 10), 'ts': ts})
+        else:
+            events.append({'type': 'track_view_offline', 'client_id': f"c{rng.randrange(num_sessions)}",
+                           'track_id': track_id, 'ts': ts})
+    return events
+
+
+def run(events: Iterable[Optional[Dict[str, Any]]], aggregator: NearlineAggregator, store: RedisFeatureStore,
+        publish_interval: float = 10.0, ttl_seconds: int = 3600, live: bool = False):
+    """
+    消费循环：持续聚合，每 publish_interval 秒批量写一次 Redis。
+    事件源在空闲时产出 None (心跳)，因此流量停止后已聚合的窗口也会按时发布。
+    live (Kafka / --follow) 时窗口按当前时间老化，空闲期间过期的热度与共现随之减少直至清空；
+    回放时按事件时间，结果与回放速度无关。
+    """
+    def publish():
+        aggregator.publish(store, ttl_seconds=ttl_seconds, now=int(time.time()) if live else None)
+
+    last_publish = time.time()
+    for event in events:
+        if event is not None:
+            aggregator.add(event)
+        if time.time() - last_publish >= publish_interval:
+            publish()
+            last_publish = time.time()
+    publish()
+
+
+def benchmark(events: List[Dict[str, Any]], aggregator: NearlineAggregator) -> Dict[str, float]:
+    start = time.perf_counter()
+    for event in events:
+        aggregator.add(event)
+    ingest_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    aggregator.snapshot()
+    snapshot_seconds = time.perf_counter() - start
+    return {
+        'events': len(events),
+        'seconds': round(ingest_seconds, 4),
+        'events_per_sec': round(len(events) / ingest_seconds, 1) if ingest_seconds else 0.0,
+        'snapshot_seconds': round(snapshot_seconds, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="近线行为聚合 (热度 / 共现)")
+    parser.add_argument('--source', choices=['kafka', 'spool'], default='spool')
+    parser.add_argument('--spool', default=os.getenv('EVENT_SPOOL_PATH'), help='本地事件文件 (JSON Lines)')
+    parser.add_argument('--follow', action='store_true', help='持续追踪 spool 文件的新事件')
+    parser.add_argument('--replay', help='回放指定事件文件 (等价于 --source spool --spool FILE)')
+    parser.add_argument('--synthetic', type=int, default=0, help='使用 N 条合成事件')
+    parser.add_argument('--bench', action='store_true', help='只测吞吐，不写 Redis')
+    parser.add_argument('--window-seconds', type=int, default=3600)
+    parser.add_argument('--num-windows', type=int, default=24)
+    parser.add_argument('--publish-interval', type=float, default=10.0)
+    args = parser.parse_args()
+
+    aggregator = NearlineAggregator(window_seconds=args.window_seconds, num_windows=args.num_windows)
+
+    if args.bench:
+        if args.synthetic:
+            events = synthetic_events(args.synthetic)
+        else:
+            path = args.replay or args.spool
+            if not path:
+                parser.error("--bench 需要 --replay FILE 或 --synthetic N")
+            events = list(iter_spool_events(path))
+        print(json.dumps(benchmark(events, aggregator)))
+        return
+
+    if args.synthetic:
+        events = synthetic_events(args.synthetic)
+    elif args.replay:
+        events = iter_spool_events(args.replay)
+    elif args.source == 'kafka':
+        events = iter_kafka_events()
+    else:
+        if not args.spool:
+            parser.error("spool 模式需要 --spool 或环境变量 EVENT_SPOOL_PATH")
+        events = iter_spool_events(args.spool, follow=args.follow)
+
+    store = RedisFeatureStore()
+    if not store.enabled:
+        print("[WARN] Redis 未启用，聚合结果不会被发布")
+    live = not (args.synthetic or args.replay) and (args.source == 'kafka' or args.follow)
+    run(events, aggregator, store, publish_interval=args.publish_interval, live=live)
+    print(f"[INFO] 聚合完成，共处理 {aggregator.events_processed} 条事件。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from infra import RedisFeatureStore
+
+
+class PlaylistSeedCache:
+    """
+    歌单快照 -> 已解析的种子行号。
+
+    key = (playlist_id, snapshot_id, index_version)：歌单内容变化会产生新的 snapshot_id，
+    模型/库变化会改变 index_version，两者任一变化都自然失效，无需主动清理。
+    命中时 /recommend 可跳过歌单分页与种子解析 (含 名称+歌手 回退扫描)，只做相似度检索。
+    """
+
+    def __init__(self, feature_store: Optional[RedisFeatureStore] = None, ttl_seconds: int = 86400,
+                 max_local_entries: int = 1000):
+        self.feature_store = feature_store
+        self.ttl_seconds = ttl_seconds
+        self.max_local_entries = max_local_entries
+        self._local: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, playlist_id: str, snapshot_id: Optional[str], index_version: str) -> Optional[np.ndarray]:
+        if not playlist_id or not snapshot_id:
+            return None
+        key = (playlist_id, snapshot_id, index_version)
+        with self._lock:
+            positions = self._local.get(key)
+            if positions is not None:
+                self._local.move_to_end(key)
+                return positions
+        if self.feature_store and self.feature_store.enabled:
+            data = self.feature_store.get_playlist_seeds(playlist_id, snapshot_id, index_version)
+            if data is not None:
+                positions = np.asarray(data, dtype=np.int64)
+                self._put_local(key, positions)
+                return positions
+        return None
+
+    def put(self, playlist_id: str, snapshot_id: Optional[str], index_version: str, positions: np.ndarray):
+        if not playlist_id or not snapshot_id:
+            return
+        positions = np.asarray(positions, dtype=np.int64)
+        self._put_local((playlist_id, snapshot_id, index_version), positions)
+        if self.feature_store and self.feature_store.enabled:
+            self.feature_store.cache_playlist_seeds(playlist_id, snapshot_id, index_version,
+                                                    positions.tolist(), ttl_seconds=self.ttl_seconds)
+
+    def _put_local(self, key: tuple, positions: np.ndarray):
+        with self._lock:
+            self._local[key] = positions
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
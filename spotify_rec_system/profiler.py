@@ -0,0 +1,263 @@
+"""
+慢请求剖析 (默认关闭)：对选中的请求采集调用栈，耗时超过阈值时把剖析结果写入磁盘环形目录，
+由 /admin/profiles 列出与下载，用来定位偶发的慢 /recommend、/songs?q= 究竟卡在哪个 pandas / NumPy 调用。
+
+两种模式 (PROFILER_MODE)：
+- sample   后台线程按固定间隔读取请求线程的调用栈 (sys._current_frames)，开销小，可常开；
+           结果为折叠栈 (collapsed stacks，可直接喂给 flamegraph.pl / speedscope) 与按函数汇总的采样数。
+- cprofile 确定性剖析 (cProfile)，数据精确但开销较大；同一时刻只剖析一个请求，其余请求照常处理。
+
+两种模式都只覆盖处理请求的线程，交给线程池 / 分片进程的扫描只体现为等待时间。
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+MODES = ('off', 'sample', 'cprofile')
+# 每份剖析保留的函数条数 (按累计耗时 / 采样数排序)
+TOP_FUNCTIONS = 40
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class _Sampler(threading.Thread):
+    """按 interval 秒采样目标线程的调用栈，累计为 折叠栈 -> 次数。"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='request-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=1.0)
+
+
+class RequestProfiler:
+    """
+    routes 为空时所有请求都可被选中，否则只剖析 endpoint 名或路径前缀匹配的请求 (如 "recommend,/songs")；
+    选中的请求再按 sample_rate 抽样。只有耗时 >= threshold_ms 的剖析会落盘，目录中最多保留 max_files 份。
+    """
+
+    def __init__(self, mode: str = 'off', routes: str = '', sample_rate: float = 1.0, threshold_ms: float = 1000.0,
+                 directory: Optional[str] = None, max_files: int = 50, interval_ms: float = 5.0):
+        self.mode = mode if mode in MODES else 'off'
+        self.routes = [r.strip() for r in routes.split(',') if r.strip()]
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self.threshold = float(threshold_ms) / 1000.0
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_cache', 'profiles')
+        self.max_files = max(int(max_files), 1)
+        self.interval = max(float(interval_ms), 0.5) / 1000.0
+        # cProfile 同一时刻只能有一个处于激活状态
+        self._cprofile_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stats = {'started': 0, 'saved': 0, 'skipped_busy': 0}
+
+    @classmethod
+    def from_env(cls) -> 'RequestProfiler':
+        return cls(
+            mode=os.getenv('PROFILER_MODE', 'off').strip().lower(),
+            routes=os.getenv('PROFILER_ROUTES', ''),
+            sample_rate=float(os.getenv('PROFILER_SAMPLE_RATE', '1.0')),
+            threshold_ms=float(os.getenv('PROFILER_THRESHOLD_MS', '1000')),
+            directory=os.getenv('PROFILER_DIR') or None,
+            max_files=int(os.getenv('PROFILER_MAX_FILES', '50')),
+            interval_ms=float(os.getenv('PROFILER_INTERVAL_MS', '5')),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self._stats)
+
+    def _selected(self, endpoint: Optional[str], path: str) -> bool:
+        if self.routes and not any(r == endpoint or (r.startswith('/') and path.startswith(r)) for r in self.routes):
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    # --- 采集 ---
+
+    def start(self, endpoint: Optional[str], path: str) -> Optional[dict]:
+        """请求开始时调用；未选中时返回 None。"""
+        if not self.enabled or not self._selected(endpoint, path):
+            return None
+        handle = {'endpoint': endpoint or 'unmatched', 'path': path, 'mode': self.mode,
+                  'started_at': time.time(), 'started': time.perf_counter()}
+        if self.mode == 'cprofile':
+            if not self._cprofile_lock.acquire(blocking=False):
+                self._stats['skipped_busy'] += 1
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except Exception:
+                self._cprofile_lock.release()
+                self._stats['skipped_busy'] += 1
+                return None
+            handle['profile'] = profile
+        else:
+            sampler = _Sampler(threading.get_ident(), self.interval)
+            sampler.start()
+            handle['sampler'] = sampler
+        self._stats['started'] += 1
+        return handle
+
+    def finish(self, handle: Optional[dict], **meta) -> Optional[str]:
+        """请求结束时调用 (与 start 同一线程)；超过阈值时写盘并返回剖析名。"""
+        if handle is None:
+            return None
+        elapsed = time.perf_counter() - handle['started']
+        profile = handle.get('profile')
+        if profile is not None:
+            profile.disable()
+            self._cprofile_lock.release()
+        sampler = handle.get('sampler')
+        if sampler is not None:
+            sampler.stop()
+        if elapsed < self.threshold:
+            return None
+        try:
+            return self._save(handle, elapsed, meta)
+        except Exception as exc:
+            print(f"[WARN] 保存慢请求剖析失败: {exc}")
+            return None
+
+    # --- 环形目录 ---
+
+    def _save(self, handle: dict, elapsed: float, meta: dict) -> str:
+        endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', handle['endpoint'])
+        name = f"{int(handle['started_at'] * 1000)}_{endpoint}_{int(elapsed * 1000)}ms"
+        record = {
+            'name': name,
+            'endpoint': handle['endpoint'],
+            'path': handle['path'],
+            'mode': handle['mode'],
+            'started_at': round(handle['started_at'], 3),
+            'elapsed_ms': round(elapsed * 1000, 1),
+            **meta,
+        }
+        raw = None
+        profile = handle.get('profile')
+        if profile is not None:
+            record.update(self._summarize_cprofile(profile))
+            raw = profile
+        else:
+            record.update(self._summarize_samples(handle['sampler']))
+
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if raw is not None:
+                raw.dump_stats(os.path.join(self.directory, name + '.prof'))
+            tmp = os.path.join(self.directory, name + '.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.directory, name + '.json'))
+            self._trim()
+        self._stats['saved'] += 1
+        return name
+
+    @staticmethod
+    def _summarize_cprofile(profile) -> dict:
+        stats = pstats.Stats(profile)
+        rows = []
+        for (filename, lineno, func), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({'function': f"{func} ({os.path.basename(filename)}:{lineno})", 'file': filename,
+                         'ncalls': nc, 'tottime': round(tt, 6), 'cumtime': round(ct, 6)})
+        # 热点取自身耗时 (tottime) 最大的函数，外层框架函数的累计耗时总是最大，没有定位意义
+        hotspot = max(rows, key=lambda r: r['tottime'])['function'] if rows else None
+        rows.sort(key=lambda r: r['cumtime'], reverse=True)
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        return {'hotspot': hotspot, 'top': rows[:TOP_FUNCTIONS], 'text': text.getvalue()}
+
+    @staticmethod
+    def _summarize_samples(sampler: _Sampler) -> dict:
+        # 函数出现在栈中的采样数 (含子调用) 与位于栈顶的采样数 (自身)
+        inclusive, own = Counter(), Counter()
+        for stack, count in sampler.stacks.items():
+            frames = stack.split(';')
+            for label in set(frames):
+                inclusive[label] += count
+            own[frames[-1]] += count
+        rows = [{'function': label, 'samples': n, 'own_samples': own.get(label, 0),
+                 'share': round(n / sampler.samples, 4) if sampler.samples else 0.0}
+                for label, n in inclusive.most_common(TOP_FUNCTIONS)]
+        collapsed = [f"{stack} {count}" for stack, count in sampler.stacks.most_common()]
+        return {'samples': sampler.samples, 'interval_ms': round(sampler.interval * 1000, 3),
+                'hotspot': own.most_common(1)[0][0] if own else None, 'top': rows, 'collapsed': collapsed}
+
+    def _trim(self):
+        names = sorted(f[:-5] for f in os.listdir(self.directory) if f.endswith('.json'))
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            for ext in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, name + ext))
+                except FileNotFoundError:
+                    pass
+
+    # --- 查询 ---
+
+    def list_profiles(self) -> List[dict]:
+        """最新的在前；只返回摘要字段。"""
+        if not os.path.isdir(self.directory):
+            return []
+        out = []
+        for f in sorted(os.listdir(self.directory), reverse=True):
+            if not f.endswith('.json'):
+                continue
+            record = self.load(f[:-5])
+            if record is None:
+                continue
+            summary = {k: v for k, v in record.items() if k not in ('top', 'text', 'collapsed')}
+            summary['has_prof'] = os.path.exists(os.path.join(self.directory, f[:-5] + '.prof'))
+            out.append(summary)
+        return out
+
+    def _path(self, name: str, ext: str) -> Optional[str]:
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', name or ''):
+            return None
+        path = os.path.join(self.directory, name + ext)
+        return path if os.path.exists(path) else None
+
+    def load(self, name: str) -> Optional[dict]:
+        path = self._path(name, '.json')
+        if path is None:
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def prof_path(self, name: str) -> Optional[str]:
+        """cprofile 模式下的原始 pstats 文件 (可用 snakeviz / python -m pstats 打开)。"""
+        return self._path(name, '.prof')
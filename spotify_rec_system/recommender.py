@@ -1,14 +1,27 @@
 import pandas as pd
 import numpy as np
 from dataset_service import SpotifyDataset
-from sklearn.preprocessing import MinMaxScaler
+from singleflight import SingleFlight
+from similarity import top_k, max_sim_top_k, local_positions, merge_top_k, cluster_seeds, rerank_max_sim, cluster_cohesion
+from sharded_index import ShardedIndex
+from filter_index import FilterIndex, exclude_sorted
+from frontier_cache import FrontierCache, PlaylistFrontier
+import metrics
+import memstat
+from sklearn.preprocessing import MinMaxScaler, normalize
 import torch
 from torch import nn, optim
 from torch.utils.data import DataLoader, TensorDataset
 import os
+import gc
+import glob
+import hashlib
 import pickle
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -58,16 +71,208 @@ class Autoencoder(nn.Module):
         decoded = self.decoder(encoded)
         return encoded, decoded
 
+
+class LinearEncoder(nn.Module):
+    """
+    线性 (PCA) 编码器：与 Autoencoder 接口相同 (forward 返回 encoded, decoded)，可直接替换。
+    不需要训练，fit 对缩放后的特征分块累加均值与协方差 (一次遍历)，特征分解后得到投影矩阵；
+    whiten=True 时各主成分再除以标准差，余弦相似度不再被方差最大的一两个方向主导。
+    """
+    def __init__(self, input_dim, latent_dim=None, whiten=True):
+        super(LinearEncoder, self).__init__()
+        latent_dim = min(latent_dim or input_dim, input_dim)
+        self.whiten = whiten
+        self.encoder = nn.Linear(input_dim, latent_dim)
+        self.decoder = nn.Linear(latent_dim, input_dim)
+
+    def forward(self, x):
+        encoded = self.encoder(x)
+        decoded = self.decoder(encoded)
+        return encoded, decoded
+
+    @torch.no_grad()
+    def fit(self, features, chunk_rows=65536):
+        """
+        一次遍历拟合：只保留 d 维和与 d x d 的平方和 (float64)，内存与行数无关。
+        返回 (保留主成分的特征值, 总方差)，两者来自同一个协方差矩阵。
+        """
+        dim = features.shape[1]
+        total = np.zeros(dim)
+        outer = np.zeros((dim, dim))
+        n = 0
+        for start in range(0, features.shape[0], chunk_rows):
+            chunk = np.asarray(features[start:start + chunk_rows], dtype=np.float64)
+            total += chunk.sum(axis=0)
+            outer += chunk.T @ chunk
+            n += len(chunk)
+        mean = total / max(n, 1)
+        cov = outer / max(n - 1, 1) - np.outer(mean, mean) * (n / max(n - 1, 1))
+        total_variance = float(np.trace(cov))
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        order = np.argsort(eigvals)[::-1][:self.encoder.out_features]
+        eigvals, components = np.clip(eigvals[order], 0.0, None), eigvecs[:, order].T  # (latent, input)
+        scale = 1.0 / np.sqrt(eigvals + 1e-6) if self.whiten else np.ones_like(eigvals)
+        weight = components * scale[:, None]
+        self.encoder.weight.copy_(torch.from_numpy(weight).float())
+        self.encoder.bias.copy_(torch.from_numpy(-weight @ mean).float())
+        # 解码为编码的逆 (正交投影回原空间)，仅用于与 Autoencoder 保持相同接口
+        self.decoder.weight.copy_(torch.from_numpy((components / scale[:, None]).T).float())
+        self.decoder.bias.copy_(torch.from_numpy(mean).float())
+        return eigvals, total_variance
+
+# 可选编码器：ae (MLP Autoencoder，默认) / pca (线性投影，秒级构建)
+ENCODERS = ('ae', 'pca')
+
 # --- 2. 推荐系统核心类 ---
 
+class IndexSnapshot:
+    """
+    不可变的检索索引快照：向量矩阵 (只读) + 对应的 DataFrame + 空间标识。
+    引擎切换索引时整体替换引用；检索方法每次调用只读取一次快照，切换期间不会混用新旧状态。
+    启用分片时向量只在分片进程中 (embeddings_norm 为 None)，通过 vectors() 按行号取回；
+    使用分片的检索须先 acquire()，结束后 release()，被替换的快照在最后一次 release 后释放分片版本。
+    """
+    __slots__ = ('embeddings_norm', 'df', 'embedding_space', 'is_interim', 'popular_positions', 'shards', 'filters',
+                 'aliases', 'alias_lists')
+
+    # 预先排好的热门行号数量，降级推荐只在这个范围内挑选
+    POPULAR_TOP_N = 1000
+
+    def __init__(self, embeddings_norm, df, embedding_space, is_interim=False, shards=None, filters=None,
+                 aliases=None, alias_lists=None):
+        if embeddings_norm is not None:
+            embeddings_norm.flags.writeable = False
+        # 重复歌曲合并 (RECOMMENDER_COLLAPSE_DUPLICATES)：别名 id -> 规范 id，规范 id -> 别名 id 列表
+        object.__setattr__(self, 'aliases', aliases if aliases is not None else {})
+        object.__setattr__(self, 'alias_lists', alias_lists if alias_lists is not None else {})
+        object.__setattr__(self, 'shards', shards)  # 可选的 ShardedIndex，存在时向量与全库检索都在分片进程
+        # genre / 年份 / 人气过滤索引，只依赖 df，可在同一 df 的快照之间复用
+        object.__setattr__(self, 'filters', filters if filters is not None else FilterIndex(df))
+        object.__setattr__(self, 'embeddings_norm', embeddings_norm)
+        object.__setattr__(self, 'df', df)
+        object.__setattr__(self, 'embedding_space', embedding_space)
+        object.__setattr__(self, 'is_interim', is_interim)
+        object.__setattr__(self, 'popular_positions', self._popular_positions(df))
+
+    @classmethod
+    def _popular_positions(cls, df):
+        if df is None or 'popularity' not in df.columns or not len(df):
+            return np.array([], dtype=np.int64)
+        popularity = pd.to_numeric(df['popularity'], errors='coerce').fillna(0).to_numpy()
+        top = ContentBasedRecommender._top_k(popularity, cls.POPULAR_TOP_N)
+        top.flags.writeable = False
+        return top
+
+    def __setattr__(self, name, value):
+        raise AttributeError("IndexSnapshot 不可修改，请构造新的快照")
+
+    @property
+    def dim(self):
+        return self.embeddings_norm.shape[1] if self.embeddings_norm is not None else self.shards.dim
+
+    def vectors(self, positions):
+        """按行号取归一化向量 (分片时从分片进程取回)。"""
+        if self.embeddings_norm is not None:
+            return self.embeddings_norm[positions]
+        return self.shards.vectors(positions)
+
+    def acquire(self):
+        """登记一次使用；分片版本已被替换时返回 False，调用方应改用新快照。"""
+        return self.shards is None or self.shards.acquire()
+
+    def release(self):
+        if self.shards is not None:
+            self.shards.release()
+
+    def positions(self, ids):
+        """id -> 行号 (不在库中为 -1)；别名 id 映射到其规范条目的行号。"""
+        ids = [str(x) for x in ids]
+        if self.aliases:
+            ids = [self.aliases.get(x, x) for x in ids]
+        return self.df.index.get_indexer(ids)
+
+    def records(self, positions):
+        """按行号取出歌曲记录；合并了重复歌曲时，规范条目附带 alias_ids。"""
+        records = self.df.iloc[positions].to_dict('records')
+        if self.alias_lists:
+            for record in records:
+                aliases = self.alias_lists.get(record.get('id'))
+                if aliases:
+                    record['alias_ids'] = list(aliases)
+        return records
+
+    @property
+    def version(self):
+        """行号 (position) 的有效版本：向量空间或库大小变化后，外部缓存的行号即失效。"""
+        return f"{self.embedding_space}:{len(self.df)}"
+
+
 class ContentBasedRecommender:
-    def __init__(self, progress_callback=None, fallback_loose=None):
+    # 进程内共享的已初始化引擎 (按模型变体区分) 及其配置视图
+    _instances = {}
+    _views = {}
+    _instances_lock = threading.Lock()
+    # 查询内并行检索共用的线程池 (按需创建，进程内所有引擎共享)
+    _scan_executor = None
+    _scan_executor_workers = 0
+    _scan_executor_lock = threading.Lock()
+
+    @classmethod
+    def register_instance(cls, engine, variant='default'):
+        """登记一个已初始化的引擎，之后 get_instance 直接复用，不再重复加载。"""
+        with cls._instances_lock:
+            cls._instances[variant] = engine
+            cls._views = {k: v for k, v in cls._views.items() if k[0] != variant}
+
+    @classmethod
+    def get_instance(cls, variant='default', fallback_loose=None, build=True):
+        """
+        获取共享引擎。fallback_loose 与引擎自身配置不同时返回一个轻量视图 (RecommenderView)，
+        数据集、Scaler、Embeddings 等重量级状态全部共享，构造代价可忽略。
+        尚无已登记引擎且 build=True 时在锁内构建一次 (并发调用方等待同一次构建)。
+        """
+        engine = cls._instances.get(variant)
+        if engine is None:
+            if not build:
+                return None
+            with cls._instances_lock:
+                engine = cls._instances.get(variant)
+                if engine is None:
+                    engine = cls()
+                    cls._instances[variant] = engine
+        if fallback_loose is None or bool(fallback_loose) == engine.fallback_loose:
+            return engine
+        key = (variant, bool(fallback_loose))
+        view = cls._views.get(key)
+        if view is None or view._engine is not engine:
+            view = RecommenderView(engine, fallback_loose=bool(fallback_loose))
+            cls._views[key] = view
+        return view
+
+    def __init__(self, progress_callback=None, fallback_loose=None, timing_callback=None, ready_callback=None):
         self.progress_callback = progress_callback
+        self.timing_callback = timing_callback
+        # 临时索引可用时回调 ready_callback(self)，调用方可以在训练期间先行提供服务
+        self.ready_callback = ready_callback
+        self.stage_timings = {}  # 启动各阶段耗时 (秒)：dataset / scaler / weights / embeddings / index
+        # 各阶段内存 (MB)：peak 为阶段内峰值 RSS，rss 为阶段结束时的常驻内存；
+        # serving 为初始化完成后的常驻内存与整个初始化过程的进程峰值
+        self.stage_memory = {}
+        # 省内存模式：特征全程 float32、NumPy 与 torch 共享缓冲区，向量生成后释放缩放特征等中间结果
+        self.memory_lean = os.getenv('RECOMMENDER_MEMORY_LEAN', '0').lower() in ('1', 'true', 'yes')
+        # 重复歌曲合并：track_name + artist_name 相同 (忽略大小写与首尾空白) 的多个 id (再版、合辑等)
+        # 只保留一个规范条目进入索引，其余 id 作为别名映射到规范条目
+        self.collapse_duplicates = os.getenv('RECOMMENDER_COLLAPSE_DUPLICATES', '0').lower() in ('1', 'true', 'yes')
+        self.aliases = {}
+        self.alias_lists = {}
+        # 规范条目的 名称+歌手 哈希 (与 df 行号对齐)，入库时据此识别新的重复歌曲
+        self._duplicate_hashes = None
         self.device = self._check_hardware()
         self._update_progress(5, "正在加载数据集...")
         
-        self.dataset = SpotifyDataset.get_instance()
-        self.df = self.dataset.get_dataframe()
+        with self._timed('dataset'):
+            self.dataset = SpotifyDataset.get_instance()
+            self.df = self.dataset.get_dataframe()
         
         # 核心音频特征 (扩展特征集以提升精度)
         self.feature_cols = [
@@ -81,20 +286,61 @@ class ContentBasedRecommender:
         self.scaled_features = None
         self.model = None
         self.embeddings = None
+        # 当前检索索引 (IndexSnapshot)，通过 _publish_index 整体替换
+        self._index = None
+        # 合并并发的相同检索请求 (相同索引版本 + 种子集合 + limit)
+        self._inflight = SingleFlight()
+        # 查询内并行：把全库按行切块分给多个线程 (NumPy 点积会释放 GIL)，各块取 Top-K 后合并
+        # 1 表示单线程；auto 为 CPU 核数。单次延迟与整机吞吐之间的取舍，可配合 REC_MAX_CONCURRENCY 调整
+        workers = os.getenv('RECOMMENDER_SCAN_WORKERS', '1').strip().lower()
+        self.scan_workers = (os.cpu_count() or 1) if workers == 'auto' else max(1, int(workers))
+        # 库较小时切块的调度开销大于收益，直接单线程扫描
+        self.scan_min_rows = int(os.getenv('RECOMMENDER_SCAN_MIN_ROWS', '50000'))
+        # 分片数 > 1 时，最终索引切片交给本地工作进程持有，检索时 scatter-gather (见 sharded_index.py)
+        self.shard_count = int(os.getenv('RECOMMENDER_SHARDS', '0'))
+        # 种子聚类：种子数超过 k 时先用球面 k-means 压缩为 k 个代表向量 (按簇大小加权) 再打分，
+        # 大歌单的检索代价近似恒定；0 表示关闭 (逐个种子取最大值，精确)
+        # 代表向量只负责召回 k * RERANK 倍候选 (大簇按簇大小获得有界加分)，候选再按全部种子精确重排；
+        # 带 frontier_key 的歌单请求走候选前沿 (精确且增量)，不做聚类
+        self.seed_clusters = int(os.getenv('RECOMMENDER_SEED_CLUSTERS', '0'))
+        self.seed_cluster_bonus = float(os.getenv('RECOMMENDER_SEED_CLUSTER_BONUS', '0'))
+        self.seed_cluster_rerank = max(1, int(os.getenv('RECOMMENDER_SEED_CLUSTER_RERANK', '20')))
+        # 种子与代表向量的平均相似度低于该值 (歌单过于分散) 时放弃聚类，改为精确扫描
+        self.seed_cluster_min_cohesion = float(os.getenv('RECOMMENDER_SEED_CLUSTER_MIN_COHESION', '0.85'))
+        # 歌单候选前沿 (Top-M 行 + 种子集合)：同一歌单只新增歌曲时，只需对新种子打分后合并
+        self.frontier_size = int(os.getenv('RECOMMENDER_FRONTIER_SIZE', '500'))
+        self._frontiers = FrontierCache(max_entries=int(os.getenv('RECOMMENDER_FRONTIER_ENTRIES', '1000')))
+        self.progressive = os.getenv('RECOMMENDER_PROGRESSIVE', '1').lower() in ('1', 'true', 'yes')
+        # 增量入库 (ingest)：串行执行；每次入库递增修订号，使基于行号的外部缓存失效
+        self._ingest_lock = threading.Lock()
+        self._revision = 0
+        # 离群值截断边界 (1% / 99% 分位)，入库的新行按同一边界截断
+        self.clip_bounds = {}
         
-        # 模型缓存路径
-        self.cache_dir = os.path.join(os.path.dirname(__file__), 'model_cache')
+        # 模型缓存路径 (RECOMMENDER_CACHE_DIR 可改到其他目录，如基准测试的临时目录)
+        self.cache_dir = os.getenv('RECOMMENDER_CACHE_DIR') or os.path.join(os.path.dirname(__file__), 'model_cache')
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
+        # 编码器 (RECOMMENDER_ENCODER)：各自的权重与向量分开存放，切换时不会误用对方的缓存
+        self.encoder_type = os.getenv('RECOMMENDER_ENCODER', 'ae').strip().lower()
+        if self.encoder_type not in ENCODERS:
+            logger.warning(f"未知编码器 {self.encoder_type}，使用 ae")
+            self.encoder_type = 'ae'
         self.scaler_path = os.path.join(self.cache_dir, 'scaler.pkl')
-        self.model_weights_path = os.path.join(self.cache_dir, 'ae_model.pth')
-        self.embeddings_path = os.path.join(self.cache_dir, 'embeddings.npy')
-        
-        if self.df is not None:
-            self._preprocess_data()
-            self._init_model()
+        if self.encoder_type == 'ae':
+            self.model_weights_path = os.path.join(self.cache_dir, 'ae_model.pth')
+            self.embeddings_path = os.path.join(self.cache_dir, 'embeddings.npy')
         else:
-            logger.warning("推荐引擎初始化失败: 数据集为空")
+            self.model_weights_path = os.path.join(self.cache_dir, f'{self.encoder_type}_model.pth')
+            self.embeddings_path = os.path.join(self.cache_dir, f'embeddings_{self.encoder_type}.npy')
+        if self.collapse_duplicates:
+            # 合并后行数不同，与未合并的缓存分开存放
+            self.model_weights_path = self.model_weights_path.replace('.pth', '_dedup.pth')
+            self.embeddings_path = self.embeddings_path.replace('.npy', '_dedup.npy')
+        # 向量缓存的行清单 (id + 特征哈希)：启动时逐行核对，入库增量另存为 *_delta_<ns>.npz
+        self.embeddings_rows_path = self.embeddings_path.replace('.npy', '_rows.npz')
+        
+        # 须在建索引前确定：临时索引就绪后引擎即可能被调用
         # Fallback matching mode: strict by default (match artist exactly),
         # can be overridden by constructor arg or environment variable RECOMMENDER_FALLBACK_LOOSE=1
         env_loose = os.getenv('RECOMMENDER_FALLBACK_LOOSE', '').lower() in ('1', 'true', 'yes')
@@ -104,10 +350,77 @@ class ContentBasedRecommender:
             self.fallback_loose = bool(fallback_loose)
         logger.info(f"Fallback loose matching: {self.fallback_loose}")
 
+        if self.df is not None:
+            with self._timed('scaler'):
+                self._preprocess_data()
+            if self.collapse_duplicates:
+                with self._timed('dedupe'):
+                    self._collapse_duplicates()
+            self._init_model()
+            self._release_intermediates()
+        else:
+            logger.warning("推荐引擎初始化失败: 数据集为空")
+
     def _update_progress(self, percent, message):
         if self.progress_callback:
             self.progress_callback(percent, message)
 
+    @contextmanager
+    def _leased_index(self):
+        """取当前快照并在使用期间持有它 (分片版本引用计数)；快照恰好被替换时改取新快照。"""
+        while True:
+            index = self._index
+            if index is None or index.acquire():
+                break
+            if self._index is index:
+                raise RuntimeError("检索索引已关闭")
+        try:
+            yield index
+        finally:
+            if index is not None:
+                index.release()
+
+    def close(self):
+        """释放分片工作进程 (进行中的检索结束后)；进程退出时也会自动关闭。"""
+        index = self._index
+        if index is not None and index.shards is not None:
+            index.shards.retire()
+
+    @contextmanager
+    def _timed(self, stage):
+        """记录一个启动阶段的耗时；同名阶段 (如训练后再生成向量) 累加。"""
+        memstat.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + elapsed
+            self._record_memory(stage)
+            if self.timing_callback:
+                self.timing_callback(stage, self.stage_timings[stage])
+
+    def _record_memory(self, stage):
+        rss, peak = memstat.rss_mb(), memstat.peak_rss_mb()
+        if rss is None:
+            return
+        previous = self.stage_memory.get(stage, {})
+        self.stage_memory[stage] = {'peak_mb': round(max(peak or rss, previous.get('peak_mb', 0.0)), 1),
+                                    'rss_mb': round(rss, 1)}
+
+    def _release_intermediates(self):
+        """初始化结束：省内存模式或启用分片时释放只在建索引时需要的缩放特征，并记录服务期常驻内存。"""
+        index = self._index
+        if index is not None and not index.is_interim and (self.memory_lean or index.shards is not None):
+            self.scaled_features = None
+            gc.collect()
+        rss, peak = memstat.rss_mb(), memstat.process_peak_rss_mb()
+        if rss is not None:
+            self.stage_memory['serving'] = {'peak_mb': round(peak or rss, 1), 'rss_mb': round(rss, 1)}
+        if self.stage_memory:
+            summary = ', '.join(f"{k}={v['peak_mb']:.0f}/{v['rss_mb']:.0f}" for k, v in self.stage_memory.items())
+            logger.info(f"内存 (峰值/常驻 MB): {summary} (lean={self.memory_lean})")
+
     def _check_hardware(self):
         logger.info("正在检测硬件环境...")
         if torch.cuda.is_available():
@@ -139,7 +452,11 @@ class ContentBasedRecommender:
             time.sleep(0.05) # 让出 CPU
             lower = self.df[col].quantile(0.01)
             upper = self.df[col].quantile(0.99)
+            self.clip_bounds[col] = (lower, upper)
             self.df[col] = self.df[col].clip(lower, upper)
+        if self.memory_lean:
+            # 特征列降为 float32，缩放与训练不再需要 float64 副本
+            self.df = self.df.astype({col: np.float32 for col in self.feature_cols})
 
         # 特征归一化 [0, 1]
         if os.path.exists(self.scaler_path):
@@ -147,96 +464,206 @@ class ContentBasedRecommender:
                 with open(self.scaler_path, 'rb') as f:
                     self.scaler = pickle.load(f)
                 logger.info("[Step 1] 加载预训练的特征缩放器...")
-                self.scaled_features = self.scaler.transform(self.df[self.feature_cols])
+                self.scaled_features = self._scale(self.df[self.feature_cols])
                 self._update_progress(15, "特征缩放完成...")
                 return
             except Exception as e:
                 logger.warning(f"加载 Scaler 失败: {e}，将重新拟合。")
 
         logger.info("[Step 1] 数据预处理: 将音频特征归一化到 [0, 1] 区间...")
-        self.scaled_features = self.scaler.fit_transform(self.df[self.feature_cols])
+        self.scaler.fit(self.df[self.feature_cols])
+        self.scaled_features = self._scale(self.df[self.feature_cols])
         with open(self.scaler_path, 'wb') as f:
             pickle.dump(self.scaler, f)
         self._update_progress(15, "特征缩放完成...")
 
+    @staticmethod
+    def _duplicate_key_hashes(frame):
+        """名称 + 歌手 (忽略大小写与首尾空白) 的 64 位哈希，相同即视为同一首歌。"""
+        keys = pd.DataFrame({col: frame[col].astype(str).str.strip().str.lower()
+                             for col in ('track_name', 'artist_name')})
+        return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+    def _collapse_duplicates(self):
+        """
+        把 名称+歌手 相同的行合并为一个规范条目 (人气最高者，同人气取先出现的)，
+        其余 id 记为别名；df 与缩放特征只保留规范条目，索引更小、扫描更快，Top-N 不再被同一首歌占满。
+        """
+        if not {'track_name', 'artist_name'}.issubset(self.df.columns):
+            logger.warning("缺少 track_name / artist_name 列，跳过重复歌曲合并")
+            return
+        hashes = self._duplicate_key_hashes(self.df)
+        codes, _ = pd.factorize(hashes)
+        popularity = pd.to_numeric(self.df['popularity'], errors='coerce').fillna(0).to_numpy() \
+            if 'popularity' in self.df.columns else np.zeros(len(self.df))
+        # 按 (重复组, 人气降序, 原行号) 排序，每组第一行即规范条目
+        order = np.lexsort((np.arange(len(self.df)), -popularity, codes))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = codes[order][1:] != codes[order][:-1]
+        canonical_of_code = np.empty(codes.max() + 1 if len(codes) else 0, dtype=np.int64)
+        canonical_of_code[codes[order][first]] = order[first]
+        canonical = canonical_of_code[codes]
+
+        alias_rows = np.flatnonzero(canonical != np.arange(len(self.df)))
+        ids = self.df.index.to_numpy()
+        aliases = dict(zip(ids[alias_rows].tolist(), ids[canonical[alias_rows]].tolist()))
+        alias_lists = {}
+        for alias, target in aliases.items():
+            alias_lists.setdefault(target, []).append(alias)
+
+        keep = np.sort(order[first])
+        before = len(self.df)
+        self.df = self.df.iloc[keep]
+        self.scaled_features = self.scaled_features[keep]
+        self._duplicate_hashes = hashes[keep]
+        self.aliases, self.alias_lists = aliases, alias_lists
+        logger.info(f"[Step 1.5] 合并重复歌曲: {before} 行 -> {len(self.df)} 个规范条目 ({len(aliases)} 个别名 id)")
+
+    def _canonical_ids(self, ids):
+        aliases = self.aliases
+        return [aliases.get(x, x) for x in ids] if aliases else ids
+
+    def _alias_duplicates(self, rows):
+        """
+        入库时的重复合并：已是别名的 id、或与库中规范条目 / 同批更靠前的行 名称+歌手 相同的新 id，
+        只登记为别名，不再进入索引。返回 (仍需编入的行, 新别名数)。
+        别名表只增不减，直接原地更新 (快照共享同一份)：旧快照查到尚未编入的规范 id 时只会得到 -1。
+        """
+        if self._duplicate_hashes is None or not {'track_name', 'artist_name'}.issubset(rows.columns):
+            return rows, 0
+        aliases, alias_lists = self.aliases, self.alias_lists
+        before = len(aliases)
+        is_new = self.df.index.get_indexer(rows.index) < 0
+        hashes = self._duplicate_key_hashes(rows)
+        targets = pd.Index(self._duplicate_hashes).get_indexer(hashes)
+        seen = {}
+        drop = np.zeros(len(rows), dtype=bool)
+        for i, (row_id, h, target) in enumerate(zip(rows.index, hashes, targets)):
+            if not is_new[i]:
+                continue
+            if row_id in aliases:
+                drop[i] = True
+                continue
+            canonical = self.df.index[target] if target >= 0 else seen.get(h)
+            if canonical is None:
+                seen[h] = row_id
+                continue
+            alias_lists[canonical] = alias_lists.get(canonical, []) + [row_id]
+            aliases[row_id] = canonical
+            drop[i] = True
+        return rows[~drop], len(aliases) - before
+
+    def _scale(self, frame):
+        """MinMaxScaler.transform；省内存模式下直接在 float32 数组上原地缩放 (X * scale_ + min_)。"""
+        if not self.memory_lean:
+            return self.scaler.transform(frame)
+        features = frame.to_numpy(dtype=np.float32, copy=True)
+        features *= self.scaler.scale_.astype(np.float32)
+        features += self.scaler.min_.astype(np.float32)
+        if getattr(self.scaler, 'clip', False):
+            np.clip(features, *self.scaler.feature_range, out=features)
+        return features
+
     def _init_model(self):
-        self._update_progress(20, "初始化深度学习模型架构 (MLP Autoencoder)...")
-        logger.info("[Step 2] 初始化 MLP Autoencoder...")
-        
         input_dim = self.scaled_features.shape[1]
-        self.model = Autoencoder(input_dim=input_dim).to(self.device)
+        if self.encoder_type == 'pca':
+            self._update_progress(20, "初始化线性编码器 (PCA)...")
+            logger.info("[Step 2] 初始化线性编码器 (PCA)...")
+            latent_dim = int(os.getenv('RECOMMENDER_PCA_DIM', '0')) or None
+            whiten = os.getenv('RECOMMENDER_PCA_WHITEN', '1').lower() in ('1', 'true', 'yes')
+            self.model = LinearEncoder(input_dim, latent_dim, whiten=whiten).to(self.device)
+        else:
+            self._update_progress(20, "初始化深度学习模型架构 (MLP Autoencoder)...")
+            logger.info("[Step 2] 初始化 MLP Autoencoder...")
+            self.model = Autoencoder(input_dim=input_dim).to(self.device)
         
         # 尝试加载预训练模型
         if os.path.exists(self.model_weights_path) and os.path.exists(self.embeddings_path):
             logger.info("发现预训练模型，正在加载...")
             try:
-                state_dict = torch.load(self.model_weights_path, map_location=self.device, weights_only=True)
+                with self._timed('weights'):
+                    state_dict = torch.load(self.model_weights_path, map_location=self.device, weights_only=True)
 
-                # 检查维度
-                saved_input_dim = state_dict['encoder.0.weight'].shape[1]
-                if saved_input_dim != input_dim:
-                    logger.warning(f"模型输入维度不匹配 (Saved: {saved_input_dim}, Current: {input_dim})，将重新训练...")
-                    raise ValueError("Input dimension mismatch")
+                    # 检查维度
+                    saved_input_dim = state_dict['encoder.0.weight' if self.encoder_type == 'ae' else 'encoder.weight'].shape[1]
+                    if saved_input_dim != input_dim:
+                        logger.warning(f"模型输入维度不匹配 (Saved: {saved_input_dim}, Current: {input_dim})，将重新训练...")
+                        raise ValueError("Input dimension mismatch")
 
-                self.model.load_state_dict(state_dict)
-                self.model.eval()
+                    self.model.load_state_dict(state_dict)
+                    self.model.eval()
 
-                self.embeddings = np.load(self.embeddings_path)
+                with self._timed('embeddings'):
+                    loaded = self._load_embeddings()
 
-                if len(self.embeddings) == len(self.df):
+                if loaded:
+                    with self._timed('index'):
+                        self._build_index()
                     logger.info(f"[SUCCESS] 模型加载完成。已索引 {len(self.df)} 首歌曲。")
                     self._update_progress(100, "模型加载完成！")
                     return
-                else:
-                    logger.warning("数据集大小已变更，将重新训练...")
             except Exception as e:
                 logger.warning(f"加载模型失败 ({e})，将重新训练...")
 
+        if self.encoder_type == 'pca':
+            self._fit_linear_encoder()
+            return
+
+        if self.progressive:
+            # 训练期间先用缩放后的原始特征提供近似推荐，训练完成后再切换到 Autoencoder 向量
+            with self._timed('interim_index'):
+                self._build_interim_index()
+            logger.info(f"[Step 2.5] 临时索引就绪 ({self._index.embeddings_norm.shape[1]} 维缩放特征)，训练期间提供近似推荐")
+            if self.ready_callback:
+                self.ready_callback(self)
+
         logger.info("[Step 3] 开始训练 MLP Autoencoder...")
         self._update_progress(25, "准备训练数据...")
+        # 无缓存冷启动时，weights 阶段即训练耗时
+        with self._timed('weights'):
+            # float32 且连续时与 scaled_features 共享内存，不再复制一份
+            train_data = torch.from_numpy(np.ascontiguousarray(self.scaled_features, dtype=np.float32))
         
-        train_data = torch.FloatTensor(self.scaled_features)
+            # Batch Size 256
+            batch_size = 256
+            dataset = TensorDataset(train_data)
+            dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
         
-        # Batch Size 256
-        batch_size = 256
-        dataset = TensorDataset(train_data)
-        dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+            # 使用 MSE Loss 和 Adam
+            criterion = nn.MSELoss()
+            optimizer = optim.Adam(self.model.parameters(), lr=0.001)
         
-        # 使用 MSE Loss 和 Adam
-        criterion = nn.MSELoss()
-        optimizer = optim.Adam(self.model.parameters(), lr=0.001)
+            self.model.train()
+            epochs = int(os.getenv('RECOMMENDER_EPOCHS', '20')) # MLP 收敛很快，20 epoch 足够
         
-        self.model.train()
-        epochs = 20 # MLP 收敛很快，20 epoch 足够
-        
-        for epoch in range(epochs):
-            time.sleep(0.1) # 让出 CPU
+            for epoch in range(epochs):
+                time.sleep(0.1) # 让出 CPU
 
-            total_loss = 0
-            for batch_idx, (data,) in enumerate(dataloader):
-                data = data.to(self.device)
-                optimizer.zero_grad()
+                total_loss = 0
+                for batch_idx, (data,) in enumerate(dataloader):
+                    data = data.to(self.device)
+                    optimizer.zero_grad()
                 
-                encoded, decoded = self.model(data)
-                loss = criterion(decoded, data)
+                    encoded, decoded = self.model(data)
+                    loss = criterion(decoded, data)
                 
-                loss.backward()
-                optimizer.step()
+                    loss.backward()
+                    optimizer.step()
                 
-                total_loss += loss.item()
+                    total_loss += loss.item()
             
-            avg_loss = total_loss / len(dataloader)
+                avg_loss = total_loss / len(dataloader)
             
-            if np.isnan(avg_loss):
-                logger.error(f"训练出现异常: Loss 变为 NaN (Epoch {epoch+1})")
-                break
+                if np.isnan(avg_loss):
+                    logger.error(f"训练出现异常: Loss 变为 NaN (Epoch {epoch+1})")
+                    break
 
-            p = 30 + int((epoch + 1) / epochs * 50)
-            self._update_progress(p, f"正在训练神经网络 (Epoch {epoch+1}/{epochs})... Loss: {avg_loss:.6f}")
+                p = 30 + int((epoch + 1) / epochs * 50)
+                self._update_progress(p, f"正在训练神经网络 (Epoch {epoch+1}/{epochs})... Loss: {avg_loss:.6f}")
 
-        logger.info("保存模型权重...")
-        self._update_progress(85, "保存模型权重...")
-        torch.save(self.model.state_dict(), self.model_weights_path)
+            logger.info("保存模型权重...")
+            self._update_progress(85, "保存模型权重...")
+            torch.save(self.model.state_dict(), self.model_weights_path)
 
         logger.info("[Step 4] 生成全库音乐指纹 (Embeddings)...")
         self._update_progress(90, "生成全库音乐指纹...")
@@ -245,30 +672,442 @@ class ContentBasedRecommender:
         embeddings_list = []
         predict_loader = DataLoader(dataset, batch_size=4096, shuffle=False)
         
-        with torch.no_grad():
-            for (data,) in predict_loader:
-                data = data.to(self.device)
-                encoded, _ = self.model(data)
-                embeddings_list.append(encoded.cpu().numpy())
-        
-        self.embeddings = np.concatenate(embeddings_list, axis=0)
-        np.save(self.embeddings_path, self.embeddings)
+        with self._timed('embeddings'):
+            with torch.no_grad():
+                for (data,) in predict_loader:
+                    data = data.to(self.device)
+                    encoded, _ = self.model(data)
+                    embeddings_list.append(encoded.cpu().numpy())
+
+            self.embeddings = np.concatenate(embeddings_list, axis=0)
+            self._save_embeddings()
+        with self._timed('index'):
+            self._build_index()
         
         logger.info(f"[SUCCESS] 推荐系统就绪。已索引 {len(self.df)} 首歌曲。")
         self._update_progress(100, "初始化完成！")
 
-    def recommend(self, seed_track_infos, limit=50):
+    def _fit_linear_encoder(self):
+        """PCA 编码器：一次遍历拟合投影 (秒级，不需要临时索引)，再分块生成全库向量。"""
+        logger.info("[Step 3] 拟合线性编码器 (PCA)...")
+        self._update_progress(30, "正在拟合线性编码器 (PCA)...")
+        with self._timed('weights'):
+            eigvals, total_variance = self.model.fit(self.scaled_features)
+            self.model.eval()
+            torch.save(self.model.state_dict(), self.model_weights_path)
+        explained = eigvals.sum() / max(total_variance, 1e-12)
+        logger.info(f"PCA 保留 {len(eigvals)} 个主成分 (解释 {min(explained, 1.0):.1%} 方差)，whiten={self.model.whiten}")
+
+        logger.info("[Step 4] 生成全库音乐指纹 (Embeddings)...")
+        self._update_progress(90, "生成全库音乐指纹...")
+        with self._timed('embeddings'):
+            features = self.scaled_features
+            self.embeddings = np.concatenate([self._encode(features[start:start + 65536])
+                                              for start in range(0, len(features), 65536)], axis=0)
+            self._save_embeddings()
+        with self._timed('index'):
+            self._build_index()
+        logger.info(f"[SUCCESS] 推荐系统就绪。已索引 {len(self.df)} 首歌曲。")
+        self._update_progress(100, "初始化完成！")
+
+    # --- 向量缓存 ---
+
+    @staticmethod
+    def _feature_hashes(features):
+        """每行缩放特征 (按 float32) 的 64 位哈希，用来判断缓存向量是否仍对应当前特征。"""
+        frame = pd.DataFrame(np.asarray(features, dtype=np.float32))
+        return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+    @staticmethod
+    def _id_bytes(ids):
+        return np.char.encode(np.asarray(ids, dtype=str), 'utf-8')
+
+    def _embedding_delta_paths(self):
+        return sorted(glob.glob(self.embeddings_path.replace('.npy', '_delta_*.npz')))
+
+    @staticmethod
+    def _write_npz(path, **arrays):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    def _save_embedding_rows(self):
+        self._write_npz(self.embeddings_rows_path, ids=self._id_bytes(self.df.index),
+                        hashes=self._feature_hashes(self.scaled_features))
+
+    def _save_embeddings(self):
+        """全量写出向量与行清单；入库增量已包含在内，一并清理。"""
+        tmp = self.embeddings_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, self.embeddings)
+        os.replace(tmp, self.embeddings_path)
+        self._save_embedding_rows()
+        for path in self._embedding_delta_paths():
+            os.remove(path)
+
+    def _load_embeddings(self):
+        """
+        读取向量缓存 (叠加入库增量) 并按 id + 特征哈希与当前数据集逐行对齐：一致的行直接复用，
+        新增或特征有变化的行 (例如重放数据集增量后) 用已加载的编码器补编，不需要重新训练。
+        有补编或增量时写回一份完整缓存。返回 False 表示缓存不可用 (无行清单的旧缓存且行数不符)。
+        """
+        embeddings = np.load(self.embeddings_path)
+        if not os.path.exists(self.embeddings_rows_path):
+            # 旧版缓存没有行清单，只能按行数判断；可用时补写清单
+            if len(embeddings) != len(self.df):
+                logger.warning("数据集大小已变更 (旧版向量缓存没有行清单)，将重新训练...")
+                return False
+            self.embeddings = embeddings
+            self._save_embedding_rows()
+            return True
+
+        with np.load(self.embeddings_rows_path) as rows:
+            ids, hashes = rows['ids'], rows['hashes']
+        if len(ids) != len(embeddings):
+            raise ValueError("向量缓存与行清单不一致")
+        deltas = self._embedding_delta_paths()
+        for path in deltas:
+            with np.load(path) as delta:
+                ids = np.concatenate([ids, delta['ids']])
+                hashes = np.concatenate([hashes, delta['hashes']])
+                embeddings = np.concatenate([embeddings, delta['vectors'].astype(embeddings.dtype, copy=False)])
+        cached = pd.Index(ids)
+        latest = ~cached.duplicated(keep='last')
+        cached, hashes, embeddings = cached[latest], hashes[latest], embeddings[latest]
+
+        positions = cached.get_indexer(self._id_bytes(self.df.index))
+        reuse = positions >= 0
+        reuse[reuse] = hashes[positions[reuse]] == self._feature_hashes(self.scaled_features[reuse])
+        stale = np.flatnonzero(~reuse)
+        out = np.empty((len(self.df), embeddings.shape[1]), dtype=embeddings.dtype)
+        out[reuse] = embeddings[positions[reuse]]
+        for start in range(0, len(stale), 65536):
+            chunk = stale[start:start + 65536]
+            out[chunk] = self._encode(self.scaled_features[chunk])
+        self.embeddings = out
+
+        if len(stale) or deltas or len(cached) != len(out):
+            logger.info(f"向量缓存: 复用 {int(reuse.sum())} 行，补编 {len(stale)} 行 (新增或特征变化)，"
+                        f"合并入库增量 {len(deltas)} 个")
+            self._save_embeddings()
+        return True
+
+    def _build_index(self):
+        """
+        预先归一化全库向量，避免每次推荐都对百万行矩阵重新 normalize。
+        启用分片时各分片进程直接从向量缓存读取并归一化自己的行，本进程不再保留全库向量。
+        """
+        version = int(os.path.getmtime(self.embeddings_path)) if os.path.exists(self.embeddings_path) else 0
+        space = f"{self.encoder_type}{self.embeddings.shape[1]}-{version}"
+        shards = self._start_shards() if self.shard_count > 1 else None
+        if shards is not None:
+            self.embeddings = None
+            self._publish_index(None, space, shards=shards)
+            return
+        self._publish_index(normalize(self.embeddings, axis=1).astype(np.float32), space)
+
+    def _build_interim_index(self):
+        """
+        临时索引：直接在 [0, 1] 缩放特征空间做余弦检索。
+        特征全为非负时各向量夹角都很小，先减去列均值再归一化，相似度才有区分度。
+        """
+        features = np.asarray(self.scaled_features, dtype=np.float32)
+        centered = features - features.mean(axis=0, keepdims=True)
+        self._publish_index(normalize(centered, axis=1).astype(np.float32),
+                            f"raw{features.shape[1]}-{len(features)}", is_interim=True)
+
+    def _publish_index(self, embeddings_norm, embedding_space, is_interim=False, filters=None, shards=None):
+        """原子地替换检索索引：单次引用赋值，正在进行的检索继续使用旧快照。"""
+        previous = self._index
+        if filters is None and previous is not None and previous.df is self.df:
+            filters = previous.filters
+        self._index = IndexSnapshot(embeddings_norm, self.df, embedding_space, is_interim, shards=shards, filters=filters,
+                                    aliases=self.aliases, alias_lists=self.alias_lists)
+        if previous is not None and previous.shards is not None and previous.shards is not shards:
+            # 旧快照可能仍有进行中的检索：最后一个使用者 release 后才丢弃其分片版本
+            previous.shards.retire()
+
+    def _start_shards(self):
+        try:
+            start = time.perf_counter()
+            shards = ShardedIndex(self.embeddings_path, self.shard_count, normalize=True)
+            logger.info(f"分片索引就绪: {self.shard_count} 个工作进程，耗时 {time.perf_counter() - start:.2f}s")
+            return shards
+        except Exception as e:
+            logger.warning(f"分片索引启动失败 ({e})，回退为进程内检索")
+            return None
+
+    # --- 增量入库 ---
+
+    def ingest(self, rows):
+        """
+        把新增/更新的歌曲编入正在服务的索引，无需重启或重新训练。
+        rows 为以 id 为索引的完整记录 (通常来自 SpotifyDataset.ingest)；只对这些行做清洗、缩放和编码，
+        已有 id 原位替换 (行号不变)，新 id 追加在末尾，然后发布新的索引快照。
+        训练期间 (临时索引) 不接受入库，调用方可在训练完成后重试。
+        """
+        with self._ingest_lock:
+            index = self._index
+            if index is None or index.is_interim:
+                raise RuntimeError("推荐引擎尚未就绪 (训练中或未加载)，暂不能入库")
+            start = time.perf_counter()
+            cleaned = self._clean_rows(rows)
+            skipped = len(rows) - len(cleaned)
+            aliased = 0
+            if self.collapse_duplicates:
+                cleaned, aliased = self._alias_duplicates(cleaned)
+            if cleaned.empty:
+                return {'added': 0, 'updated': 0, 'skipped': int(skipped), 'aliased': int(aliased)}
+
+            features = self._scale(cleaned[self.feature_cols])
+            vectors = self._encode(features)
+            vectors_norm = normalize(vectors, axis=1).astype(np.float32)
+
+            positions = self.df.index.get_indexer(cleaned.index)
+            is_new = positions < 0
+            existing = positions[~is_new]
+            df = self.df
+            if existing.size:
+                df = df.copy()
+                columns = df.columns.intersection(cleaned.columns)
+                df.loc[cleaned.index[~is_new], columns] = cleaned.loc[~is_new, columns]
+            if is_new.any():
+                df = pd.concat([df, cleaned[is_new]])
+            touched = np.concatenate([existing, np.arange(len(self.df), len(df))])
+
+            def merged(base, values):
+                out = np.concatenate([base, values[is_new]]).astype(base.dtype, copy=False)
+                out[existing] = values[~is_new]
+                return out
+
+            # 分片时全库向量只在分片进程中：派生新的分片版本 (只复制改动到的分片)
+            shards = None if index.shards is None else index.shards.with_rows(
+                touched, np.concatenate([vectors_norm[~is_new], vectors_norm[is_new]]))
+            embeddings = None if self.embeddings is None else merged(self.embeddings, vectors)
+            # 省内存模式或分片时缩放特征已释放，入库时不再维护
+            scaled_features = None if self.scaled_features is None else merged(np.asarray(self.scaled_features), features)
+            embeddings_norm = None if index.embeddings_norm is None else merged(index.embeddings_norm, vectors_norm)
+            filters = index.filters.with_rows(df, touched)
+            if self._duplicate_hashes is not None:
+                self._duplicate_hashes = merged(self._duplicate_hashes, self._duplicate_key_hashes(cleaned))
+
+            try:
+                # 与数据集增量一起落盘，重启时由 _load_embeddings 叠加，不会回退到入库前的向量
+                self._write_npz(self.embeddings_path.replace('.npy', f'_delta_{time.time_ns()}.npz'),
+                                ids=self._id_bytes(cleaned.index), hashes=self._feature_hashes(features),
+                                vectors=vectors)
+            except OSError as e:
+                logger.warning(f"[Ingest] 写入向量增量失败 ({e})，重启时将按特征重新编码这些行")
+
+            self._revision += 1
+            space = f"{index.embedding_space.split('+')[0]}+{self._revision}"
+            self.df, self.embeddings, self.scaled_features = df, embeddings, scaled_features
+            self._publish_index(embeddings_norm, space, filters=filters, shards=shards)
+
+            result = {'added': int(is_new.sum()), 'updated': int(existing.size), 'skipped': int(skipped),
+                      'aliased': int(aliased),
+                      'rows': len(df), 'embedding_space': space,
+                      'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}
+            logger.info(f"[Ingest] 新增 {result['added']} 首，更新 {result['updated']} 首，跳过 {skipped} 首 "
+                        f"(特征缺失)，合并为别名 {aliased} 首，耗时 {result['elapsed_ms']}ms")
+            return result
+
+    def _clean_rows(self, rows):
+        """与 _preprocess_data 相同的清洗规则：缺失列补 0、数值化、丢弃缺失值、按全库分位截断。"""
+        rows = rows.copy()
+        for col in self.feature_cols:
+            if col not in rows.columns:
+                rows[col] = 0
+            rows[col] = pd.to_numeric(rows[col], errors='coerce')
+        rows = rows.dropna(subset=self.feature_cols)
+        for col, (lower, upper) in self.clip_bounds.items():
+            rows[col] = rows[col].clip(lower, upper)
+        if self.memory_lean:
+            rows = rows.astype({col: np.float32 for col in self.feature_cols})
+        return rows
+
+    def _encode(self, features):
+        """用当前编码器把缩放后的特征映射为潜在向量。"""
+        with torch.no_grad():
+            data = torch.from_numpy(np.ascontiguousarray(features, dtype=np.float32)).to(self.device)
+            encoded, _ = self.model(data)
+        return encoded.cpu().numpy()
+
+    @property
+    def embeddings_norm(self):
+        index = self._index
+        return index.embeddings_norm if index is not None else None
+
+    @property
+    def embedding_space(self):
+        index = self._index
+        return index.embedding_space if index is not None else None
+
+    @property
+    def is_interim(self):
+        index = self._index
+        return bool(index is not None and index.is_interim)
+
+    def inflight_stats(self):
+        """并发合并统计：executed 为实际计算次数，coalesced 为复用他人结果的次数。"""
+        return self._inflight.stats()
+
+    def frontier_stats(self):
+        """歌单前沿统计：reused / incremental / full 分别为直接复用、增量合并、全量重算的次数。"""
+        return self._frontiers.stats()
+
+    def get_embedding(self, track_id):
+        """返回单曲的归一化向量 (哈希索引 O(1) 查找)，不在库中时返回 None。"""
+        return self.get_embeddings([track_id])[0]
+
+    def get_embeddings(self, track_ids):
+        """批量版 get_embedding：一次取回 (分片时只扇出一次)，不在库中的位置为 None。"""
+        with self._leased_index() as index:
+            if index is None:
+                return [None] * len(track_ids)
+            positions = index.positions(track_ids)
+            found = positions >= 0
+            vectors = iter(index.vectors(positions[found]) if found.any() else ())
+            return [next(vectors) if ok else None for ok in found]
+
+    def recommend_by_vector(self, vector, limit=50, exclude_ids=None, genre=None, year_range=None, min_popularity=None):
+        """单向量检索：一次全库点积 + Top-K，用于会话兴趣向量等已聚合好的查询。过滤条件同 recommend。"""
+        with self._leased_index() as index:
+            if index is None or vector is None:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if not norm or query.shape[0] != index.dim:
+                return []
+            excluded = None
+            if exclude_ids:
+                excluded = index.positions(exclude_ids)
+                excluded = excluded[excluded >= 0]
+            eligible = index.filters.eligible(genre, year_range, min_popularity)
+            with metrics.span('similarity_scan'):
+                top_indices, _ = self._scan_top_k(index.embeddings_norm, (query / norm)[None, :], limit, excluded,
+                                                  shards=index.shards, eligible=eligible)
+            with metrics.span('materialize'):
+                return index.records(top_indices)
+
+    def recommend_popular(self, limit=50, exclude_positions=None, exclude_ids=None,
+                          genre=None, year_range=None, min_popularity=None):
+        """
+        降级推荐：直接取快照中预排好的热门行号 (排除种子)，不做任何全库计算。
+        用于准入控制拒绝 (过载) 时代替 recommend_positions / recommend_by_vector。
+        有过滤条件时在符合条件的行中按人气选取。
+        """
+        index = self._index
+        if index is None:
+            return []
+        excluded = set()
+        if exclude_positions is not None:
+            excluded.update(int(p) for p in np.asarray(exclude_positions).ravel())
+        if exclude_ids:
+            ids = index.positions(exclude_ids)
+            excluded.update(int(p) for p in ids[ids >= 0])
+        eligible = index.filters.eligible(genre, year_range, min_popularity)
+        if eligible is None:
+            candidates = index.popular_positions
+        else:
+            candidates = index.filters.most_popular(eligible, limit + len(excluded))
+        picked = [int(p) for p in candidates if int(p) not in excluded][:limit]
+        return index.records(picked)
+
+    def _scan_top_k(self, db_norm, queries, limit, exclude_positions=None, shards=None, eligible=None, bonus=None):
+        """
+        精确 Max-Sim 检索：每行得分为与所有查询向量余弦相似度的最大值，返回 (Top-K 行号, 得分)。
+        有分片索引时扇出到各分片进程 (此时本进程没有全库向量，db_norm 为 None)；
+        否则 scan_workers > 1 且库足够大时按行切块并行打分，各块先取 Top-K，最后合并再取 Top-K。
+        几种方式结果均与单线程扫描一致。
+
+        eligible 为过滤后的有序行号时只对这些行打分 (先剔除种子，分片时由各分片只对本片候选打分)，
+        条件越严格扫描越快，且只要符合条件的行足够多就一定返回 limit 条。
+        """
+        exclude_positions = None if exclude_positions is None else np.asarray(exclude_positions, dtype=np.int64)
+        candidates = None
+        if eligible is not None:
+            candidates = exclude_sorted(eligible, exclude_positions)
+            if not len(candidates):
+                return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        if shards is not None:
+            if candidates is not None:
+                return shards.top_k(queries, limit, bonus=bonus, eligible=candidates)
+            return shards.top_k(queries, limit, exclude_positions, bonus=bonus)
+        if candidates is not None:
+            top, scores = self._scan_top_k(db_norm[candidates], queries, limit, bonus=bonus)
+            return candidates[top], scores
+        n_db = db_norm.shape[0]
+        if self.scan_workers <= 1 or n_db < self.scan_min_rows:
+            return self._scan_block(db_norm, queries, 0, n_db, limit, exclude_positions, bonus)
+
+        bounds = np.linspace(0, n_db, self.scan_workers + 1).astype(np.int64)
+        executor = self._get_scan_executor(self.scan_workers)
+        futures = [executor.submit(self._scan_block, db_norm, queries, int(start), int(stop), limit, exclude_positions, bonus)
+                   for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        parts = [f.result() for f in futures]
+        with metrics.span('topk_merge'):
+            return merge_top_k(parts, limit)
+
+    @staticmethod
+    def _scan_block(db_norm, queries, start, stop, limit, exclude_positions=None, bonus=None):
+        """对 [start, stop) 行打分并取块内 Top-K；返回全局行号。"""
+        return max_sim_top_k(db_norm[start:stop], queries, limit,
+                             local_positions(exclude_positions, start, stop), offset=start, bonus=bonus)
+
+    @classmethod
+    def _get_scan_executor(cls, workers):
+        with cls._scan_executor_lock:
+            if cls._scan_executor is None or cls._scan_executor_workers < workers:
+                # 不关闭旧线程池：其他线程可能已拿到它、正要 submit。最后一个引用释放后被回收，
+                # ThreadPoolExecutor 的弱引用回调会唤醒空闲线程使其退出，不会泄漏
+                cls._scan_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rec-scan')
+                cls._scan_executor_workers = workers
+            return cls._scan_executor
+
+    _top_k = staticmethod(top_k)
+
+    @property
+    def index_version(self):
+        """行号 (position) 的有效版本：向量空间或库大小变化后，外部缓存的行号即失效。"""
+        index = self._index
+        return index.version if index is not None else f"None:{0 if self.df is None else len(self.df)}"
+
+    def recommend(self, seed_track_infos, limit=50, fallback_loose=None, genre=None, year_range=None, min_popularity=None,
+                  frontier_key=None):
         """
         基于 MLP Autoencoder 的推荐 (Max Similarity Strategy)
         支持两种输入格式：
         - 列表字符串 id：['id1','id2',...]
         - 列表字典：[{ 'id':..., 'name':..., 'artist':... }, ...]
+        可选过滤：genre (字符串、逗号分隔或列表，子串匹配)、year_range=(起, 止) (闭区间，任一端可为 None)、
+        min_popularity；只对符合条件的行打分。
+        frontier_key (如 playlist_id) 不为空时为该歌单维护候选前沿，歌单只新增歌曲时增量计算。
         """
         logger.info("启动智能推荐流程 (MLP Autoencoder - Max Sim)")
 
-        if self.df is None or self.embeddings is None or not seed_track_infos:
+        if self._index is None or not seed_track_infos:
             return []
 
+        seed_positions = self.resolve_seed_positions(seed_track_infos, fallback_loose=fallback_loose)
+        return self.recommend_positions(seed_positions, limit=limit, genre=genre, year_range=year_range,
+                                        min_popularity=min_popularity, frontier_key=frontier_key)
+
+    def resolve_seed_positions(self, seed_track_infos, fallback_loose=None):
+        """
+        将种子歌曲 (id 或 {id,name,artist}) 解析为库内行号 (已去重、升序)。
+        id 未命中时按 名称+歌手 回退匹配。结果可按歌单快照缓存，配合 recommend_positions 复用。
+        fallback_loose 为 None 时使用引擎自身配置。
+        """
+        with metrics.span('seed_resolution'):
+            return self._resolve_seed_positions(seed_track_infos, fallback_loose)
+
+    def _resolve_seed_positions(self, seed_track_infos, fallback_loose=None):
+        if self.df is None or not seed_track_infos:
+            return np.array([], dtype=np.int64)
+        loose = self.fallback_loose if fallback_loose is None else bool(fallback_loose)
+
         # 1. Input
         # 兼容老的只传 id 的调用
         seed_ids = []
@@ -286,18 +1125,18 @@ class ContentBasedRecommender:
                     # fallback: ignore
                     continue
 
-        # Normalize to strings
-        seed_ids = [str(x) for x in seed_ids]
+        # Normalize to strings (别名 id 映射到规范条目)
+        seed_ids = self._canonical_ids([str(x) for x in seed_ids])
 
         # DEBUG: 记录输入信息以便排查匹配问题
         logger.debug(f"原始 seed_track_infos: {seed_track_infos}")
         logger.debug(f"解析后 seed_ids: {seed_ids}")
 
-        # Check which seed ids exist in dataset
-        seed_mask = self.df.index.isin(seed_ids)
+        # Check which seed ids exist in dataset (哈希索引查找，不再逐个扫描 index 列表)
+        found = self.df.index.get_indexer(seed_ids) >= 0 if seed_ids else np.array([], dtype=bool)
 
         # If some provided ids are not found, attempt to fallback by name+artist when available
-        missing_ids = [sid for sid in seed_ids if sid not in list(self.df.index)]
+        missing_ids = [sid for sid, ok in zip(seed_ids, found) if not ok]
         if missing_ids:
             logger.debug(f"缺失的 ids: {missing_ids}")
         if missing_ids:
@@ -314,81 +1153,225 @@ class ContentBasedRecommender:
 
             from dataset_service import SpotifyDataset
             ds = SpotifyDataset.get_instance()
-            for mid in missing_ids:
-                if mid in id_map:
-                    name, artist = id_map[mid]
-                    try:
-                        row = ds.get_track_features_by_name(name, artist)
-                        logger.debug(f"回退查找 for id={mid}, name={name}, artist={artist} -> row: {row}")
-                        if row and row.get('id'):
-                            # Enforce strict or loose artist matching depending on configuration
-                            db_artist = str(row.get('artist_name', '')).strip().lower()
-                            target_artist = str(artist).strip().lower() if artist else ''
-                            matched = False
-                            if self.fallback_loose:
-                                # Loose: accept if either contains the other
-                                if target_artist and (target_artist in db_artist or db_artist in target_artist):
-                                    matched = True
-                            else:
-                                # Strict: require exact match (case-insensitive)
-                                if db_artist and target_artist and db_artist == target_artist:
-                                    matched = True
-
-                            if matched:
-                                found_id = str(row.get('id'))
-                                seed_ids.append(found_id)
-                                logger.debug(f"回退匹配成功: {mid} -> {found_id} (db_artist={db_artist}, target={target_artist})")
+            with metrics.span('name_fallback'):
+                for mid in missing_ids:
+                    if mid not in id_map:
+                        metrics.FALLBACK_MATCHES.inc(result='no_metadata')
+                    else:
+                        name, artist = id_map[mid]
+                        try:
+                            row = ds.get_track_features_by_name(name, artist)
+                            logger.debug(f"回退查找 for id={mid}, name={name}, artist={artist} -> row: {row}")
+                            if row and row.get('id'):
+                                # Enforce strict or loose artist matching depending on configuration
+                                db_artist = str(row.get('artist_name', '')).strip().lower()
+                                target_artist = str(artist).strip().lower() if artist else ''
+                                matched = False
+                                if loose:
+                                    # Loose: accept if either contains the other
+                                    if target_artist and (target_artist in db_artist or db_artist in target_artist):
+                                        matched = True
+                                else:
+                                    # Strict: require exact match (case-insensitive)
+                                    if db_artist and target_artist and db_artist == target_artist:
+                                        matched = True
+
+                                metrics.FALLBACK_MATCHES.inc(result='matched' if matched else 'rejected')
+                                if matched:
+                                    found_id = self._canonical_ids([str(row.get('id'))])[0]
+                                    seed_ids.append(found_id)
+                                    logger.debug(f"回退匹配成功: {mid} -> {found_id} (db_artist={db_artist}, target={target_artist})")
+                                else:
+                                    logger.debug(f"回退匹配被拒绝(严格模式): {mid} (db_artist={db_artist}, target={target_artist})")
                             else:
-                                logger.debug(f"回退匹配被拒绝(严格模式): {mid} (db_artist={db_artist}, target={target_artist})")
-                    except Exception as e:
-                        logger.debug(f"回退查找失败 for {mid}: {e}")
+                                metrics.FALLBACK_MATCHES.inc(result='not_found')
+                        except Exception as e:
+                            metrics.FALLBACK_MATCHES.inc(result='error')
+                            logger.debug(f"回退查找失败 for {mid}: {e}")
 
         # Recompute mask after possible fallbacks
-        seed_mask = self.df.index.isin(seed_ids)
-        if not np.any(seed_mask):
+        return np.flatnonzero(self.df.index.isin(seed_ids))
+
+    def recommend_positions(self, seed_positions, limit=50, genre=None, year_range=None, min_popularity=None,
+                            frontier_key=None):
+        """
+        对已解析的种子行号执行相似度检索，返回 Top-N 歌曲记录。
+        并发的相同请求 (同一索引版本、同一种子集合、同一 limit 与过滤条件) 只计算一次，结果共享。
+        frontier_key 不为空时复用/维护该歌单的候选前沿 (见 _frontier_top_k)。
+        """
+        # 只读取一次索引快照：训练完成后的切换不会影响进行中的检索
+        with self._leased_index() as index:
+            if index is None:
+                return []
+            return self._recommend_positions(index, seed_positions, limit, genre, year_range, min_popularity,
+                                             frontier_key)
+
+    def _recommend_positions(self, index, seed_positions, limit, genre, year_range, min_popularity, frontier_key):
+        filter_key = self._filter_key(genre, year_range, min_popularity)
+        eligible = index.filters.eligible(genre, year_range, min_popularity) if filter_key else None
+        seed_positions = np.asarray(seed_positions, dtype=np.int64)
+        # 入库切换的瞬间，按新表解析的行号可能超出旧快照
+        seed_positions = seed_positions[seed_positions < len(index.df)]
+        if seed_positions.size == 0:
             logger.warning("歌单中的歌曲未在数据库中找到。")
-            return self.df.sample(limit).to_dict('records')
+            if eligible is not None:
+                picked = np.random.permutation(eligible)[:limit]
+                return index.records(picked)
+            return index.records(np.random.choice(len(index.df), min(limit, len(index.df)), replace=False))
+
+        # Max 策略与种子顺序、重复无关，按去重排序后的集合合并
+        unique_positions = np.unique(seed_positions)
+        seed_digest = hashlib.blake2b(unique_positions.tobytes(), digest_size=16).hexdigest()
+        # 前沿与种子聚类 (近似) 会改变结果或副作用，一并计入合并键：只有走同一路径的请求才共享结果
+        key = (index.version, seed_digest, limit, filter_key, frontier_key,
+               self._cluster_params(frontier_key, unique_positions.size))
+        records, shared = self._inflight.do(key,
+                                            self._score_positions, index, unique_positions, limit, eligible,
+                                            frontier_key, filter_key)
+        if shared:
+            logger.info(f"[SingleFlight] 复用并发中的相同检索结果 ({unique_positions.size} 首种子)")
+        # 共享结果只读；每个调用方 (包括发起计算的一方) 都拿到独立副本，修改记录不会影响其他调用方
+        return self._copy_records(records)
+
+    @staticmethod
+    def _copy_records(records):
+        return [{k: list(v) if isinstance(v, list) else v for k, v in r.items()} for r in records]
+
+    @staticmethod
+    def _filter_key(genre, year_range, min_popularity):
+        """过滤条件的可哈希表示 (用于合并相同请求)；无条件时为 None。"""
+        if isinstance(genre, str):
+            genre = tuple(g.strip().lower() for g in genre.split(',') if g.strip())
+        elif genre:
+            genre = tuple(str(g).strip().lower() for g in genre)
+        year_range = tuple(year_range) if year_range and any(y is not None for y in year_range) else None
+        if not (genre or year_range or min_popularity is not None):
+            return None
+        return (genre or None, year_range, min_popularity)
+
+    def _cluster_params(self, frontier_key, n_seeds):
+        """
+        本次检索是否走种子聚类 (近似)：是则返回聚类参数，否则为 None。
+        种子聚类只用于没有候选前沿的请求：前沿本身是精确的，且歌单追加歌曲时只需对新种子打分。
+        """
+        if frontier_key is not None or not self.seed_clusters or n_seeds <= self.seed_clusters:
+            return None
+        return (self.seed_clusters, self.seed_cluster_bonus, self.seed_cluster_rerank, self.seed_cluster_min_cohesion)
 
-        logger.info(f"[Step 1] 输入分析: 识别到 {np.sum(seed_mask)} 首有效种子歌曲。")
+    def _score_positions(self, index, seed_positions, limit, eligible=None, frontier_key=None, filter_key=None):
+        logger.info(f"[Step 1] 输入分析: 识别到 {seed_positions.size} 首有效种子歌曲。")
         # 2. Latent Mapping
-        seed_vectors = self.embeddings[seed_mask]
-        logger.info(f"[Step 2] 深度编码: 已将种子歌曲映射到 32维 潜在风格空间。")
+        logger.info(f"[Step 2] 深度编码: 已将种子歌曲映射到 {index.dim}维 潜在风格空间。")
 
         # 3. Similarity Search (Max Similarity Strategy)
         # 策略变更: 不再计算平均口味，而是为每首种子歌曲寻找相似歌曲，然后取最大值。
         # 这能更好地保留歌单的多样性 (例如同时包含古典和金属)。
         logger.info("[Step 3] 全库检索: 正在计算相似度 (Max Strategy)...")
         
-        from sklearn.preprocessing import normalize
-        
-        # 归一化向量 (L2 Norm) 以便直接使用点积计算余弦相似度
-        # shape: (N_db, 32)
-        db_norm = normalize(self.embeddings, axis=1)
+        # 全库向量已在 _build_index 中归一化 (L2 Norm)，直接使用点积计算余弦相似度
         # shape: (N_seeds, 32)
-        seeds_norm = normalize(seed_vectors, axis=1)
-        
-        # 初始化最大相似度数组
-        n_db = self.embeddings.shape[0]
-        max_scores = np.full(n_db, -1.0)
-        
-        # 逐个种子计算相似度并更新最大值 (内存优化)
-        # 相当于: 对于库里的每首歌，它与我歌单里最像的那首歌有多像？
-        for i in range(seeds_norm.shape[0]):
-            # dot product: (32,) @ (32, N_db) -> (N_db,)
-            sim = np.dot(db_norm, seeds_norm[i])
-            max_scores = np.maximum(max_scores, sim)
-            
-        scores = max_scores
+        seeds_norm = index.vectors(seed_positions)
+        clustered = self._cluster_params(frontier_key, len(seeds_norm)) is not None
         
-        # 排除种子歌曲自身 (避免推荐已有的歌)
-        scores[seed_mask] = -1
-        
-        # 获取 Top N
-        top_indices = scores.argsort()[-limit:][::-1]
-        recommendations = self.df.iloc[top_indices]
+        if eligible is not None:
+            logger.info(f"[Step 3] 过滤条件生效: 仅对 {len(eligible)} / {len(index.df)} 首候选歌曲打分")
+
+        # 排除种子歌曲自身 (避免推荐已有的歌)，获取 Top N
+        with metrics.span('similarity_scan'):
+            if frontier_key is not None:
+                top_indices, top_scores = self._frontier_top_k(index, frontier_key, filter_key, seed_positions, seeds_norm,
+                                                               limit, eligible)
+            elif clustered:
+                top_indices, top_scores = self._clustered_top_k(index, seeds_norm, seed_positions, limit, eligible)
+            else:
+                top_indices, top_scores = self._scan_top_k(index.embeddings_norm, seeds_norm, limit, seed_positions,
+                                                           shards=index.shards, eligible=eligible)
         
-        top_score = scores[top_indices][0]
+        top_score = top_scores[0] if len(top_scores) else float('nan')
         logger.info(f"[SUCCESS] 推荐生成完毕! 最佳匹配度: {top_score:.4f}")
         logger.debug("="*50 + "\n")
         
-        return recommendations.to_dict('records')
+        with metrics.span('materialize'):
+            return index.records(top_indices)
+
+    def _clustered_top_k(self, index, seeds_norm, seed_positions, limit, eligible=None):
+        """种子聚类：k 个代表向量召回 limit * RERANK 个候选，再按全部种子精确重排取 Top-K；歌单过于分散时精确扫描。"""
+        db_norm = index.embeddings_norm
+        centers, bonus = cluster_seeds(seeds_norm, self.seed_clusters, max_bonus=self.seed_cluster_bonus)
+        cohesion = cluster_cohesion(seeds_norm, centers)
+        if cohesion < self.seed_cluster_min_cohesion:
+            logger.info(f"[Step 2] 种子过于分散 (聚合度 {cohesion:.2f})，不做聚类，精确扫描")
+            return self._scan_top_k(db_norm, seeds_norm, limit, seed_positions, shards=index.shards, eligible=eligible)
+        logger.info(f"[Step 2] 种子聚类: {len(seed_positions)} 首种子压缩为 {len(centers)} 个代表向量 (聚合度 {cohesion:.2f})")
+        candidates, _ = self._scan_top_k(db_norm, centers, limit * self.seed_cluster_rerank, seed_positions,
+                                         shards=index.shards, eligible=eligible, bonus=bonus)
+        return rerank_max_sim(candidates, index.vectors(candidates), seeds_norm, limit)
+
+    def _frontier_top_k(self, index, frontier_key, filter_key, seed_positions, seeds_norm, limit, eligible=None):
+        """
+        基于歌单候选前沿的精确 Top-K。Max-Sim 得分随种子增加单调不减：
+        - 种子未变：直接取前沿的前 K 行；
+        - 只新增种子：只用新种子做一次全库检索 (取 Top-M)，与旧前沿合并后对候选行按全部种子精确重算，
+          前沿之外的行得分不超过 max(旧前沿阈值, 新种子检索的第 M 名)，据此判断结果是否仍然精确；
+        - 删除了种子、索引版本或过滤条件变化、前沿不足以给出精确结果：全量重算。
+        """
+        db_norm = index.embeddings_norm
+        version = (index.version, filter_key)
+        size = max(self.frontier_size, limit)
+        frontier = self._frontiers.get(frontier_key)
+        if frontier is not None and frontier.version == version and np.isin(frontier.seeds, seed_positions).all():
+            new_seeds = np.setdiff1d(seed_positions, frontier.seeds, assume_unique=True)
+            if not new_seeds.size:
+                if frontier.covers(limit):
+                    self._frontiers.count('reused')
+                    return frontier.positions[:limit], frontier.scores[:limit]
+            else:
+                new_positions, new_scores = self._scan_top_k(db_norm, seeds_norm[np.isin(seed_positions, new_seeds)],
+                                                             size, seed_positions,
+                                                             shards=index.shards, eligible=eligible)
+                bound = max(frontier.threshold, float(new_scores[-1]) if len(new_scores) >= size else -np.inf)
+                candidates = np.union1d(frontier.positions, new_positions)
+                # 只保留真实候选：去掉全部种子 (含此前的种子)
+                candidates = candidates[~np.isin(candidates, seed_positions)]
+                # 候选行数很少 (<= 2M)，按全部种子精确重算
+                exact = (index.vectors(candidates) @ seeds_norm.T).max(axis=1)
+                order = self._top_k(exact, size)
+                threshold = bound if len(candidates) <= size else max(bound, float(exact[order[-1]]))
+                updated = PlaylistFrontier(version, seed_positions, candidates[order], exact[order], threshold)
+                if updated.covers(limit):
+                    self._frontiers.put(frontier_key, updated)
+                    self._frontiers.count('incremental')
+                    logger.info(f"[Frontier] 歌单新增 {new_seeds.size} 首歌曲，仅对新种子全库打分后合并")
+                    return updated.positions[:limit], updated.scores[:limit]
+
+        positions, scores = self._scan_top_k(db_norm, seeds_norm, size, seed_positions,
+                                             shards=index.shards, eligible=eligible)
+        # 库中行数少于前沿大小时，未填满的位置与种子不能进入前沿
+        valid = np.isfinite(scores) & ~np.isin(positions, seed_positions)
+        positions, scores = positions[valid], scores[valid]
+        threshold = float(scores[-1]) if len(scores) >= size else -np.inf
+        self._frontiers.put(frontier_key, PlaylistFrontier(version, seed_positions, positions, scores, threshold))
+        self._frontiers.count('full')
+        return positions[:limit], scores[:limit]
+
+
+class RecommenderView:
+    """
+    共享引擎上的配置视图：只覆盖 fallback_loose 等请求级配置，
+    其余属性与方法 (df、embeddings、recommend_positions 等) 全部委托给底层引擎。
+    """
+
+    def __init__(self, engine, fallback_loose):
+        self._engine = engine
+        self.fallback_loose = fallback_loose
+
+    def __getattr__(self, name):
+        return getattr(self._engine, name)
+
+    def resolve_seed_positions(self, seed_track_infos, fallback_loose=None):
+        loose = self.fallback_loose if fallback_loose is None else fallback_loose
+        return self._engine.resolve_seed_positions(seed_track_infos, fallback_loose=loose)
+
+    def recommend(self, seed_track_infos, limit=50, fallback_loose=None, **filters):
+        loose = self.fallback_loose if fallback_loose is None else fallback_loose
+        return self._engine.recommend(seed_track_infos, limit=limit, fallback_loose=loose, **filters)
@@ -0,0 +1,248 @@
+"""
+检索质量/延迟评估：以逐个种子取最大值的精确检索 (Max-Sim) 为基准，对每个可用的检索方案及其参数
+计算 recall@10 / recall@K、重合度与耗时，输出表格并可另存 JSON，作为上线更快检索路径前的依据。
+
+    python retrieval_eval.py --embeddings model_cache/embeddings.npy --seeds 100 --json eval.json
+    python retrieval_eval.py --backends clustered --clusters 4,8,16,32
+    python retrieval_eval.py --backends exact,parallel,sharded --workers 2,4 --shards 2,4
+    python retrieval_eval.py --embeddings model_cache/embeddings.npy --backends exact \
+        --alt-embeddings model_cache/embeddings_pca.npy
+
+检索方案 (--backends)：
+    exact       单线程精确扫描 (基准本身，用于对照耗时)
+    parallel    按行切块多线程扫描后合并 Top-K (RECOMMENDER_SCAN_WORKERS)，参数 --workers
+    sharded     多进程分片索引 scatter-gather (RECOMMENDER_SHARDS)，参数 --shards；当前平台不可用时跳过
+    clustered   种子聚类为 k 个代表向量召回候选，再按全部种子精确重排 (RECOMMENDER_SEED_CLUSTERS)，
+                参数 --clusters / --cluster-bonus / --rerank / --min-cohesion (过于分散的歌单改为精确扫描)
+前三者理论上与基准完全一致，评估用于确认这一点并给出加速比；clustered 为近似方案 (召回不足时丢失结果)。
+--alt-embeddings 另给同一曲库 (行顺序一致) 的其他编码器向量 (如 RECOMMENDER_ENCODER=pca 生成的
+embeddings_pca.npy)，在其空间内精确检索，衡量换编码器后推荐结果与当前向量的重合度。
+
+模拟歌单：随机选若干 "锚点" 歌曲，每个锚点取其近邻组成一组，再混入少量随机歌曲，
+接近真实歌单 "几种风格 + 零散曲目" 的分布。指标：
+    recall@10 / recall@K   结果前 10 / 前 K 与精确 Top-10 / Top-K 的重合比例
+    overlap@K              精确 Top-10 落在结果 Top-K 中的比例 (精排/重排前的候选覆盖率)
+    score_ratio            结果在精确打分 (Max-Sim) 下的平均得分 / 精确 Top-K 的平均得分
+    *_ms                   单次检索耗时 (均值 / p50 / p95)，speedup 为精确检索均值耗时 / 该方案均值耗时
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from similarity import cluster_cohesion, cluster_seeds, local_positions, max_sim_top_k, merge_top_k, rerank_max_sim
+
+
+def load_embeddings(path=None, rows=200000, dim=32, seed=0):
+    if path:
+        db = np.load(path).astype(np.float32)
+    else:
+        # 无真实向量时生成带簇结构的随机向量
+        rng = np.random.default_rng(seed)
+        centers = rng.standard_normal((64, dim)).astype(np.float32)
+        db = centers[rng.integers(0, 64, rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    db /= np.maximum(np.linalg.norm(db, axis=1, keepdims=True), 1e-12)
+    return db
+
+
+def sample_playlist(db, size, rng, max_anchors=8, noise=0.1):
+    """锚点近邻 + 少量随机曲目组成的模拟歌单 (行号，不重复)。"""
+    n_anchors = int(rng.integers(1, max_anchors + 1))
+    n_noise = int(round(size * noise))
+    per_anchor = max(1, (size - n_noise) // n_anchors)
+    chosen = set()
+    for anchor in rng.choice(len(db), n_anchors, replace=False):
+        neighbours, _ = max_sim_top_k(db, db[anchor][None, :], per_anchor * 3)
+        chosen.update(int(p) for p in rng.choice(neighbours, per_anchor, replace=False))
+    while len(chosen) < size:
+        chosen.add(int(rng.integers(0, len(db))))
+    return np.array(sorted(chosen)[:size], dtype=np.int64)
+
+
+def exact_scores(db, seeds, positions):
+    """精确 Max-Sim 得分 (只对给定行计算)。"""
+    return (db[positions] @ db[seeds].T).max(axis=1)
+
+
+# --- 检索方案：每个工厂返回 (名称, 参数, search(seeds, limit) -> 行号, close) ---
+
+def exact_backend(db):
+    return 'exact', {}, lambda seeds, limit: max_sim_top_k(db, db[seeds], limit, seeds)[0], None
+
+
+def parallel_backend(db, workers):
+    """与 ContentBasedRecommender._scan_top_k 的多线程路径相同：按行切块、块内 Top-K、合并。"""
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='eval-scan')
+    bounds = np.linspace(0, len(db), workers + 1).astype(np.int64)
+
+    def search(seeds, limit):
+        queries = db[seeds]
+        futures = [executor.submit(max_sim_top_k, db[start:stop], queries, limit,
+                                   local_positions(seeds, start, stop), int(start))
+                   for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        return merge_top_k([f.result() for f in futures], limit)[0]
+    return 'parallel', {'workers': workers}, search, executor.shutdown
+
+
+def sharded_backend(db, shards):
+    from sharded_index import ShardedIndex
+    index = ShardedIndex(db, shards)
+    return 'sharded', {'shards': shards}, lambda seeds, limit: index.top_k(db[seeds], limit, seeds)[0], index.close
+
+
+def clustered_backend(db, k, max_bonus, rerank, min_cohesion):
+    """与 ContentBasedRecommender._clustered_top_k 相同：代表向量召回 limit * rerank 个候选后精确重排。"""
+    def search(seeds, limit):
+        queries, bonus = cluster_seeds(db[seeds], k, max_bonus=max_bonus)
+        if cluster_cohesion(db[seeds], queries) < min_cohesion:
+            return max_sim_top_k(db, db[seeds], limit, seeds)[0]
+        candidates, _ = max_sim_top_k(db, queries, limit * rerank, seeds, bonus=bonus)
+        return rerank_max_sim(candidates, db[candidates], db[seeds], limit)[0]
+    return 'clustered', {'clusters': k, 'bonus': max_bonus, 'rerank': rerank, 'min_cohesion': min_cohesion}, search, None
+
+
+def embeddings_backend(path, rows):
+    """另一编码器的向量空间：同一组种子行号在该空间内精确检索。"""
+    alt = load_embeddings(path)
+    if len(alt) != rows:
+        raise ValueError(f"行数不一致 ({len(alt)} != {rows})")
+    search = lambda seeds, limit: max_sim_top_k(alt, alt[seeds], limit, seeds)[0]  # noqa: E731
+    return 'embeddings', {'path': os.path.basename(path), 'dim': int(alt.shape[1])}, search, None
+
+
+def build_backends(db, args):
+    """
+    按命令行展开各方案的参数组合，依次产出 (名称, 参数, search, close, 错误)；
+    无法启用的方案 (如分片进程启动失败) 只带错误信息，由调用方记为跳过。
+    """
+    ints = lambda text: [int(x) for x in str(text).split(',') if x.strip()]  # noqa: E731
+    factories = []
+    for name in [b.strip() for b in args.backends.split(',') if b.strip()]:
+        if name == 'exact':
+            factories.append((name, {}, lambda: exact_backend(db)))
+        elif name == 'parallel':
+            factories.extend((name, {'workers': w}, lambda w=w: parallel_backend(db, w)) for w in ints(args.workers))
+        elif name == 'sharded':
+            factories.extend((name, {'shards': s}, lambda s=s: sharded_backend(db, s)) for s in ints(args.shards))
+        elif name == 'clustered':
+            factories.extend((name, {'clusters': k}, lambda k=k: clustered_backend(db, k, args.cluster_bonus, args.rerank,
+                                                                              args.min_cohesion))
+                             for k in ints(args.clusters))
+        else:
+            raise ValueError(f"未知检索方案: {name}")
+    for path in [p.strip() for p in (args.alt_embeddings or '').split(',') if p.strip()]:
+        factories.append(('embeddings', {'path': os.path.basename(path)},
+                          lambda path=path: embeddings_backend(path, len(db))))
+    for name, params, factory in factories:
+        try:
+            yield (*factory(), None)
+        except Exception as exc:
+            print(f"[WARN] 跳过 {name} {params}: {exc}")
+            yield name, params, None, None, str(exc)
+
+
+def ground_truth(db, playlists, limit):
+    """精确 Top-K 与其耗时 (基准)。"""
+    truths, times = [], []
+    for seeds in playlists:
+        start = time.perf_counter()
+        truths.append(max_sim_top_k(db, db[seeds], limit, seeds)[0])
+        times.append((time.perf_counter() - start) * 1000)
+    return truths, float(np.mean(times))
+
+
+def evaluate(db, playlists, truths, search, limit, repeats=1):
+    recall_10, recall_k, overlap, ratios, times = [], [], [], [], []
+    for seeds, exact in zip(playlists, truths):
+        got = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            got = np.asarray(search(seeds, limit))
+            times.append((time.perf_counter() - start) * 1000)
+        exact_10 = set(exact[:10].tolist())
+        recall_10.append(len(exact_10 & set(got[:10].tolist())) / max(1, len(exact_10)))
+        recall_k.append(len(set(exact.tolist()) & set(got.tolist())) / max(1, len(exact)))
+        overlap.append(len(exact_10 & set(got.tolist())) / max(1, len(exact_10)))
+        ratios.append(float(exact_scores(db, seeds, got).mean() / exact_scores(db, seeds, exact).mean()))
+    return {
+        'recall@10': round(float(np.mean(recall_10)), 4),
+        f'recall@{limit}': round(float(np.mean(recall_k)), 4),
+        f'overlap@{limit}': round(float(np.mean(overlap)), 4),
+        'score_ratio': round(float(np.mean(ratios)), 4),
+        'ms_mean': round(float(np.mean(times)), 2),
+        'ms_p50': round(float(np.percentile(times, 50)), 2),
+        'ms_p95': round(float(np.percentile(times, 95)), 2),
+    }
+
+
+def _label(r):
+    return r['backend'] + (' ' + ','.join(f"{k}={v}" for k, v in r['params'].items()) if r['params'] else '')
+
+
+def print_table(report):
+    limit = report['limit']
+    cols = ['recall@10', f'recall@{limit}', f'overlap@{limit}', 'score_ratio', 'ms_mean', 'ms_p95', 'speedup']
+    print(f"精确基准: {report['exact_ms_mean']:.2f} ms/次 ({report['rows']} 行, 种子 {report['seeds']}, "
+          f"歌单 {report['playlists']})")
+    width = max([36] + [len(_label(r)) + 2 for r in report['results']])
+    print(f"{'backend':<{width}}" + ''.join(f"{c:>13}" for c in cols))
+    for r in report['results']:
+        label = _label(r)
+        if r.get('skipped'):
+            print(f"{label:<{width}} 跳过: {r['skipped']}")
+            continue
+        print(f"{label:<{width}}" + ''.join(f"{r[c]:>13.4f}" if c.startswith(('recall', 'overlap', 'score'))
+                                          else f"{r[c]:>13.2f}" for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索质量/延迟评估 (以精确 Max-Sim 为基准)")
+    parser.add_argument('--embeddings', help='embeddings.npy 路径 (默认生成带簇结构的随机向量)')
+    parser.add_argument('--rows', type=int, default=200000, help='随机向量行数')
+    parser.add_argument('--seeds', type=int, default=100, help='每个模拟歌单的种子数')
+    parser.add_argument('--playlists', type=int, default=30)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=1, help='每个歌单重复检索次数 (计时更稳定)')
+    parser.add_argument('--backends', default='exact,parallel,sharded,clustered', help='逗号分隔的检索方案')
+    parser.add_argument('--workers', default='2,4', help='parallel 的线程数 (逗号分隔)')
+    parser.add_argument('--shards', default='2,4', help='sharded 的分片数 (逗号分隔)')
+    parser.add_argument('--clusters', default='4,8,16,32', help='clustered 的 k 值 (逗号分隔)')
+    parser.add_argument('--cluster-bonus', type=float, default=0.0, help='按簇大小给代表向量的最大加分 (0 为不加分)')
+    parser.add_argument('--rerank', type=int, default=20, help='clustered 召回候选数 = limit * rerank')
+    parser.add_argument('--min-cohesion', type=float, default=0.85, help='种子聚合度低于该值时改为精确扫描')
+    parser.add_argument('--alt-embeddings', help='其他编码器生成的向量 (逗号分隔)，与 --embeddings 比较推荐重合度')
+    parser.add_argument('--json', help='结果另存为 JSON 文件')
+    args = parser.parse_args()
+
+    db = load_embeddings(args.embeddings, rows=args.rows)
+    rng = np.random.default_rng(42)
+    playlists = [sample_playlist(db, args.seeds, rng) for _ in range(args.playlists)]
+    truths, exact_ms = ground_truth(db, playlists, args.limit)
+
+    results = []
+    for name, params, search, close, error in build_backends(db, args):
+        if error is not None:
+            results.append({'backend': name, 'params': params, 'skipped': error})
+            continue
+        try:
+            row = evaluate(db, playlists, truths, search, args.limit, args.repeats)
+        finally:
+            if close is not None:
+                close()
+        row['speedup'] = round(exact_ms / row['ms_mean'], 2) if row['ms_mean'] else 0.0
+        results.append({'backend': name, 'params': params, **row})
+
+    report = {'rows': int(len(db)), 'dim': int(db.shape[1]), 'seeds': args.seeds, 'playlists': args.playlists,
+              'limit': args.limit, 'repeats': args.repeats, 'exact_ms_mean': round(exact_ms, 2), 'results': results}
+    print_table(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"[INFO] 结果已写入 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
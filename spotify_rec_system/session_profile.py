@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+
+from infra import RedisFeatureStore
+
+
+class SessionVectorStore:
+    """
+    会话兴趣向量：对点击过的歌曲 (已归一化) embedding 做指数衰减累加
+        v <- decay * v + e_track
+    每次交互只做一次 32 维运算；推荐时只需用 v 做一次单向量检索。
+
+    存储优先使用 Redis (RedisFeatureStore.store_user_features)，未启用时降级为进程内 LRU。
+    向量所在空间 (embedding_space) 编入 key，模型更换后旧向量自然失效。
+    update 的读-改-写是原子的：Redis 上由 Lua 脚本完成，进程内按会话加锁 (分段锁)，并发的 /events 不会丢失更新。
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, feature_store: Optional[RedisFeatureStore] = None, decay: float = 0.8,
+                 ttl_seconds: int = 3600, max_local_sessions: int = 10000, precision: int = 5):
+        self.feature_store = feature_store
+        self.decay = decay
+        self.ttl_seconds = ttl_seconds
+        self.max_local_sessions = max_local_sessions
+        self.precision = precision
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._session_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    @staticmethod
+    def _user_key(session_id: str, space: str) -> str:
+        return f"session:{space}:{session_id}"
+
+    def get(self, session_id: str, space: str) -> Optional[np.ndarray]:
+        key = self._user_key(session_id, space)
+        if self.feature_store and self.feature_store.enabled:
+            data = self.feature_store.get_user_features(key)
+            return np.asarray(data, dtype=np.float32) if data else None
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            vector, expires_at = item
+            if expires_at < time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return vector
+
+    def put(self, session_id: str, space: str, vector: np.ndarray):
+        key = self._user_key(session_id, space)
+        if self.feature_store and self.feature_store.enabled:
+            # 保留 5 位小数即可，JSON 体积约为完整 float 的一半
+            compact = [round(float(x), self.precision) for x in vector]
+            self.feature_store.store_user_features(key, compact, ttl_seconds=self.ttl_seconds)
+            return
+        with self._lock:
+            self._local[key] = (vector, time.time() + self.ttl_seconds)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_sessions:
+                self._local.popitem(last=False)
+
+    def update(self, session_id: str, space: str, track_vector: np.ndarray) -> np.ndarray:
+        """记录一次交互，返回更新后的会话向量。"""
+        track_vector = np.asarray(track_vector, dtype=np.float32)
+        key = self._user_key(session_id, space)
+        if self.feature_store and self.feature_store.enabled:
+            compact = [round(float(x), self.precision) for x in track_vector]
+            data = self.feature_store.decay_add_user_features(key, compact, self.decay, ttl_seconds=self.ttl_seconds,
+                                                              precision=self.precision)
+            return np.asarray(data, dtype=np.float32) if data else track_vector.copy()
+        with self._session_locks[hash(key) % self.LOCK_STRIPES]:
+            current = self.get(session_id, space)
+            if current is None or current.shape != track_vector.shape:
+                updated = track_vector.copy()
+            else:
+                updated = self.decay * current + track_vector
+            self.put(session_id, space, updated)
+            return updated
+
+    def rebuild(self, session_id: Optional[str], space: str, track_vectors: Iterable[np.ndarray]) -> Optional[np.ndarray]:
+        """按时间顺序 (旧 -> 新) 重放向量重建会话向量，用于冷启动或模型切换后。"""
+        vector = None
+        for tv in track_vectors:
+            tv = np.asarray(tv, dtype=np.float32)
+            vector = tv.copy() if vector is None else self.decay * vector + tv
+        if vector is not None and session_id:
+            self.put(session_id, space, vector)
+        return vector
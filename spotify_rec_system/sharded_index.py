@@ -0,0 +1,511 @@
+"""
+分片向量索引：把归一化后的全库向量按行切成 N 片，每片由一个独立的本地工作进程持有，
+协调方通过 Unix Socket (multiprocessing.connection) 把查询向量扇出到各分片，
+各分片返回局部 Top-K，协调方合并得到全局 Top-K (scatter-gather)。
+
+向量来源为 .npy 文件：各工作进程只映射 (mmap) 并读入自己那一片，协调方不持有全库矩阵，
+也不再为每个分片另写一份文件，因此单进程内存随分片数下降。过滤后的候选行号同样下发到分片内打分。
+
+增量入库不重启工作进程：with_rows 生成新版本 (只复制被改动的分片，新行追加到最后一片)，
+新旧版本在工作进程内并存；每个版本按引用计数管理，被替换 (retire) 且最后一个使用者释放后丢弃，
+所有版本都丢弃后工作进程退出。单机即可验证任意分片数：
+    python sharded_index.py --self-check --rows 200000 --shards 4
+    python sharded_index.py --self-check --embeddings model_cache/embeddings.npy --shards 2
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from similarity import local_positions, max_sim_top_k, merge_top_k
+
+AUTHKEY_ENV = 'SHARD_AUTHKEY'
+
+
+class ShardError(Exception):
+    """分片工作进程启动失败或请求出错。"""
+
+
+def l2_normalize(block: np.ndarray) -> np.ndarray:
+    """原地按行 L2 归一化 (零向量保持不变)，与 sklearn.preprocessing.normalize 一致。"""
+    norms = np.sqrt(np.einsum('ij,ij->i', block, block))
+    norms[norms == 0.0] = 1.0
+    block /= norms[:, None]
+    return block
+
+
+# --- 工作进程 ---
+
+def serve_shard(socket_path: str, source: str, start: int, stop: int, authkey: bytes,
+                normalize: bool = False, last: bool = False):
+    """
+    分片工作进程主循环：每个连接一个线程 (NumPy 点积释放 GIL)，收到 close 后退出。
+    blocks 按版本保存本分片的向量；未被改动的版本之间共享同一数组。
+    """
+    block = np.array(np.load(source, mmap_mode='r')[start:stop], dtype=np.float32)
+    if normalize:
+        l2_normalize(block)
+    blocks = {0: block}
+    parent = os.getppid()
+    listener = Listener(socket_path, family='AF_UNIX', authkey=authkey)
+    closing = threading.Event()
+
+    def watch_parent():
+        # 协调进程意外退出时随之退出，避免遗留孤儿进程
+        while not closing.is_set():
+            if os.getppid() != parent:
+                os._exit(0)
+            time.sleep(1.0)
+
+    def top_k(block, queries, limit, exclude, bonus, eligible):
+        end = start + block.shape[0]
+        if eligible is None:
+            return max_sim_top_k(block, queries, limit, local_positions(exclude, start, end), offset=start, bonus=bonus)
+        # 调用方已从候选中去掉种子
+        local = local_positions(eligible, start, end)
+        if not local.size:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        top, scores = max_sim_top_k(block[local], queries, limit, bonus=bonus)
+        return local[top] + start, scores
+
+    def upsert(block, positions, vectors):
+        end = start + block.shape[0]
+        inside = (positions >= start) & (positions < end)
+        appended = (positions >= end) if last else np.zeros(len(positions), dtype=bool)
+        if not inside.any() and not appended.any():
+            return block
+        order = np.argsort(positions[appended])
+        if not np.array_equal(positions[appended][order], np.arange(end, end + order.size)):
+            raise ValueError("新增行号必须紧接在末尾")
+        updated = np.concatenate([block, vectors[appended][order]]) if order.size else block.copy()
+        updated[positions[inside] - start] = vectors[inside]
+        return updated
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = message[0]
+                try:
+                    if op == 'topk':
+                        _, version, queries, limit, exclude, bonus, eligible = message
+                        result = top_k(blocks[version], queries, limit, exclude, bonus, eligible)
+                    elif op == 'vectors':
+                        _, version, positions = message
+                        block = blocks[version]
+                        result = block[local_positions(positions, start, start + block.shape[0])]
+                    elif op == 'upsert':
+                        _, version, new_version, positions, vectors = message
+                        blocks[new_version] = upsert(blocks[version], positions, vectors)
+                        result = int(blocks[new_version].shape[0])
+                    elif op == 'drop':
+                        blocks.pop(message[1], None)
+                        result = None
+                    elif op == 'info':
+                        block = blocks[message[1]]
+                        result = {'start': start, 'stop': start + int(block.shape[0]), 'dim': int(block.shape[1]),
+                                  'versions': len(blocks), 'pid': os.getpid()}
+                    elif op == 'close':
+                        conn.send(('ok', None))
+                        closing.set()
+                        return
+                    else:
+                        raise ValueError(f"未知操作: {op}")
+                    conn.send(('ok', result))
+                except Exception as exc:
+                    conn.send(('error', str(exc)))
+
+    def accept_loop():
+        while not closing.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+    # 关闭 listener 不会唤醒阻塞中的 accept，主线程只等待 close 信号，随后进程退出
+    threading.Thread(target=accept_loop, daemon=True).start()
+    closing.wait()
+    listener.close()
+
+
+# --- 协调方 ---
+
+# 仍在运行的工作进程组：进程退出时统一关闭 (只注册一次 atexit，不随版本累积)
+_live_pools = weakref.WeakSet()
+
+
+@atexit.register
+def _close_live_pools():
+    for pool in list(_live_pools):
+        pool.close()
+
+
+class _ShardPool:
+    """一组分片工作进程及其连接通道，由同一来源派生的各版本 ShardedIndex 共享。"""
+
+    def __init__(self, source: str, bounds, normalize: bool, workdir: str, own_workdir: bool, connections: int,
+                 startup_timeout: float, request_timeout: float):
+        self._own_workdir = own_workdir
+        self.request_timeout = request_timeout
+        self.workdir = workdir
+        self._authkey = secrets.token_bytes(16)
+        self._procs: List[subprocess.Popen] = []
+        self._channels: "queue.Queue[list]" = queue.Queue()
+        self._all_conns = []
+        self._lock = threading.Lock()
+        self._live_versions = 0
+        self._next_version = 0
+        self.closed = False
+        try:
+            self._sockets = self._spawn(source, bounds, normalize)
+            for _ in range(max(1, connections)):
+                self._channels.put(self._open_channel(startup_timeout))
+        except Exception:
+            self.close()
+            raise
+        _live_pools.add(self)
+
+    def _spawn(self, source: str, bounds, normalize: bool) -> List[str]:
+        env = dict(os.environ, **{AUTHKEY_ENV: self._authkey.hex()})
+        script = os.path.abspath(__file__)
+        sockets = []
+        for i, (start, stop) in enumerate(bounds):
+            socket_path = os.path.join(self.workdir, f"shard_{i}.sock")
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            command = [sys.executable, script, '--serve', '--socket', socket_path, '--source', source,
+                       '--start', str(start), '--stop', str(stop)]
+            if normalize:
+                command.append('--normalize')
+            if i == len(bounds) - 1:
+                command.append('--last')
+            self._procs.append(subprocess.Popen(command, env=env, cwd=os.path.dirname(script)))
+            sockets.append(socket_path)
+        return sockets
+
+    def _connect(self, socket_path: str, timeout: float):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return Client(socket_path, family='AF_UNIX', authkey=self._authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if any(p.poll() is not None for p in self._procs):
+                    raise ShardError("分片工作进程已退出")
+                if time.time() > deadline:
+                    raise ShardError(f"连接分片超时: {socket_path}")
+                time.sleep(0.05)
+
+    def _open_channel(self, timeout: float) -> list:
+        channel = []
+        try:
+            for path in self._sockets:
+                channel.append(self._connect(path, timeout))
+        except Exception:
+            self._close_channel(channel)
+            raise
+        with self._lock:
+            self._all_conns.extend(channel)
+        return channel
+
+    def _close_channel(self, channel: list):
+        for conn in channel:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _replace_channel(self, channel: list):
+        """出错的通道状态未知：关闭后重新连接各分片再放回池中；分片进程已退出时不再放回 (之后的请求超时报错)。"""
+        self._close_channel(channel)
+        if self.closed:
+            return
+        try:
+            self._channels.put(self._open_channel(min(5.0, self.request_timeout)))
+        except Exception:
+            pass
+
+    def scatter(self, message) -> list:
+        if self.closed:
+            raise ShardError("分片索引已关闭")
+        try:
+            channel = self._channels.get(timeout=self.request_timeout)
+        except queue.Empty:
+            raise ShardError("等待分片连接超时 (分片进程可能已退出)") from None
+        try:
+            # 先把请求发给所有分片，再依次收结果：各分片并行计算
+            for conn in channel:
+                conn.send(message)
+            replies = []
+            for conn in channel:
+                if not conn.poll(self.request_timeout):
+                    raise TimeoutError("分片响应超时")
+                replies.append(conn.recv())
+        except Exception as exc:
+            self._replace_channel(channel)
+            raise ShardError(f"分片请求失败: {exc}") from exc
+        self._channels.put(channel)
+        errors = [payload for status, payload in replies if status != 'ok']
+        if errors:
+            raise ShardError(f"分片返回错误: {errors[0]}")
+        return [payload for _, payload in replies]
+
+    def attach(self) -> int:
+        """登记一个新版本，返回版本号。"""
+        with self._lock:
+            version = self._next_version
+            self._next_version += 1
+            self._live_versions += 1
+            return version
+
+    def detach(self, version: int):
+        """丢弃一个版本；最后一个版本丢弃后关闭工作进程。"""
+        with self._lock:
+            self._live_versions -= 1
+            last = self._live_versions <= 0
+        if last:
+            self.close()
+            return
+        try:
+            self.scatter(('drop', version))
+        except ShardError:
+            pass
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        _live_pools.discard(self)
+        for conn in self._all_conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        for i, proc in enumerate(self._procs):
+            try:
+                with Client(os.path.join(self.workdir, f"shard_{i}.sock"), family='AF_UNIX', authkey=self._authkey) as c:
+                    c.send(('close',))
+                    c.recv()
+            except Exception:
+                pass
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self._own_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class ShardedIndex:
+    """
+    分片索引的一个版本：top_k / vectors 调用扇出到所有分片后合并。
+    source 为 .npy 路径时各分片直接从文件读取自己的行 (normalize=True 时在分片内归一化)；
+    为数组时先写入工作目录的一个文件 (自检与评估用)。
+    connections 为并发通道数 (每个通道包含到每个分片的一条连接)，同一通道同一时刻只服务一个查询；
+    请求出错的通道会重新连接，分片进程退出后请求在 request_timeout 秒内以 ShardError 失败，不会一直阻塞。
+
+    引用计数：检索前 acquire()，结束后 release()；retire() 标记该版本已被替换，
+    之后 acquire() 返回 False，最后一个引用释放时丢弃该版本。close() 立即关闭整组工作进程。
+    """
+
+    def __init__(self, source, n_shards: int, workdir: Optional[str] = None, connections: int = 2,
+                 startup_timeout: float = 60.0, normalize: bool = False, request_timeout: float = 30.0):
+        own_workdir = workdir is None
+        workdir = workdir or tempfile.mkdtemp(prefix='rec-shards-')
+        os.makedirs(workdir, exist_ok=True)
+        own_file = None
+        if not isinstance(source, (str, os.PathLike)):
+            own_file = os.path.join(workdir, 'vectors.npy')
+            np.save(own_file, np.asarray(source, dtype=np.float32))
+            source = own_file
+        source = os.path.abspath(source)
+        try:
+            self.n_rows, self.dim = np.load(source, mmap_mode='r').shape
+            n_shards = max(1, min(int(n_shards), self.n_rows or 1))
+            bounds = np.linspace(0, self.n_rows, n_shards + 1).astype(np.int64)
+            self.bounds = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+            self.n_shards = n_shards
+            pool = _ShardPool(source, self.bounds, normalize, workdir, own_workdir, connections, startup_timeout,
+                              request_timeout)
+        finally:
+            # 连接建立时工作进程已读入各自的行，临时文件不再需要
+            if own_file is not None and os.path.exists(own_file):
+                os.remove(own_file)
+        self._init_version(pool, pool.attach())
+
+    def _init_version(self, pool: _ShardPool, version: int):
+        self._pool = pool
+        self._version = version
+        self._refs = 0
+        self._retired = False
+        self._ref_lock = threading.Lock()
+
+    @property
+    def closed(self) -> bool:
+        return self._pool.closed
+
+    def _scatter(self, message) -> list:
+        return self._pool.scatter(message)
+
+    def top_k(self, queries: np.ndarray, limit: int, exclude_positions=None, bonus=None,
+              eligible=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Max-Sim Top-K：与本地精确扫描结果一致，返回 (全局行号, 得分)。
+        eligible 为过滤后的有序行号 (已去掉种子) 时，各分片只对落在本片的候选打分。
+        """
+        queries = np.ascontiguousarray(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        exclude = None if exclude_positions is None else np.asarray(exclude_positions, dtype=np.int64)
+        bonus = None if bonus is None else np.asarray(bonus, dtype=np.float32)
+        eligible = None if eligible is None else np.asarray(eligible, dtype=np.int64)
+        return merge_top_k(self._scatter(('topk', self._version, queries, int(limit), exclude, bonus, eligible)), limit)
+
+    def vectors(self, positions) -> np.ndarray:
+        """按全局行号取回向量 (顺序与输入一致)。"""
+        positions = np.asarray(positions, dtype=np.int64).ravel()
+        out = np.zeros((len(positions), self.dim), dtype=np.float32)
+        for (start, stop), vecs in zip(self.bounds, self._scatter(('vectors', self._version, positions))):
+            out[(positions >= start) & (positions < stop)] = vecs
+        return out
+
+    def with_rows(self, positions, vectors) -> 'ShardedIndex':
+        """
+        派生新版本：positions 中已有的行替换为 vectors，超出末尾的行 (须连续) 追加到最后一个分片。
+        只有被改动的分片复制向量，其余分片新旧版本共享；本版本不受影响，仍可继续服务。
+        """
+        positions = np.asarray(positions, dtype=np.int64).ravel()
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        pool = self._pool
+        version = pool.attach()
+        try:
+            rows = pool.scatter(('upsert', self._version, version, positions, vectors))
+        except Exception:
+            pool.detach(version)
+            raise
+        derived = object.__new__(ShardedIndex)
+        derived._init_version(pool, version)
+        derived.dim, derived.n_shards = self.dim, self.n_shards
+        derived.bounds = []
+        start = 0
+        for count in rows:
+            derived.bounds.append((start, start + count))
+            start += count
+        derived.n_rows = start
+        return derived
+
+    def acquire(self) -> bool:
+        """登记一次使用；版本已被替换或已关闭时返回 False (调用方应改用新版本)。"""
+        with self._ref_lock:
+            if self._retired or self.closed:
+                return False
+            self._refs += 1
+            return True
+
+    def release(self):
+        with self._ref_lock:
+            self._refs -= 1
+            drop = self._retired and self._refs == 0
+        if drop:
+            self._pool.detach(self._version)
+
+    def retire(self):
+        """该版本不再接受新的使用；没有进行中的检索时立即丢弃。"""
+        with self._ref_lock:
+            if self._retired:
+                return
+            self._retired = True
+            drop = self._refs == 0
+        if drop:
+            self._pool.detach(self._version)
+
+    def info(self) -> List[dict]:
+        return self._scatter(('info', self._version))
+
+    def close(self):
+        """立即关闭整组工作进程 (包括共享同一组进程的其他版本)。"""
+        self._pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _self_check(args):
+    if args.embeddings:
+        db = np.load(args.embeddings).astype(np.float32)
+    else:
+        db = np.random.default_rng(0).standard_normal((args.rows, args.dim)).astype(np.float32)
+    db /= np.maximum(np.linalg.norm(db, axis=1, keepdims=True), 1e-12)
+    rng = np.random.default_rng(1)
+
+    results = {'rows': int(db.shape[0]), 'shards': args.shards, 'queries': args.queries, 'seeds': args.seeds}
+    start = time.perf_counter()
+    with ShardedIndex(db, args.shards) as index:
+        results['startup_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        mismatches = 0
+        exact_ms, sharded_ms = [], []
+        for _ in range(args.queries):
+            seeds = rng.choice(db.shape[0], size=min(args.seeds, db.shape[0]), replace=False)
+            t0 = time.perf_counter()
+            exact = max_sim_top_k(db, db[seeds], args.limit, seeds)
+            t1 = time.perf_counter()
+            got = index.top_k(index.vectors(seeds), args.limit, seeds)
+            t2 = time.perf_counter()
+            exact_ms.append((t1 - t0) * 1000)
+            sharded_ms.append((t2 - t1) * 1000)
+            # 得分相同的行顺序可能不同，按得分比较
+            if not np.allclose(exact[1], got[1], atol=1e-6):
+                mismatches += 1
+        results.update({
+            'mismatches': mismatches,
+            'exact_ms_mean': round(float(np.mean(exact_ms)), 2),
+            'sharded_ms_mean': round(float(np.mean(sharded_ms)), 2),
+        })
+    print(json.dumps(results, indent=2))
+    return 0 if mismatches == 0 else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="分片向量索引 (工作进程 / 自检)")
+    parser.add_argument('--serve', action='store_true', help='以分片工作进程模式运行 (由 ShardedIndex 启动)')
+    parser.add_argument('--socket')
+    parser.add_argument('--source', help='向量 .npy 文件 (工作进程读取其中 [start, stop) 行)')
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--stop', type=int, default=0)
+    parser.add_argument('--normalize', action='store_true', help='读入后按行 L2 归一化')
+    parser.add_argument('--last', action='store_true', help='最后一个分片 (入库新增的行追加到这里)')
+    parser.add_argument('--self-check', action='store_true', help='与单进程精确检索对比结果与耗时')
+    parser.add_argument('--embeddings', help='使用已有的 embeddings.npy (默认随机生成)')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=32)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--seeds', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+    if args.serve:
+        serve_shard(args.socket, args.source, args.start, args.stop, bytes.fromhex(os.environ[AUTHKEY_ENV]),
+                    normalize=args.normalize, last=args.last)
+    elif args.self_check:
+        sys.exit(_self_check(args))
+    else:
+        parser.print_help()
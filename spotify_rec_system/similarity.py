@@ -0,0 +1,118 @@
+"""
+纯 NumPy 的相似度检索内核 (不依赖 torch/pandas)，供推荐引擎与分片工作进程共用。
+向量均已 L2 归一化，点积即余弦相似度。
+"""
+import numpy as np
+
+
+def top_k(scores, limit):
+    """argpartition 取 Top-K 后只对这 K 个排序，避免全量 argsort。"""
+    limit = min(limit, len(scores))
+    if limit <= 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(scores, -limit)[-limit:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def max_sim_top_k(block, queries, limit, exclude_local=None, offset=0, bonus=None):
+    """
+    Max-Sim 打分：每行得分为与所有查询向量相似度的最大值，返回块内 Top-K 的 (行号 + offset, 得分)。
+    exclude_local 为块内行号 (0 起)，这些行不参与排序；库中可选行不足 limit 时返回的结果少于 limit 条。
+    bonus 为每个查询向量的加分 (种子聚类后按簇大小给出，有界且非负)，得分 = max(相似度 + 加分)；
+    加法不改变相似度的正负次序，不会像乘法那样把负相似度拉向 0。None 表示不加分。
+    """
+    n = block.shape[0]
+    block_scores = np.full(n, -1.0, dtype=np.float32)
+    sim = np.empty(n, dtype=np.float32)
+    # 逐个查询向量计算相似度并原地更新最大值 (内存优化)
+    # 相当于: 对于库里的每首歌，它与我歌单里最像的那首歌有多像？
+    for i, query in enumerate(np.asarray(queries, dtype=np.float32)):
+        # dot product: (N_block, 32) @ (32,) -> (N_block,)
+        np.dot(block, query, out=sim)
+        if bonus is not None:
+            sim += bonus[i]
+        np.maximum(block_scores, sim, out=block_scores)
+    if exclude_local is not None and len(exclude_local):
+        block_scores[exclude_local] = -np.inf
+    top = top_k(block_scores, limit)
+    # 可选行不足 limit 时，被排除的行 (种子) 会进入 Top-K，去掉
+    top = top[np.isfinite(block_scores[top])]
+    return top + offset, block_scores[top]
+
+
+def cluster_seeds(vectors, k, iterations=10, max_bonus=0.0):
+    """
+    种子向量的球面 k-means：把 N 个 (已归一化) 种子压缩为至多 k 个代表向量 (归一化质心)。
+    初始化用确定性的最远点选取 (同一歌单每次结果一致)。
+    返回 (代表向量, 加分)，加分 = max_bonus * 簇大小 / 最大簇大小 (0 到 max_bonus)，大簇的候选略占优势；
+    N <= k 时原样返回，加分为 None。代表向量只用于召回候选，最终排序见 rerank_max_sim。
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    if k <= 0 or n <= k:
+        return vectors, None
+
+    # 最远点初始化：从最接近整体均值的种子开始，依次选与已选中心最不相似的种子
+    first = int(np.argmax(vectors @ vectors.mean(axis=0)))
+    centers_idx = [first]
+    best = vectors @ vectors[first]
+    for _ in range(1, k):
+        nxt = int(np.argmin(best))
+        centers_idx.append(nxt)
+        np.maximum(best, vectors @ vectors[nxt], out=best)
+    centers = vectors[centers_idx].copy()
+
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centers.T, axis=1)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, assign, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # 空簇保留原中心
+        updated = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centers).astype(np.float32)
+        if np.allclose(updated, centers, atol=1e-6):
+            centers = updated
+            break
+        centers = updated
+    assign = np.argmax(vectors @ centers.T, axis=1)
+
+    sizes = np.bincount(assign, minlength=len(centers))
+    keep = sizes > 0
+    bonus = max_bonus * sizes[keep] / sizes.max()
+    return centers[keep], bonus.astype(np.float32)
+
+
+def rerank_max_sim(positions, vectors, seeds, limit):
+    """
+    对召回的候选行 (positions 及其向量 vectors) 按全部种子向量 seeds 精确计算 Max-Sim，返回 (Top-K 行号, 得分)。
+    种子聚类召回的候选经此重排后，只要精确 Top-K 落在候选中，结果即与精确检索一致。
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if not len(positions):
+        return positions, np.array([], dtype=np.float32)
+    exact = (np.asarray(vectors, dtype=np.float32) @ np.asarray(seeds, dtype=np.float32).T).max(axis=1)
+    order = top_k(exact, limit)
+    return positions[order], exact[order]
+
+
+def cluster_cohesion(seeds, centers):
+    """每个种子与最近代表向量的平均余弦相似度：越低说明歌单越分散，代表向量召回的候选越不可靠。"""
+    return float((np.asarray(seeds, dtype=np.float32) @ np.asarray(centers, dtype=np.float32).T).max(axis=1).mean())
+
+
+def local_positions(positions, start, stop):
+    """把全局行号中落在 [start, stop) 的部分转换为块内行号。"""
+    if positions is None:
+        return None
+    positions = np.asarray(positions, dtype=np.int64)
+    return positions[(positions >= start) & (positions < stop)] - start
+
+
+def merge_top_k(parts, limit):
+    """合并多个 (行号, 得分) 的局部 Top-K，得到全局 Top-K。"""
+    parts = [p for p in parts if len(p[0])]
+    if not parts:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    positions = np.concatenate([p for p, _ in parts])
+    scores = np.concatenate([s for _, s in parts])
+    order = top_k(scores, limit)
+    return positions[order], scores[order]
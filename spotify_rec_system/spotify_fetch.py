@@ -0,0 +1,228 @@
+"""
+Spotify Web API 并发抓取层。
+
+- 共享连接池 (requests.Session + HTTPAdapter)，避免每次请求重新握手；
+- 歌单分页：用第一页的 total 计算剩余 offset，并发拉取，而不是串行跟随 next；
+- 全局并发上限 + 429/Retry-After 感知的退避重试；
+- 可选的两级 TTL 缓存 (metadata_cache.TwoTierCache)，歌曲/歌手元数据命中时不发请求。
+
+压测 (对本地 mock 服务器)：
+    python spotify_fetch.py --bench --tracks 1000 --latency-ms 50
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metadata_cache import TwoTierCache
+
+DEFAULT_API_BASE = 'https://api.spotify.com/v1'
+PLAYLIST_PAGE_SIZE = 100
+TRACKS_BATCH_SIZE = 50
+
+
+class SpotifyFetchError(Exception):
+    """Spotify API 请求失败 (重试耗尽或非可重试错误)。"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class SpotifyFetcher:
+    def __init__(self, api_base: Optional[str] = None, max_concurrency: Optional[int] = None,
+                 max_retries: int = 4, timeout: float = 10.0, max_backoff: float = 30.0,
+                 cache: Optional[TwoTierCache] = None, cache_ttl: Optional[float] = None):
+        self.api_base = (api_base or os.getenv('SPOTIFY_API_BASE', DEFAULT_API_BASE)).rstrip('/')
+        self.cache = cache
+        self.cache_ttl = cache_ttl or float(os.getenv('SPOTIFY_META_CACHE_TTL', '86400'))
+        self.user_cache_ttl = 300.0  # 用户信息只放内存，短 TTL
+        self.max_concurrency = max_concurrency or int(os.getenv('SPOTIFY_FETCH_CONCURRENCY', '8'))
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_concurrency * 2, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # 所有调用方共享的在途请求上限 (包括请求线程直接发起的调用)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='spotify-fetch')
+
+    # --- 基础请求 ---
+
+    def _url(self, path: str) -> str:
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.api_base}/{path.lstrip('/')}"
+
+    def get(self, path: str, token: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        url = self._url(path)
+        headers = {'Authorization': f"Bearer {token}"}
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._slots:
+                    resp = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
+            except requests.RequestException as exc:
+                last_error = SpotifyFetchError(f"请求 {url} 失败: {exc}")
+                self._sleep_backoff(attempt)
+                continue
+
+            if resp.status_code == 429:
+                # 限流：优先遵守服务端给出的 Retry-After
+                retry_after = resp.headers.get('Retry-After')
+                try:
+                    delay = float(retry_after) if retry_after is not None else None
+                except ValueError:
+                    delay = None
+                last_error = SpotifyFetchError(f"请求 {url} 被限流 (429)", status=429)
+                if attempt < self.max_retries:
+                    time.sleep(min(delay, self.max_backoff) if delay is not None else self._backoff(attempt))
+                continue
+            if resp.status_code >= 500:
+                last_error = SpotifyFetchError(f"请求 {url} 服务端错误 ({resp.status_code})", status=resp.status_code)
+                self._sleep_backoff(attempt)
+                continue
+            if resp.status_code >= 400:
+                raise SpotifyFetchError(f"请求 {url} 失败 ({resp.status_code}): {resp.text[:200]}", status=resp.status_code)
+            return resp.json() if resp.content else {}
+        raise last_error or SpotifyFetchError(f"请求 {url} 失败")
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.max_backoff, 0.2 * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+    def _sleep_backoff(self, attempt: int):
+        if attempt < self.max_retries:
+            time.sleep(self._backoff(attempt))
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """在共享线程池中异步执行，用于让互不依赖的调用重叠 (例如 current_user 与歌单分页)。"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    # --- 业务接口 ---
+
+    def playlist_items(self, token: str, playlist_id: str) -> List[Dict[str, Any]]:
+        """拉取歌单全部条目：第一页拿到 total 后，其余页按 offset 并发抓取并按顺序拼接。"""
+        path = f"playlists/{playlist_id}/tracks"
+        first = self.get(path, token, params={'limit': PLAYLIST_PAGE_SIZE, 'offset': 0})
+        items = list(first.get('items') or [])
+        total = int(first.get('total') or len(items))
+        offsets = range(len(items), total, PLAYLIST_PAGE_SIZE) if items else []
+        futures = [self.executor.submit(self.get, path, token, {'limit': PLAYLIST_PAGE_SIZE, 'offset': off})
+                   for off in offsets]
+        for future in futures:
+            items.extend(future.result().get('items') or [])
+        return items
+
+    def playlist(self, token: str, playlist_id: str, fields: Optional[str] = None) -> Dict[str, Any]:
+        return self.get(f"playlists/{playlist_id}", token, params={'fields': fields} if fields else None)
+
+    def tracks(self, token: str, track_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """批量获取歌曲信息：先查缓存，只对未命中的 id 发请求 (每批 50 个，批次之间并发)，返回顺序与输入一致。"""
+        hits = self._cache_get('track', track_ids)
+        missing = [tid for tid in dict.fromkeys(track_ids) if tid not in hits]
+        batches = [missing[i:i + TRACKS_BATCH_SIZE] for i in range(0, len(missing), TRACKS_BATCH_SIZE)]
+        futures = [self.executor.submit(self.get, 'tracks', token, {'ids': ','.join(batch)}) for batch in batches]
+        fetched: Dict[str, Optional[Dict[str, Any]]] = {}
+        for batch, future in zip(batches, futures):
+            # 响应与请求 id 一一对应，查无此曲时为 null (同样缓存，避免反复查询)
+            fetched.update(zip(batch, future.result().get('tracks') or []))
+        self._cache_set('track', fetched)
+        hits.update(fetched)
+        return [hits.get(tid) for tid in track_ids]
+
+    def track(self, token: str, track_id: str) -> Dict[str, Any]:
+        cached = self._cache_get('track', [track_id]).get(track_id)
+        if cached:
+            return cached
+        info = self.get(f"tracks/{track_id}", token)
+        self._cache_set('track', {track_id: info})
+        return info
+
+    def artist(self, token: str, artist_id: str) -> Dict[str, Any]:
+        cached = self._cache_get('artist', [artist_id]).get(artist_id)
+        if cached:
+            return cached
+        info = self.get(f"artists/{artist_id}", token)
+        self._cache_set('artist', {artist_id: info})
+        return info
+
+    def current_user(self, token: str) -> Dict[str, Any]:
+        # 以 token 摘要为 key，只放内存缓存 (不把用户信息落盘)
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+        cached = self._cache_get('me', [key]).get(key)
+        if cached:
+            return cached
+        profile = self.get('me', token)
+        self._cache_set('me', {key: profile}, ttl=self.user_cache_ttl, memory_only=True)
+        return profile
+
+    # --- 缓存 ---
+
+    def _cache_get(self, kind: str, ids: List[str]) -> Dict[str, Any]:
+        if self.cache is None or not ids:
+            return {}
+        hits = self.cache.get_many(f"{kind}:{i}" for i in ids)
+        prefix = len(kind) + 1
+        return {k[prefix:]: v for k, v in hits.items()}
+
+    def _cache_set(self, kind: str, items: Dict[str, Any], ttl: Optional[float] = None, memory_only: bool = False):
+        if self.cache is None or not items:
+            return
+        self.cache.set_many({f"{kind}:{k}": v for k, v in items.items()}, ttl or self.cache_ttl, memory_only=memory_only)
+
+    # --- 对照组：模拟 spotipy 的串行 next 翻页 ---
+
+    def playlist_items_serial(self, token: str, playlist_id: str) -> List[Dict[str, Any]]:
+        page = self.get(f"playlists/{playlist_id}/tracks", token, params={'limit': PLAYLIST_PAGE_SIZE})
+        items = list(page.get('items') or [])
+        while page.get('next'):
+            page = self.get(page['next'], token)
+            items.extend(page.get('items') or [])
+        return items
+
+
+def _bench(args):
+    from mock_spotify import MockSpotifyServer
+
+    with MockSpotifyServer(latency_ms=args.latency_ms, tracks_per_playlist=args.tracks,
+                           rate_limit_every=args.rate_limit_every) as server:
+        fetcher = SpotifyFetcher(api_base=server.api_base, max_concurrency=args.concurrency)
+        results = {}
+        for name, fn in (('serial', fetcher.playlist_items_serial), ('concurrent', fetcher.playlist_items)):
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                items = fn('mock-token', 'bench-playlist')
+                timings.append(time.perf_counter() - start)
+            assert len(items) == args.tracks, f"{name}: 期望 {args.tracks} 条，实际 {len(items)} 条"
+            results[name] = {'best_ms': round(min(timings) * 1000, 1), 'mean_ms': round(sum(timings) / len(timings) * 1000, 1)}
+        results['speedup'] = round(results['serial']['best_ms'] / max(results['concurrent']['best_ms'], 1e-6), 2)
+        results['config'] = {'tracks': args.tracks, 'latency_ms': args.latency_ms, 'concurrency': args.concurrency,
+                             'rate_limit_every': args.rate_limit_every}
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Spotify 抓取层压测 (本地 mock 服务器)")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--tracks', type=int, default=1000, help='歌单条目数')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='mock 服务器每个请求的延迟')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='每 N 个请求返回一次 429 (0 表示不限流)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args)
+    else:
+        parser.print_help()
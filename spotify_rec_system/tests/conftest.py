@@ -0,0 +1,38 @@
+"""
+pytest 公共夹具：模块按平铺方式 (import recommender) 导入，这里把 spotify_rec_system/ 加入 sys.path。
+引擎相关用例都在临时目录里用合成歌曲库 + PCA 编码器启动 (秒级)，不触碰 data/ 与 model_cache/。
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset_service import SpotifyDataset  # noqa: E402
+from synthetic_catalog import write_catalog  # noqa: E402
+
+
+@pytest.fixture
+def catalog_env(tmp_path, monkeypatch):
+    """合成歌曲库 + 独立的缓存/入库目录；返回 start()，每次调用相当于一次进程重启。"""
+    csv_path = str(tmp_path / 'catalog.csv')
+    write_catalog(csv_path, 3000, seed=3)
+    monkeypatch.setenv('SPOTIFY_DATASET_PATH', csv_path)
+    monkeypatch.setenv('SPOTIFY_INGEST_DIR', str(tmp_path / 'ingested'))
+    monkeypatch.setenv('RECOMMENDER_CACHE_DIR', str(tmp_path / 'model_cache'))
+    monkeypatch.setenv('RECOMMENDER_ENCODER', 'pca')
+    for name in ('RECOMMENDER_SHARDS', 'RECOMMENDER_SEED_CLUSTERS', 'RECOMMENDER_COLLAPSE_DUPLICATES',
+                 'RECOMMENDER_MEMORY_LEAN', 'RECOMMENDER_SCAN_WORKERS'):
+        monkeypatch.delenv(name, raising=False)
+
+    from recommender import ContentBasedRecommender
+
+    def start(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        SpotifyDataset._instance = None
+        return ContentBasedRecommender()
+
+    yield start
+    SpotifyDataset._instance = None
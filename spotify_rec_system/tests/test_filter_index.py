@@ -0,0 +1,84 @@
+"""FilterIndex 的组合查询与逐行暴力筛选一致，增量维护 (with_rows) 与整表重建一致。"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from filter_index import FilterIndex, exclude_sorted
+from synthetic_catalog import generate_catalog
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    df = generate_catalog(4000, seed=5).rename(columns={'track_id': 'id'}).set_index('id', drop=False)
+    df.loc[df.index[:20], 'popularity'] = np.nan
+    return df
+
+
+def _brute_force(df, genre=None, year_range=None, min_popularity=None):
+    mask = np.ones(len(df), dtype=bool)
+    if genre:
+        wanted = [g.strip().lower() for g in genre.split(',') if g.strip()]
+        names = df['genre'].fillna('').astype(str).str.strip().str.lower()
+        mask &= names.map(lambda name: any(w in name for w in wanted)).to_numpy()
+    years = pd.to_numeric(df['year'], errors='coerce').fillna(-1).to_numpy()
+    popularity = pd.to_numeric(df['popularity'], errors='coerce').fillna(-1).to_numpy()
+    if year_range:
+        low, high = year_range
+        if low is not None:
+            mask &= years >= low
+        if high is not None:
+            mask &= years <= high
+    if min_popularity is not None:
+        mask &= popularity >= min_popularity
+    return np.flatnonzero(mask)
+
+
+QUERIES = [
+    {'genre': 'rock'},
+    {'genre': 'ROCK, jazz'},
+    {'genre': 'no-such-genre'},
+    {'year_range': (2005, 2010)},
+    {'year_range': (None, 2001)},
+    {'min_popularity': 60},
+    {'min_popularity': 0},
+    {'genre': 'pop', 'year_range': (2010, None), 'min_popularity': 30},
+    {'genre': 'house', 'min_popularity': 95},
+]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_eligible_matches_brute_force(catalog, query):
+    np.testing.assert_array_equal(FilterIndex(catalog).eligible(**query), _brute_force(catalog, **query))
+
+
+def test_no_filter_means_whole_catalog(catalog):
+    assert FilterIndex(catalog).eligible() is None
+
+
+def test_with_rows_matches_rebuild(catalog):
+    index = FilterIndex(catalog)
+    df = catalog.copy()
+    df.loc[df.index[[3, 50]], ['genre', 'year', 'popularity']] = [['Brand-New-Genre', 1999, 88], ['rock', 2020, 5]]
+    added = catalog.iloc[[10, 11]].copy()
+    added.index = added['id'] = ['ADDED000000000000001', 'ADDED000000000000002']
+    added['genre'] = ['jazz', 'brand-new-genre']
+    df = pd.concat([df, added])
+    updated = index.with_rows(df, [3, 50, len(catalog), len(catalog) + 1])
+    rebuilt = FilterIndex(df)
+    for query in QUERIES + [{'genre': 'brand-new'}]:
+        np.testing.assert_array_equal(updated.eligible(**query), rebuilt.eligible(**query))
+        np.testing.assert_array_equal(updated.eligible(**query), _brute_force(df, **query))
+    # 旧索引不受影响
+    np.testing.assert_array_equal(index.eligible(genre='rock'), _brute_force(catalog, genre='rock'))
+
+
+def test_most_popular_and_exclusion(catalog):
+    index = FilterIndex(catalog)
+    eligible = index.eligible(genre='rock')
+    top = index.most_popular(eligible, 10)
+    popularity = pd.to_numeric(catalog['popularity'], errors='coerce').fillna(-1).to_numpy()
+    assert sorted(popularity[top], reverse=True) == list(popularity[top])
+    assert popularity[top].min() >= np.sort(popularity[eligible])[-10]
+    seeds = eligible[:5]
+    remaining = exclude_sorted(eligible, seeds)
+    np.testing.assert_array_equal(remaining, eligible[5:])
@@ -0,0 +1,41 @@
+"""歌单候选前沿 (复用 / 增量合并 / 全量) 给出的结果与精确 Max-Sim 扫描一致。"""
+import numpy as np
+
+
+def _ids(records):
+    return [r['id'] for r in records]
+
+
+def test_frontier_matches_exact_scan(catalog_env):
+    engine = catalog_env(RECOMMENDER_FRONTIER_SIZE=200)
+    playlist = [11, 402, 1337]
+    growth = [[2048, 7], [999], [1500, 1501, 1502]]
+    for added in [[]] + growth:
+        playlist = playlist + added
+        seeds = np.array(playlist)
+        expected = _ids(engine.recommend_positions(seeds, limit=30))
+        assert _ids(engine.recommend_positions(seeds, limit=30, frontier_key='p1')) == expected
+        # 种子不变时直接复用前沿
+        assert _ids(engine.recommend_positions(seeds, limit=30, frontier_key='p1')) == expected
+
+        filtered = _ids(engine.recommend_positions(seeds, limit=30, genre='rock'))
+        assert _ids(engine.recommend_positions(seeds, limit=30, genre='rock', frontier_key='p2')) == filtered
+
+    stats = engine.frontier_stats()
+    # 追加歌曲走增量合并，而不是每次全量重算
+    assert stats['incremental'] >= len(growth) and stats['reused'] == len(growth) + 1
+
+    # 删除种子后全量重算
+    seeds = np.array(playlist[1:])
+    assert (_ids(engine.recommend_positions(seeds, limit=30, frontier_key='p1'))
+            == _ids(engine.recommend_positions(seeds, limit=30)))
+
+
+def test_frontier_larger_than_catalog(catalog_env):
+    engine = catalog_env(RECOMMENDER_FRONTIER_SIZE=5000)
+    seeds = np.array([1, 2, 3])
+    records = engine.recommend_positions(seeds, limit=len(engine.df), frontier_key='small')
+    ids = _ids(records)
+    assert len(ids) == len(engine.df) - len(seeds) == len(set(ids))
+    assert not set(ids) & set(engine.df.index[seeds])
+    assert ids[:50] == _ids(engine.recommend_positions(seeds, limit=50))
@@ -0,0 +1,57 @@
+"""增量入库 (数据集增量 + 向量增量) 在重启后仍然生效，且不触发重新训练。"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_service import SpotifyDataset
+from recommender import ContentBasedRecommender
+
+
+def _median_row(df, feature_cols, track_id):
+    """特征取全库中位数：重启时分位截断范围略有变化也不会影响这一行。"""
+    row = df.iloc[[0]].copy()
+    row[feature_cols] = df[feature_cols].median().to_numpy()
+    row['id'] = row.index = [track_id]
+    return row
+
+
+@pytest.fixture
+def ingested(catalog_env):
+    engine = catalog_env()
+    df = engine.df
+    updated_id = df.index[0]
+    before = engine.get_embedding(updated_id).copy()
+
+    delta = _median_row(df, engine.feature_cols, updated_id)
+    added = _median_row(df, engine.feature_cols, 'NEWTRACK0000000000001')
+    added['energy'] = df['energy'].quantile(0.3)
+    rows, _, _ = SpotifyDataset.get_instance().ingest(pd.concat([delta, added]))
+    result = engine.ingest(rows)
+    assert (result['added'], result['updated']) == (1, 1)
+    vectors = {track_id: engine.get_embedding(track_id).copy() for track_id in (updated_id, 'NEWTRACK0000000000001')}
+    return catalog_env, before, vectors
+
+
+def test_ingest_survives_restart_without_retraining(ingested, monkeypatch):
+    start, before, vectors = ingested
+
+    def no_retrain(self):
+        raise AssertionError("重启时不应重新训练")
+    monkeypatch.setattr(ContentBasedRecommender, '_fit_linear_encoder', no_retrain)
+
+    engine = start()
+    assert len(engine.df) == 3001
+    for track_id, vector in vectors.items():
+        np.testing.assert_allclose(engine.get_embedding(track_id), vector, atol=1e-5)
+    updated_id = next(iter(vectors))
+    assert not np.allclose(engine.get_embedding(updated_id), before, atol=1e-3)
+
+
+def test_restart_compacts_embedding_deltas(ingested):
+    start, _, vectors = ingested
+    engine = start()
+    assert engine._embedding_delta_paths() == []
+    # 第二次重启直接命中完整缓存
+    engine = start()
+    for track_id, vector in vectors.items():
+        np.testing.assert_allclose(engine.get_embedding(track_id), vector, atol=1e-5)
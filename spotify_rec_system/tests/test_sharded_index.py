@@ -0,0 +1,120 @@
+"""分片检索与进程内精确 Max-Sim 结果一致；分片时协调方不保留全库向量；版本按引用计数释放。"""
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sharded_index import ShardedIndex, ShardError
+from similarity import max_sim_top_k
+
+
+def _unit_rows(rows, dim=16, seed=0):
+    db = np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+    return db / np.linalg.norm(db, axis=1, keepdims=True)
+
+
+def test_top_k_matches_exact_scan():
+    db = _unit_rows(5000)
+    seeds = np.array([3, 1500, 4999])
+    eligible = np.arange(0, 5000, 7)
+    with ShardedIndex(db, 3) as index:
+        np.testing.assert_allclose(index.vectors(seeds), db[seeds])
+        positions, scores = index.top_k(db[seeds], 20, seeds)
+        exact_positions, exact_scores = max_sim_top_k(db, db[seeds], 20, seeds)
+        np.testing.assert_array_equal(positions, exact_positions)
+        np.testing.assert_allclose(scores, exact_scores, atol=1e-6)
+
+        candidates = eligible[~np.isin(eligible, seeds)]
+        positions, _ = index.top_k(db[seeds], 20, eligible=candidates)
+        top, _ = max_sim_top_k(db[candidates], db[seeds], 20)
+        np.testing.assert_array_equal(positions, candidates[top])
+
+
+def test_versions_are_reference_counted():
+    db = _unit_rows(300)
+    index = ShardedIndex(db, 2)
+    try:
+        extra = _unit_rows(2, seed=1)
+        derived = index.with_rows([5, 300, 301], np.concatenate([db[[0]], extra]))
+        assert derived.n_rows == 302 and index.n_rows == 300
+        np.testing.assert_allclose(derived.vectors([5, 300, 301]), np.concatenate([db[[0]], extra]))
+        # 旧版本不受影响
+        np.testing.assert_allclose(index.vectors([5]), db[[5]])
+
+        assert index.acquire()
+        index.retire()
+        assert not index.acquire()
+        np.testing.assert_allclose(index.vectors([5]), db[[5]])  # 进行中的检索仍可用
+        index.release()
+        with pytest.raises(ShardError):
+            index.vectors([5])
+        assert not derived.closed
+
+        derived.retire()
+        assert derived.closed
+    finally:
+        index.close()
+
+
+@pytest.fixture
+def engines(catalog_env):
+    local = catalog_env()
+    sharded = catalog_env(RECOMMENDER_SHARDS=2)
+    yield local, sharded
+    sharded.close()
+
+
+def test_sharded_engine_matches_local_engine(engines):
+    local, sharded = engines
+    assert sharded.embeddings is None and sharded._index.embeddings_norm is None
+    assert sharded.scaled_features is None
+    seeds = np.array([10, 20, 30, 40])
+    for filters in ({}, {'genre': 'rock'}, {'min_popularity': 40}):
+        expected = [r['id'] for r in local.recommend_positions(seeds, limit=15, **filters)]
+        got = [r['id'] for r in sharded.recommend_positions(seeds, limit=15, **filters)]
+        assert got == expected
+    track_id = local.df.index[7]
+    np.testing.assert_allclose(sharded.get_embedding(track_id), local.get_embedding(track_id), atol=1e-6)
+
+
+def test_sharded_engine_ingest(engines):
+    local, sharded = engines
+    rows = local.df.iloc[[0]].copy()
+    rows[local.feature_cols] = local.df[local.feature_cols].iloc[[5]].to_numpy()
+    added = rows.copy()
+    added.index = added['id'] = ['NEWTRACK0000000000002']
+    delta = pd.concat([rows, added])
+    previous = sharded._index
+    for engine in engines:
+        engine.ingest(delta)
+    assert previous.shards.closed is False and not previous.shards.acquire()
+    seeds = np.array([0, 5, 50])
+    assert ([r['id'] for r in sharded.recommend_positions(seeds, limit=10)]
+            == [r['id'] for r in local.recommend_positions(seeds, limit=10)])
+    np.testing.assert_allclose(sharded.get_embedding('NEWTRACK0000000000002'),
+                               local.get_embedding('NEWTRACK0000000000002'), atol=1e-6)
+
+
+def test_broken_connection_is_replaced():
+    db = _unit_rows(400)
+    with ShardedIndex(db, 2, connections=1, request_timeout=2.0) as index:
+        channel = index._pool._channels.queue[0]
+        channel[1].close()  # 模拟连接在扇出途中断开
+        with pytest.raises(ShardError):
+            index.top_k(db[[0]], 5)
+        # 通道已重新连接，后续请求正常
+        np.testing.assert_allclose(index.vectors([1, 399]), db[[1, 399]])
+
+
+def test_dead_worker_fails_fast_instead_of_hanging():
+    db = _unit_rows(400)
+    with ShardedIndex(db, 2, connections=2, request_timeout=1.0) as index:
+        index._pool._procs[0].kill()
+        index._pool._procs[0].wait()
+        for _ in range(4):
+            start = time.perf_counter()
+            with pytest.raises(ShardError):
+                index.top_k(db[[0]], 5)
+            assert time.perf_counter() - start < 5.0
+        index.retire()  # 丢弃版本 (drop) 同样不会阻塞
@@ -0,0 +1,119 @@
+"""SingleFlight 合并同时在途的相同调用；recommend_positions 给每个调用方独立的记录副本。"""
+import threading
+
+import numpy as np
+
+from singleflight import SingleFlight
+
+
+def _run_concurrently(flight, key, fn, callers):
+    results = [None] * callers
+    errors = []
+
+    def call(i):
+        try:
+            results[i] = flight.do(key, fn)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(timeout=10)
+        return ['result']
+
+    threading.Timer(0.3, release.set).start()
+    results, errors = _run_concurrently(flight, 'k', compute, 8)
+    assert not errors and len(calls) == 1
+    assert sum(shared for _, shared in results) == 7
+    assert all(result is results[0][0] for result, _ in results)
+    assert flight.stats() == {'inflight': 0, 'executed': 1, 'coalesced': 7}
+
+    # 不缓存结果：结束后再次调用会重新计算
+    flight.do('k', compute)
+    assert len(calls) == 2
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(timeout=10)
+        raise ValueError('boom')
+
+    threading.Timer(0.3, release.set).start()
+    results, errors = _run_concurrently(flight, 'k', fail, 4)
+    assert len(errors) == 4 and all(isinstance(e, ValueError) for e in errors)
+    assert flight.stats()['inflight'] == 0
+
+
+def test_recommend_positions_copies_records_per_caller(catalog_env, monkeypatch):
+    engine = catalog_env()
+    original = engine._score_positions
+    release = threading.Event()
+
+    def slow_score(*args, **kwargs):
+        release.wait(timeout=10)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(engine, '_score_positions', slow_score)
+    seeds = np.array([5, 6, 7])
+    results = [None] * 4
+
+    def call(i):
+        results[i] = engine.recommend_positions(seeds, limit=10)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    threading.Timer(0.3, release.set).start()
+    for t in threads:
+        t.join(timeout=10)
+
+    assert engine.inflight_stats()['executed'] == 1
+    assert all([r['id'] for r in result] == [r['id'] for r in results[0]] for result in results)
+    results[0][0]['track_name'] = 'changed'
+    assert all(result[0] is not results[0][0] and result[0]['track_name'] != 'changed' for result in results[1:])
+
+
+def test_frontier_and_clustered_requests_are_not_coalesced(catalog_env, monkeypatch):
+    engine = catalog_env(RECOMMENDER_SEED_CLUSTERS=2)
+    seeds = np.array([5, 60, 700, 1200, 2100, 2900])
+    exact = [r['id'] for r in catalog_env(RECOMMENDER_SEED_CLUSTERS=0).recommend_positions(seeds, limit=10)]
+    original = engine._score_positions
+    release = threading.Event()
+
+    def slow_score(*args, **kwargs):
+        release.wait(timeout=10)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(engine, '_score_positions', slow_score)
+    keys = [None, 'playlist', None, 'playlist']
+    results = [None] * len(keys)
+
+    def call(i):
+        results[i] = engine.recommend_positions(seeds, limit=10, frontier_key=keys[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(keys))]
+    for t in threads:
+        t.start()
+    threading.Timer(0.3, release.set).start()
+    for t in threads:
+        t.join(timeout=10)
+
+    # 聚类 (近似) 与前沿 (精确) 各算一次，相同路径的请求才合并
+    assert engine.inflight_stats() == {'inflight': 0, 'executed': 2, 'coalesced': 2}
+    assert [r['id'] for r in results[1]] == [r['id'] for r in results[3]] == exact